@@ -0,0 +1,95 @@
+"""
+Show the SQLite query plan and the time of the listing queries of the
+``SQLAStorage`` on 100k posts, on a post table without the indexes of the
+listing queries, as created by earlier versions, and after adding them with
+``SQLAStorage.create_indexes``.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/query_plan.py
+"""
+from __future__ import print_function
+import datetime
+import os
+import tempfile
+import timeit
+import sqlalchemy as sqla
+from flask_blogging.sqlastorage import SQLAStorage
+
+NUM_POSTS = 100000
+
+
+def read_posts():
+    post_date = datetime.datetime(2010, 1, 1)
+    for i in range(NUM_POSTS):
+        date = post_date + datetime.timedelta(minutes=i)
+        yield dict(title="Title%d" % i, text="Sample Text%d" % i,
+                   user_id="user%d" % (i % 10), tags=["tag%d" % (i % 20)],
+                   draft=i % 10 == 0, post_date=date,
+                   last_modified_date=date)
+
+
+def capture_statements(engine, func):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, *args):
+        statements.append((statement, parameters))
+    sqla.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        func()
+    finally:
+        sqla.event.remove(engine, "before_cursor_execute",
+                          before_cursor_execute)
+    return statements
+
+
+def show_plans(storage, queries):
+    engine = storage.engine
+    for name, func in queries:
+        seconds = min(timeit.repeat(func, number=10, repeat=3)) / 10
+        print("%s: %.2f ms" % (name, seconds * 1000))
+        statement, parameters = capture_statements(engine, func)[0]
+        with engine.connect() as conn:
+            plan = conn.execute("EXPLAIN QUERY PLAN " + statement,
+                                parameters).fetchall()
+        for row in plan:
+            print("    " + row[-1])
+
+
+def main():
+    dbfile = os.path.join(tempfile.gettempdir(), "query_plan.db")
+    if os.path.exists(dbfile):
+        os.remove(dbfile)
+    engine = sqla.create_engine("sqlite:///" + dbfile)
+    metadata = sqla.MetaData()
+    storage = SQLAStorage(engine, metadata=metadata)
+    metadata.create_all(bind=engine)
+    # drop the indexes to get the post table of an earlier version
+    for index in storage.post_table.indexes:
+        index.drop(bind=engine)
+    storage = SQLAStorage(engine, metadata=sqla.MetaData())
+    storage.save_posts(read_posts())
+
+    queries = [
+        ("index page", lambda: storage.get_posts(count=10, offset=0,
+                                                 summary=True)),
+        ("last page", lambda: storage.get_posts(count=10, offset=89990,
+                                                summary=True)),
+        ("drafts page", lambda: storage.get_posts(count=10,
+                                                  include_draft=True,
+                                                  summary=True)),
+        ("tag page", lambda: storage.get_posts(count=10, tag="tag3",
+                                               summary=True)),
+    ]
+    print("before, %d posts" % NUM_POSTS)
+    show_plans(storage, queries)
+    print("created %s" % ", ".join(storage.create_indexes()))
+    with engine.connect() as conn:
+        conn.execute("ANALYZE")
+    print("after")
+    show_plans(storage, queries)
+    os.remove(dbfile)
+
+
+if __name__ == "__main__":
+    main()
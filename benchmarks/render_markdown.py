@@ -0,0 +1,54 @@
+"""
+Compare the cost of rendering a typical 2 KB post with a new ``Markdown``
+object per post against the per thread ``Markdown`` object of the
+``PostProcessor``. The render cache is disabled to measure the markdown
+conversion itself.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/render_markdown.py
+"""
+from __future__ import print_function
+import timeit
+import markdown
+from flask_blogging import PostProcessor
+
+paragraph = """Flask-Blogging renders *Markdown* posts with [links][1],
+`inline code` and inline math such as $e^{i\\pi} + 1 = 0$, which makes up
+a **typical** paragraph of a post.
+
+"""
+
+POST_TEXT = "Title: Benchmark\nTags: markdown\n\n## A heading\n\n" + \
+    paragraph * 12 + "    :::python\n    print('Hello, World')\n\n" + \
+    "[1]: http://flask-blogging.readthedocs.org/\n"
+
+
+def render_new_instance():
+    md = markdown.Markdown(extensions=PostProcessor.all_extensions())
+    return md.convert(POST_TEXT), md.Meta
+
+
+def render_thread_local():
+    md = PostProcessor.get_markdown()
+    return md.convert(POST_TEXT), md.Meta
+
+
+def main(number=100, repeat=20):
+    PostProcessor.set_render_cache(max_entries=0)
+    assert render_new_instance() == render_thread_local()
+    print("post size: %d bytes" % len(POST_TEXT))
+    funcs = (render_new_instance, render_thread_local)
+    timings = dict((func, []) for func in funcs)
+    # interleave the runs, so that both see the same machine load
+    for _ in range(repeat):
+        for func in funcs:
+            timings[func].append(timeit.timeit(func, number=number))
+    best = [min(timings[func]) / number * 1e6 for func in funcs]
+    for func, microseconds in zip(funcs, best):
+        print("%-20s %8.1f us/post" % (func.__name__, microseconds))
+    print("%-20s %8.1f us/post" % ("saving", best[0] - best[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+from .cachedstorage import CachedStorage
 from .engine import BloggingEngine
 from .processor import PostProcessor
 from .sqlastorage import SQLAStorage
@@ -0,0 +1,312 @@
+"""
+An asyncio version of the ``SQLAStorage``, for the applications that run on
+an async stack. It needs Python 3.7 or later and the asyncio extension of
+SQLAlchemy 1.4 or later, so it is not imported by ``flask_blogging``::
+
+    from flask_blogging.asyncsqlastorage import AsyncSQLAStorage
+"""
+import asyncio
+import contextlib
+import copy
+import itertools
+import logging
+from sqlalchemy.ext.asyncio import AsyncEngine
+from .sqlastorage import SQLAStorage
+
+
+class _ConnectionEngine(object):
+    """
+    An engine like object over a single connection, so that the methods of
+    the ``SQLAStorage`` run on the connection of a ``run_sync`` call.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.dialect = conn.dialect
+
+    @contextlib.contextmanager
+    def begin(self):
+        yield self.conn
+
+    connect = begin
+
+
+class AsyncSQLAStorage(object):
+    """
+    The ``AsyncSQLAStorage`` mirrors the interface of the ``Storage`` class
+    with coroutines. The queries are the ones of the ``SQLAStorage``, which
+    are run with ``AsyncConnection.run_sync`` on the connections of an
+    ``AsyncEngine``, so that the I/O does not block the event loop.
+    """
+    _logger = logging.getLogger("flask-blogging")
+
+    def __init__(self, engine, table_prefix="", metadata=None):
+        """
+        The constructor for the ``AsyncSQLAStorage`` class. The tables are
+        reflected, and the missing ones created, on the first query, like
+        with ``SQLAStorage(lazy=True)``.
+
+        :param engine: The ``AsyncEngine`` instance created by calling
+         ``create_async_engine``, such as with the ``sqlite+aiosqlite`` or
+         the ``postgresql+asyncpg`` dialects.
+        :type engine: object
+        :param table_prefix: (Optional) Prefix to use for the tables created
+         (default ``""``).
+        :type table_prefix: str
+        :param metadata: (Optional) The SQLAlchemy MetaData object
+        :type metadata: object
+        """
+        if not isinstance(engine, AsyncEngine):
+            raise ValueError("engine must be an AsyncEngine")
+        self._engine = engine
+        # builds and runs the queries on the connections of ``run_sync``
+        self._storage = SQLAStorage(engine.sync_engine,
+                                    table_prefix=table_prefix,
+                                    metadata=metadata, lazy=True)
+        self._initialized = False
+        self._init_lock = None
+
+    @property
+    def metadata(self):
+        return self._storage.metadata
+
+    @property
+    def engine(self):
+        return self._engine
+
+    @property
+    def storage(self):
+        return self._storage
+
+    async def save_post(self, title, text, user_id, tags, draft=False,
+                        post_date=None, last_modified_date=None,
+                        meta_data=None, post_id=None, rendered_text=None,
+                        render_version=None, excerpt_html=None):
+        """
+        Persist the blog post data, like ``SQLAStorage.save_post``.
+
+        :return: The post_id value, in case of a successful insert or update.
+         Return ``None`` if there were errors.
+        """
+        return await self._run(lambda storage, conn: storage.save_post(
+            title, text, user_id, tags, draft=draft, post_date=post_date,
+            last_modified_date=last_modified_date, meta_data=meta_data,
+            post_id=post_id, rendered_text=rendered_text,
+            render_version=render_version, excerpt_html=excerpt_html))
+
+    async def save_posts(self, posts, chunk_size=1000):
+        """
+        Insert many new posts, one transaction per chunk of ``chunk_size``
+        posts, like ``SQLAStorage.save_posts``.
+
+        :return: The number of posts that were inserted.
+        """
+        posts = iter(posts)
+        saved = 0
+        while True:
+            chunk = list(itertools.islice(posts, chunk_size))
+            if not chunk:
+                break
+            try:
+                # the exceptions roll back the transaction of the chunk
+                await self._run(lambda storage, conn:
+                                storage._insert_posts(chunk, conn))
+            except Exception as e:
+                self._logger.exception(str(e))
+                break
+            saved += len(chunk)
+        return saved
+
+    async def get_post_by_id(self, post_id):
+        """
+        Fetch the blog post given by ``post_id``.
+
+        :return: If the ``post_id`` is valid, the post data is retrieved, else
+         returns ``None``.
+        """
+        return await self._run(
+            lambda storage, conn: storage.get_post_by_id(post_id))
+
+    async def get_posts(self, count=10, offset=0, recent=True, tag=None,
+                        user_id=None, include_draft=False, before=None,
+                        after=None, summary=False):
+        """
+        Get posts given by filter criteria, like ``SQLAStorage.get_posts``.
+
+        :return: A list of posts, with each element a dict containing values
+         for the following keys: (title, text, draft, post_date,
+         last_modified_date). If count is ``None``, then all the posts are
+         returned.
+        """
+        return await self._run(lambda storage, conn: storage.get_posts(
+            count=count, offset=offset, recent=recent, tag=tag,
+            user_id=user_id, include_draft=include_draft, before=before,
+            after=after, summary=summary))
+
+    async def get_posts_and_count(self, count=10, offset=0, recent=True,
+                                  tag=None, user_id=None,
+                                  include_draft=False, before=None,
+                                  after=None, summary=False):
+        """
+        Get the posts for a page of a listing, along with the number of posts
+        for the filter, with the two queries running concurrently on
+        separate connections.
+
+        :return: A tuple of the list of posts, as returned by ``get_posts``,
+         and the number of posts, as returned by ``count_posts``.
+        """
+        posts, num_posts = await asyncio.gather(
+            self.get_posts(count=count, offset=offset, recent=recent,
+                           tag=tag, user_id=user_id,
+                           include_draft=include_draft, before=before,
+                           after=after, summary=summary),
+            self.count_posts(tag=tag, user_id=user_id,
+                             include_draft=include_draft))
+        return posts, num_posts
+
+    async def iter_posts(self, count=None, recent=True, tag=None,
+                         user_id=None, include_draft=False, batch_size=100,
+                         summary=False):
+        """
+        Asynchronously iterate over the posts for the given filter, fetching
+        ``batch_size`` posts at a time.
+
+        :return: An async iterator of posts, like the ones returned by
+         ``get_posts``.
+        """
+        offset = 0
+        while count is None or offset < count:
+            limit = batch_size if count is None else \
+                min(batch_size, count - offset)
+            posts = await self.get_posts(count=limit, offset=offset,
+                                         recent=recent, tag=tag,
+                                         user_id=user_id,
+                                         include_draft=include_draft,
+                                         summary=summary)
+            for post in posts:
+                yield post
+            if len(posts) < limit:
+                break
+            offset += limit
+
+    async def iter_sitemap_entries(self, count=None, offset=0,
+                                   batch_size=1000):
+        """
+        Asynchronously iterate over the published posts listed in the
+        sitemap, like ``SQLAStorage.iter_sitemap_entries``.
+
+        :return: An async iterator of dicts with the ``post_id``, ``title``
+         and ``last_modified_date`` of the posts.
+        """
+        fetched = 0
+        while count is None or fetched < count:
+            limit = batch_size if count is None else \
+                min(batch_size, count - fetched)
+            entries = await self._run(
+                lambda storage, conn: list(storage.iter_sitemap_entries(
+                    count=limit, offset=offset + fetched, batch_size=limit)))
+            for entry in entries:
+                yield entry
+            if len(entries) < limit:
+                break
+            fetched += limit
+
+    async def count_posts(self, tag=None, user_id=None, include_draft=False):
+        """
+        Returns the total number of posts for the give filter.
+        """
+        return await self._run(lambda storage, conn: storage.count_posts(
+            tag=tag, user_id=user_id, include_draft=include_draft))
+
+    async def get_last_modified(self, post_id=None, tag=None, user_id=None,
+                                include_draft=False):
+        """
+        Get a cheap summary of the posts for the given filter, like
+        ``SQLAStorage.get_last_modified``.
+
+        :return: A dict with the ``last_modified_date``, the ``max_post_id``
+         and the ``count`` of the posts, or ``None`` if there were errors.
+        """
+        return await self._run(lambda storage, conn:
+                               storage.get_last_modified(
+                                   post_id=post_id, tag=tag, user_id=user_id,
+                                   include_draft=include_draft))
+
+    async def delete_post(self, post_id):
+        """
+        Delete the post defined by ``post_id``.
+
+        :return: Returns True if the post was successfully deleted and False
+         otherwise.
+        """
+        return await self._run(
+            lambda storage, conn: storage.delete_post(post_id))
+
+    async def update_rendered_text(self, post_id, rendered_text, meta_data,
+                                   render_version, excerpt_html=None):
+        """
+        Persist the rendered html of a post whose stored rendering was missing
+        or stale.
+
+        :return: Returns True if the rendered text was saved and False
+         otherwise.
+        """
+        return await self._run(lambda storage, conn:
+                               storage.update_rendered_text(
+                                   post_id, rendered_text, meta_data,
+                                   render_version, excerpt_html=excerpt_html))
+
+    async def get_stale_posts(self, render_version, count=100):
+        """
+        Get the posts whose rendered text is missing, or was not persisted
+        with the given ``render_version``.
+        """
+        return await self._run(lambda storage, conn:
+                               storage.get_stale_posts(render_version,
+                                                       count=count))
+
+    async def rebuild_post_counts(self):
+        """
+        Rebuild the ``post_counts`` table, like
+        ``SQLAStorage.rebuild_post_counts``.
+        """
+        return await self._run(
+            lambda storage, conn: storage.rebuild_post_counts())
+
+    async def create_indexes(self):
+        """
+        Create the indexes of the post table that are missing in the
+        database, like ``SQLAStorage.create_indexes``.
+        """
+        return await self._run(
+            lambda storage, conn: storage.create_indexes())
+
+    @staticmethod
+    def normalize_tags(tags):
+        return SQLAStorage.normalize_tags(tags)
+
+    async def _initialize(self):
+        # the lock is created here, in the event loop that uses the storage
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if not self._initialized:
+                async with self._engine.begin() as conn:
+                    tables = await conn.run_sync(self._storage._load_tables)
+                self._storage._publish_tables(tables)
+                self._initialized = True
+
+    async def _run(self, func):
+        """
+        Run ``func(storage, conn)`` in a transaction, with a copy of the
+        ``SQLAStorage`` whose engine is the connection of ``run_sync``.
+        """
+        if not self._initialized:
+            await self._initialize()
+        async with self._engine.begin() as conn:
+            return await conn.run_sync(self._call, func)
+
+    def _call(self, conn, func):
+        storage = copy.copy(self._storage)
+        storage._engine = _ConnectionEngine(conn)
+        return func(storage, conn)
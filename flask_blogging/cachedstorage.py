@@ -0,0 +1,240 @@
+try:
+    from builtins import str
+except ImportError:
+    pass
+import copy
+import hashlib
+import uuid
+from .storage import Storage
+from .utils import LRUCache
+
+
+class CachedStorage(Storage):
+    """
+    The ``CachedStorage`` wraps any ``Storage`` with a read through cache of
+    the posts, and of the post ids of the ``get_posts`` listings. The writes
+    through the ``CachedStorage`` invalidate the cached post, and the
+    listings of the index, the tags and the authors of the post.
+
+    The listings are cached with version tokens of their tag and author,
+    like the cached views, so a write invalidates the listings of a tag
+    without knowing their cache keys. The writes made by other processes are
+    only seen once the entries expire after ``timeout`` seconds, unless the
+    processes share the ``cache``.
+    """
+
+    def __init__(self, storage, cache=None, timeout=60):
+        """
+        The constructor for the ``CachedStorage`` class.
+
+        :param storage: The storage to cache
+        :type storage: Storage
+        :param cache: (Optional) The cache object, with the ``get``, ``set``
+         and ``delete`` methods of the ``werkzeug`` and ``Flask-Cache``
+         caches. (default an ``LRUCache`` of 1000 entries)
+        :type cache: object
+        :param timeout: (Optional) The number of seconds after which the
+         cached entries expire (default 60)
+        :type timeout: int
+        """
+        self._storage = storage
+        self._cache = cache if cache is not None else \
+            LRUCache(max_entries=1000)
+        self._timeout = timeout
+
+    def __getattr__(self, name):
+        # the attributes specific to the wrapped storage, such as the engine
+        # and the tables of the SQLAStorage
+        if "_storage" not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self._storage, name)
+
+    @property
+    def storage(self):
+        return self._storage
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def save_post(self, title, text, user_id, tags, draft=False,
+                  post_date=None, last_modified_date=None, meta_data=None,
+                  post_id=None, rendered_text=None, render_version=None,
+                  excerpt_html=None):
+        old_post = self.get_post_by_id(post_id) \
+            if post_id is not None else None
+        pid = self._storage.save_post(
+            title, text, user_id, tags, draft=draft, post_date=post_date,
+            last_modified_date=last_modified_date, meta_data=meta_data,
+            post_id=post_id, **self._set_options(
+                rendered_text=rendered_text, render_version=render_version,
+                excerpt_html=excerpt_html))
+        if pid is not None:
+            self._invalidate(pid, [old_post or {},
+                                   dict(tags=tags, user_id=user_id)])
+        return pid
+
+    def save_posts(self, posts, chunk_size=1000):
+        try:
+            return self._storage.save_posts(posts, chunk_size=chunk_size)
+        finally:
+            # the listings of all the tags and authors are invalidated
+            self._cache.delete(self._version_key("all"))
+
+    def update_rendered_text(self, post_id, rendered_text, meta_data,
+                             render_version, excerpt_html=None):
+        status = self._storage.update_rendered_text(
+            post_id, rendered_text, meta_data, render_version,
+            excerpt_html=excerpt_html)
+        if status:
+            # the listings only cache the post ids
+            self._delete_post_entries(post_id)
+        return status
+
+    def get_stale_posts(self, render_version, count=100):
+        return self._storage.get_stale_posts(render_version, count=count)
+
+    def get_post_by_id(self, post_id):
+        key = self._post_key(post_id, summary=False)
+        post = self._cache.get(key)
+        if post is None:
+            post = self._storage.get_post_by_id(post_id)
+            if post is None:
+                return None
+            self._set(key, post)
+        return copy.deepcopy(post)
+
+    def get_posts(self, count=10, offset=0, recent=True, tag=None,
+                  user_id=None, include_draft=False, before=None, after=None,
+                  summary=False):
+        dependencies = self._get_dependencies(tag, user_id)
+        key = self._listing_key(
+            "posts", dependencies,
+            (count, offset, recent, tag, user_id, include_draft, before,
+             after, summary))
+        post_ids = self._cache.get(key)
+        if post_ids is not None:
+            posts = [self._cache.get(self._post_key(post_id, summary))
+                     for post_id in post_ids]
+            if all(post is not None for post in posts):
+                return copy.deepcopy(posts)
+        posts = self._storage.get_posts(
+            count=count, offset=offset, recent=recent, tag=tag,
+            user_id=user_id, include_draft=include_draft,
+            **self._set_options(before=before, after=after, summary=summary))
+        for post in posts:
+            self._set(self._post_key(post["post_id"], summary), post)
+        self._set(key, [post["post_id"] for post in posts])
+        return copy.deepcopy(posts)
+
+    def iter_posts(self, count=None, recent=True, tag=None, user_id=None,
+                   include_draft=False, batch_size=100, summary=False):
+        return self._storage.iter_posts(
+            count=count, recent=recent, tag=tag, user_id=user_id,
+            include_draft=include_draft, batch_size=batch_size,
+            **self._set_options(summary=summary))
+
+    def iter_sitemap_entries(self, count=None, offset=0, batch_size=1000):
+        return self._storage.iter_sitemap_entries(
+            count=count, offset=offset, batch_size=batch_size)
+
+    def count_posts(self, tag=None, user_id=None, include_draft=False):
+        dependencies = self._get_dependencies(tag, user_id)
+        key = self._listing_key("count", dependencies,
+                                (tag, user_id, include_draft))
+        result = self._cache.get(key)
+        if result is None:
+            result = self._storage.count_posts(tag=tag, user_id=user_id,
+                                               include_draft=include_draft)
+            self._set(key, result)
+        return result
+
+    def get_last_modified(self, post_id=None, tag=None, user_id=None,
+                          include_draft=False):
+        return self._storage.get_last_modified(
+            post_id=post_id, tag=tag, user_id=user_id,
+            include_draft=include_draft)
+
+    def use_primary(self, primary=True):
+        self._storage.use_primary(primary)
+
+    def bind_connection(self):
+        self._storage.bind_connection()
+
+    def release_connection(self):
+        self._storage.release_connection()
+
+    def delete_post(self, post_id):
+        old_post = self.get_post_by_id(post_id)
+        status = self._storage.delete_post(post_id)
+        if status:
+            self._invalidate(post_id, [old_post or {}])
+        return status
+
+    def accepts_argument(self, method, argument):
+        return self._storage.accepts_argument(method, argument)
+
+    @staticmethod
+    def _set_options(**options):
+        # the arguments added to the storage methods are only passed when
+        # they are set, as the storages of earlier versions lack them
+        return dict((name, value) for name, value in options.items()
+                    if value is not None and value is not False)
+
+    def _set(self, key, value):
+        self._cache.set(key, copy.deepcopy(value), timeout=self._timeout)
+
+    def _get_dependencies(self, tag, user_id):
+        dependencies = ["all"]
+        if tag:
+            dependencies.append("tag:%s" % self.normalize_tags([tag])[0])
+        if user_id:
+            dependencies.append("author:%s" % user_id)
+        if not tag and not user_id:
+            dependencies.append("index")
+        return dependencies
+
+    def _invalidate(self, post_id, posts):
+        """
+        Invalidate the cached post, and the listings of the index and of the
+        tags and the authors of the old and the new versions of the post.
+        """
+        self._delete_post_entries(post_id)
+        dependencies = set(["index"])
+        for post in posts:
+            for tag in self.normalize_tags(post.get("tags") or []):
+                dependencies.add("tag:%s" % tag)
+            if post.get("user_id") is not None:
+                dependencies.add("author:%s" % post["user_id"])
+        for dependency in dependencies:
+            self._cache.delete(self._version_key(dependency))
+
+    def _delete_post_entries(self, post_id):
+        self._cache.delete(self._post_key(post_id, summary=False))
+        self._cache.delete(self._post_key(post_id, summary=True))
+
+    @staticmethod
+    def _post_key(post_id, summary):
+        return "blogging:storage:%s:%s" % (
+            "summary" if summary else "post", post_id)
+
+    @staticmethod
+    def _version_key(dependency):
+        return "blogging:storage:version:%s" % dependency
+
+    def _listing_key(self, kind, dependencies, args):
+        """
+        The cache key of a listing, which changes along with the version
+        token of each of its ``dependencies``.
+        """
+        versions = []
+        for dependency in dependencies:
+            version_key = self._version_key(dependency)
+            version = self._cache.get(version_key)
+            if version is None:
+                version = uuid.uuid4().hex
+                self._cache.set(version_key, version)
+            versions.append(version)
+        digest = hashlib.sha1(
+            repr((args, versions)).encode("utf-8")).hexdigest()
+        return "blogging:storage:%s:%s" % (kind, digest)
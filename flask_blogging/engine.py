@@ -2,10 +2,16 @@
 The BloggingEngine module.
 """
 try:
-    from builtins import object
+    from builtins import object, str
 except ImportError:
     pass
+from flask import g, has_app_context
+try:
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+except ImportError:  # Python 2 without the futures backport
+    ThreadPoolExecutor = ProcessPoolExecutor = None
 from .processor import PostProcessor
+from .utils import LRUCache
 from flask_principal import Principal, Permission, RoleNeed
 from .signals import engine_initialised, post_processed, blueprint_created
 
@@ -28,7 +34,7 @@ class BloggingEngine(object):
         blog_engine = BloggingEngine(app, storage)
     """
     def __init__(self, app=None, storage=None, post_processor=None,
-                 extensions=None, cache=None):
+                 extensions=None, cache=None, render_executor=None):
         """
 
         :param app: Optional app to use
@@ -44,17 +50,24 @@ class BloggingEngine(object):
         :type extensions: list
         :param cache: (Optional) A Flask-Cache object to enable caching
         :type cache: Object
+        :param render_executor: (Optional) A ``concurrent.futures`` executor
+         to render the markdown of the posts of a page concurrently. If none
+         provided, one is created as per ``BLOGGING_RENDER_WORKERS``.
+        :type render_executor: object
         :return:
         """
         self.app = None
         self.storage = storage
         self.cache = cache
+        self.render_executor = render_executor
         self._blogger_permission = None
         self.post_processor = PostProcessor() if post_processor is None \
             else post_processor
         if extensions:
             self.post_processor.set_custom_extensions(extensions)
         self.user_callback = None
+        self.user_batch_callback = None
+        self._user_name_cache = None
 
         if app is not None and storage is not None:
             self.init_app(app, storage)
@@ -85,6 +98,19 @@ class BloggingEngine(object):
         self.config = self.app.config
         self.storage = storage or self.storage
         self.cache = cache or self.cache
+        self.post_processor.set_render_cache(
+            max_entries=self.config.get("BLOGGING_RENDER_CACHE_SIZE", 1000),
+            max_bytes=self.config.get("BLOGGING_RENDER_CACHE_BYTES",
+                                      32 * 1024 * 1024))
+        self.post_processor.set_excerpt_blocks(
+            self.config.get("BLOGGING_EXCERPT_BLOCKS", 2))
+        user_name_timeout = self.config.get(
+            "BLOGGING_USER_NAME_CACHE_TIMEOUT")
+        self._user_name_cache = LRUCache(
+            max_entries=1000, default_timeout=user_name_timeout) \
+            if user_name_timeout else None
+        if self.render_executor is None:
+            self.render_executor = self._create_render_executor(self.config)
         self._register_plugins(self.app, self.config)
 
         from .views import create_blueprint
@@ -99,6 +125,15 @@ class BloggingEngine(object):
         self.principal = Principal(self.app)
         engine_initialised.send(self.app, engine=self)
 
+    @classmethod
+    def _create_render_executor(cls, config):
+        workers = config.get("BLOGGING_RENDER_WORKERS", 0)
+        if not workers or ThreadPoolExecutor is None:
+            return None
+        if config.get("BLOGGING_RENDER_EXECUTOR", "thread") == "process":
+            return ProcessPoolExecutor(max_workers=workers)
+        return ThreadPoolExecutor(max_workers=workers)
+
     @property
     def blogger_permission(self):
         if self._blogger_permission is None:
@@ -119,15 +154,110 @@ class BloggingEngine(object):
         self.user_callback = callback
         return callback
 
+    def user_loader_batch(self, callback):
+        """
+        The decorator for loading the authors of many posts in one call, such
+        as with one database query, instead of calling the ``user_loader``
+        once per post.
+
+        :param callback: The callback function that loads the users given a
+         list of unicode ``user_id`` values, and returns a dict of the users
+         by ``user_id``. The keys are compared as strings, so they can also
+         be the integer ids of the users. The users that are not found can
+         be left out.
+        :return: The callback function
+        """
+        self.user_batch_callback = callback
+        return callback
+
     def is_user_blogger(self):
         return self.blogger_permission.require().can()
 
     def get_posts(self, count=10, offset=0, recent=True, tag=None,
                   user_id=None, include_draft=False, render=False):
-        posts = self.storage(count, offset, recent, tag, user_id,
-                             include_draft)
+        posts = self.storage.get_posts(count, offset, recent, tag, user_id,
+                                       include_draft)
+        self.process_posts(posts, render=render)
+        return posts
+
+    def process_posts(self, posts, render=True):
+        """
+        Process the posts of a page, resolving the names of all their
+        authors at once before processing each post.
+
+        :param posts: The list of dictionaries representing the posts
+        :type posts: list
+        :param render: Choice if the markdown text has to be converted or not
+        :type render: bool
+        """
+        if render and self.render_executor is not None:
+            self._render_texts(posts)
+        self.get_user_names([post["user_id"] for post in posts])
+        for post in posts:
+            self.process_post(post, render=render)
+
+    def _render_texts(self, posts):
+        # render the markdown that process_post would render, including the
+        # excerpts of the stale posts, on the workers of the executor
+        post_processor = self.post_processor
+        texts = []
         for post in posts:
-            self.process_post(post, render=False)
+            if "text" not in post or post_processor.is_rendered(post):
+                continue
+            texts.append(post["text"])
+            if "render_version" in post:
+                texts.append(post_processor.create_excerpt(post["text"]))
+        post_processor.render_texts(texts, self.render_executor)
+
+    def get_user_names(self, user_ids):
+        """
+        Get the names of the authors given by ``user_ids``. The names are
+        memoized for the current request, and cached for
+        ``BLOGGING_USER_NAME_CACHE_TIMEOUT`` seconds if it is set, so that
+        the users are loaded once, and with one call to the
+        ``user_loader_batch`` callback if one is installed.
+
+        :param user_ids: The list of user ids
+        :type user_ids: list
+        :return: A dict of the user names by user id, with ``None`` for the
+         users that were not found
+        """
+        names = g.setdefault("blogging_user_names", {}) \
+            if has_app_context() else {}
+        cache = self._user_name_cache
+        missing = []
+        for user_id in user_ids:
+            if user_id in names or user_id in missing:
+                continue
+            user_name = cache.get(user_id) if cache is not None else None
+            if user_name is not None:
+                names[user_id] = user_name
+            else:
+                missing.append(user_id)
+        if missing:
+            users = self._load_users(missing)
+            for user_id in missing:
+                author = users.get(str(user_id))
+                user_name = None if author is None else \
+                    self.get_user_name(author)
+                names[user_id] = user_name
+                if cache is not None and user_name is not None:
+                    cache.set(user_id, user_name)
+        return dict((user_id, names[user_id]) for user_id in user_ids)
+
+    def _load_users(self, user_ids):
+        if self.user_batch_callback is not None:
+            users = self.user_batch_callback(user_ids) or {}
+            # the user ids of the storage are strings
+            return dict((str(user_id), user)
+                        for user_id, user in users.items())
+        try:
+            return dict((user_id, self.user_callback(user_id))
+                        for user_id in user_ids)
+        except Exception:
+                raise Exception("No user_loader has been installed for this "
+                                "BloggingEngine. Add one with the "
+                                "'BloggingEngine.user_loader' decorator.")
 
     def process_post(self, post, render=True):
         """
@@ -139,17 +269,74 @@ class BloggingEngine(object):
         :return:
         """
         post_processor = self.post_processor
+        # rendered text persisted by the storage with an older render
+        # version is rendered again and updated in the storage
+        stale = render and "render_version" in post and \
+            not post_processor.is_rendered(post)
         post_processor.process(post, render)
-        try:
-            author = self.user_callback(post["user_id"])
-        except Exception:
-                raise Exception("No user_loader has been installed for this "
-                                "BloggingEngine. Add one with the "
-                                "'BloggingEngine.user_loader' decorator.")
-        if author is not None:
-            post["user_name"] = self.get_user_name(author)
+        if stale:
+            post_processor.render_excerpt(post)
+            self.storage.update_rendered_text(
+                post["post_id"], post["rendered_text"], post["meta"],
+                post_processor.render_version(),
+                excerpt_html=post["excerpt_html"])
+        elif "excerpt_html" in post and \
+                not post_processor.is_excerpt_rendered(post):
+            self._render_excerpt(post)
+        user_name = self.get_user_names([post["user_id"]])[post["user_id"]]
+        if user_name is not None:
+            post["user_name"] = user_name
         post_processed.send(self.app, engine=self, post=post, render=render)
 
+    def _render_excerpt(self, post):
+        # the posts of the listings carry the excerpt but not the text, so
+        # the full post is fetched to render the excerpt again
+        post_processor = self.post_processor
+        full_post = post if "text" in post else \
+            self.storage.get_post_by_id(post["post_id"])
+        if full_post is None:
+            return
+        if not post_processor.is_rendered(full_post):
+            post_processor.render_text(full_post)
+        post_processor.render_excerpt(full_post)
+        self.storage.update_rendered_text(
+            full_post["post_id"], full_post["rendered_text"],
+            full_post["meta"], post_processor.render_version(),
+            excerpt_html=full_post["excerpt_html"])
+        post["excerpt_html"] = full_post["excerpt_html"]
+        post["render_version"] = post_processor.render_version()
+
+    def render_stale_posts(self, batch_size=100):
+        """
+        Render the text of all the posts whose rendered text is missing in
+        the storage, or was rendered with a different ``render_version``,
+        such as after changing the markdown extensions. The posts are also
+        rendered lazily when read, so this is only needed to avoid that
+        cost on the first reads.
+
+        :param batch_size: The number of posts to render per batch
+        :type batch_size: int
+        :return: The number of posts that were rendered
+        """
+        post_processor = self.post_processor
+        render_version = post_processor.render_version()
+        num_rendered = 0
+        while True:
+            posts = self.storage.get_stale_posts(render_version,
+                                                 count=batch_size)
+            num_saved = 0
+            for post in posts:
+                post_processor.render_text(post)
+                post_processor.render_excerpt(post)
+                if self.storage.update_rendered_text(
+                        post["post_id"], post["rendered_text"], post["meta"],
+                        render_version, excerpt_html=post["excerpt_html"]):
+                    num_saved += 1
+            num_rendered += num_saved
+            if num_saved == 0:
+                break
+        return num_rendered
+
     @classmethod
     def get_user_name(cls, user):
         user_name = user.get_name() if hasattr(user, "get_name") else str(user)
@@ -2,10 +2,17 @@ try:
     from builtins import object
 except ImportError:
     pass
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
 import markdown
 from markdown.extensions.meta import MetaExtension
-from flask import url_for
+from flask import url_for, current_app, _request_ctx_stack
 from flask_login import current_user
+from werkzeug.urls import url_quote
+from .utils import LRUCache
 
 
 class MathJaxPattern(markdown.inlinepatterns.Pattern):
@@ -32,9 +39,44 @@ def makeExtension(configs=[]):
     return MathJaxExtension(configs)
 
 
+_worker_local = threading.local()
+
+
+def _render_markdown(text, render_version, extensions):
+    """
+    Convert the markdown ``text`` in a worker of a render executor. The
+    ``Markdown`` object is reused by the worker thread or process for as long
+    as the ``render_version`` is the same.
+
+    :return: A tuple of the html and the meta data of the text
+    """
+    md = getattr(_worker_local, "markdown", None)
+    if md is None or _worker_local.render_version != render_version:
+        md = markdown.Markdown(extensions=extensions)
+        _worker_local.markdown = md
+        _worker_local.render_version = render_version
+    else:
+        md.reset()
+        # the MetaExtension does not reset the meta data of the last text
+        md.Meta = {}
+    return md.convert(text), md.Meta
+
+
 class PostProcessor(object):
 
     _markdown_extensions = [MathJaxExtension(), MetaExtension()]
+    _render_version = None
+    _render_cache = None
+    _local = threading.local()
+    _excerpt_blocks = 2
+    _more_pattern = re.compile(r"<!--\s*more\s*-->", re.IGNORECASE)
+    _block_separator = re.compile(r"\n[ \t]*\n")
+    _meta_pattern = re.compile(r"^[ ]{0,3}[A-Za-z0-9_-]+:")
+    _logger = logging.getLogger("flask-blogging")
+    _url_post_id = 918273645
+    _url_slug = "blogging-url-slug"
+    _quoted_slugs = {}
+    _max_quoted_slugs = 10000
 
     @staticmethod
     def create_slug(title):
@@ -42,15 +84,290 @@ class PostProcessor(object):
 
     @classmethod
     def construct_url(cls, post):
-        url = url_for("blogging.page_by_id", post_id=post["post_id"],
-                      slug=cls.create_slug(post["title"]))
-        return url
+        slug = post.get("slug")
+        if slug is None:
+            slug = cls.create_slug(post["title"])
+        template = cls.get_url_template()
+        if template is None or not slug:
+            return url_for("blogging.page_by_id", post_id=post["post_id"],
+                           slug=slug)
+        return template.format(post_id=int(post["post_id"]),
+                               slug=cls._quote_slug(slug))
+
+    @classmethod
+    def get_url_template(cls):
+        """
+        The template of the urls of the ``page_by_id`` view, built once per
+        app and script root with ``url_for``, and looked up once per request,
+        so that the url of each post is formatted rather than built with
+        ``url_for``.
+
+        :return: The template string with the ``post_id`` and ``slug``
+         fields, or ``None`` if the url cannot be formatted.
+        """
+        ctx = _request_ctx_stack.top
+        if ctx is not None and hasattr(ctx, "blogging_url_template"):
+            return ctx.blogging_url_template
+        script_root = ctx.request.script_root if ctx is not None else \
+            current_app.config.get("APPLICATION_ROOT")
+        templates = current_app.extensions.setdefault(
+            "blogging_url_templates", {})
+        if script_root not in templates:
+            post_id = str(cls._url_post_id)
+            url = url_for("blogging.page_by_id", post_id=cls._url_post_id,
+                          slug=cls._url_slug)
+            template = None
+            if url.count(post_id) == 1 and url.count(cls._url_slug) == 1:
+                template = url.replace("{", "{{").replace("}", "}}").\
+                    replace(post_id, "{post_id}").\
+                    replace(cls._url_slug, "{slug}")
+            templates[script_root] = template
+        if ctx is not None:
+            ctx.blogging_url_template = templates[script_root]
+        return templates[script_root]
+
+    @classmethod
+    def _quote_slug(cls, slug):
+        # quoted like the slugs of url_for, and memoized since the same
+        # posts are listed on every page
+        quoted_slugs = cls._quoted_slugs
+        quoted = quoted_slugs.get(slug)
+        if quoted is None:
+            if len(quoted_slugs) >= cls._max_quoted_slugs:
+                quoted_slugs.clear()
+            quoted = url_quote(slug)
+            quoted_slugs[slug] = quoted
+        return quoted
+
+    @classmethod
+    def get_current_user_id(cls):
+        """
+        The id of the ``current_user``, resolved once per request.
+
+        :return: The unicode user id, or ``None`` for anonymous users
+        """
+        ctx = _request_ctx_stack.top
+        if ctx is None:
+            return current_user.get_id()
+        if not hasattr(ctx, "blogging_user_id"):
+            ctx.blogging_user_id = current_user.get_id()
+        return ctx.blogging_user_id
 
     @classmethod
     def render_text(cls, post):
-        md = markdown.Markdown(extensions=cls.all_extensions())
-        post["rendered_text"] = md.convert(post["text"])
-        post["meta"] = md.Meta
+        text = post["text"]
+        key = cls._render_key(text)
+        render_cache = cls.get_render_cache()
+        rendered = render_cache.get(key)
+        if rendered is None:
+            md = cls.get_markdown()
+            rendered = (md.convert(text), md.Meta)
+            render_cache.set(key, rendered)
+        rendered_text, meta = rendered
+        post["rendered_text"] = rendered_text
+        post["meta"] = dict((k, list(v)) for k, v in meta.items())
+
+    @classmethod
+    def render_texts(cls, texts, executor):
+        """
+        Render the markdown ``texts`` concurrently on the workers of
+        ``executor`` into the render cache, so that ``render_text`` then
+        finds them there. Only the markdown conversion runs on the workers,
+        the posts are still processed in order on the calling thread.
+
+        :param texts: The markdown texts
+        :type texts: list
+        :param executor: A ``concurrent.futures`` executor, such as a
+         ``ThreadPoolExecutor`` or a ``ProcessPoolExecutor``
+        :type executor: object
+        :return: The number of texts that were rendered
+        """
+        render_cache = cls.get_render_cache()
+        if not render_cache.max_entries:
+            return 0
+        pending = OrderedDict()
+        for text in texts:
+            key = cls._render_key(text)
+            if key not in pending and render_cache.get(key) is None:
+                pending[key] = text
+        # a single text is rendered faster without the executor
+        if len(pending) < 2:
+            return 0
+        render_version = cls.render_version()
+        extensions = cls.all_extensions()
+        futures = [(key, executor.submit(_render_markdown, text,
+                                         render_version, extensions))
+                   for key, text in pending.items()]
+        num_rendered = 0
+        for key, future in futures:
+            try:
+                render_cache.set(key, future.result())
+                num_rendered += 1
+            except Exception as e:
+                # the text is rendered again by render_text
+                cls._logger.exception(str(e))
+        return num_rendered
+
+    @classmethod
+    def _render_key(cls, text):
+        return hashlib.sha1((cls.render_version() + text).encode("utf-8")).\
+            hexdigest()
+
+    @classmethod
+    def create_excerpt(cls, text):
+        """
+        The Markdown text of the excerpt of a post, which is the text before
+        a ``<!--more-->`` marker, or else the first blocks of the text.
+
+        :param text: The Markdown text of the post
+        :type text: str
+        :return: The Markdown text of the excerpt
+        """
+        parts = cls._more_pattern.split(text, 1)
+        if len(parts) > 1:
+            return parts[0]
+        blocks = [block for block in cls._block_separator.split(text)
+                  if block.strip()]
+        num_blocks = cls._excerpt_blocks
+        # the meta data header is not a block of the excerpt
+        if blocks and cls._meta_pattern.match(blocks[0]):
+            num_blocks += 1
+        return "\n\n".join(blocks[:num_blocks])
+
+    @classmethod
+    def render_excerpt(cls, post):
+        """
+        Render the excerpt of the post text into ``post["excerpt_html"]``,
+        for the teasers of the listing pages.
+        """
+        excerpt = dict(text=cls.create_excerpt(post["text"]))
+        cls.render_text(excerpt)
+        post["excerpt_html"] = excerpt["rendered_text"]
+
+    @classmethod
+    def set_excerpt_blocks(cls, blocks):
+        """
+        Set the number of blocks of the text, such as paragraphs, in the
+        excerpt of the posts that have no ``<!--more-->`` marker.
+
+        :param blocks: The number of blocks
+        :type blocks: int
+        """
+        if blocks != cls._excerpt_blocks:
+            cls._excerpt_blocks = blocks
+            cls._render_version = None
+
+    @classmethod
+    def get_markdown(cls):
+        """
+        The ``Markdown`` object of the current thread, configured with
+        ``all_extensions`` and reset for a new conversion. Reusing it avoids
+        registering the extensions and compiling their patterns for every
+        post. The object is replaced when the ``render_version`` changes.
+
+        :return: The ``markdown.Markdown`` object
+        """
+        render_version = cls.render_version()
+        md = getattr(cls._local, "markdown", None)
+        if md is None or cls._local.render_version != render_version:
+            md = markdown.Markdown(extensions=cls.all_extensions())
+            cls._local.markdown = md
+            cls._local.render_version = render_version
+        else:
+            md.reset()
+            # the MetaExtension does not reset the meta data of the last text
+            md.Meta = {}
+        return md
+
+    @classmethod
+    def get_render_cache(cls):
+        """
+        The cache of the html and meta data rendered from the post text,
+        keyed by the hash of the text and the ``render_version``. Its
+        ``info`` method returns the hit and miss counts.
+
+        :return: The ``LRUCache`` object
+        """
+        if cls._render_cache is None:
+            cls.set_render_cache()
+        return cls._render_cache
+
+    @classmethod
+    def set_render_cache(cls, max_entries=1000, max_bytes=32 * 1024 * 1024):
+        """
+        Replace the render cache with one of the given size.
+
+        :param max_entries: The maximum number of posts to cache. A value of
+         ``0`` disables the cache.
+        :type max_entries: int
+        :param max_bytes: The maximum total size of the cached html
+        :type max_bytes: int
+        """
+        cls._render_cache = LRUCache(
+            max_entries=max_entries, max_bytes=max_bytes,
+            size_func=lambda rendered: len(rendered[0]))
+
+    @classmethod
+    def render_version(cls):
+        """
+        A hash that identifies the markdown version, the post processor and
+        the extensions used to render the posts. The rendered text persisted
+        by the storage is stale when it was rendered with a different
+        version.
+
+        :return: The version string
+        """
+        if cls._render_version is None:
+            parts = [markdown.version, cls.__module__, cls.__name__,
+                     "excerpt:%d" % cls._excerpt_blocks]
+            for extension in cls.all_extensions():
+                parts.append("%s%s" % (
+                    cls._config_identity(type(extension)),
+                    cls._config_identity(extension.getConfigs())))
+            cls._render_version = hashlib.sha1(
+                "|".join(parts).encode("utf-8")).hexdigest()
+        return cls._render_version
+
+    @classmethod
+    def _config_identity(cls, value):
+        """
+        A representation of a configuration value of an extension that is
+        the same in every process, unlike the ``repr`` of the functions and
+        of the objects, which contains their address.
+        """
+        if isinstance(value, (list, tuple)):
+            return "[%s]" % ", ".join(cls._config_identity(item)
+                                      for item in value)
+        if isinstance(value, dict):
+            items = sorted("%s: %s" % (cls._config_identity(key),
+                                       cls._config_identity(item))
+                           for key, item in value.items())
+            return "{%s}" % ", ".join(items)
+        if callable(value):
+            name = getattr(value, "__qualname__", None) or \
+                getattr(value, "__name__", None) or type(value).__name__
+            return "%s.%s" % (getattr(value, "__module__", None), name)
+        if type(value).__repr__ is object.__repr__:
+            return cls._config_identity(type(value))
+        return repr(value)
+
+    @classmethod
+    def is_rendered(cls, post):
+        """
+        Check if the post carries rendered text from the storage that is
+        consistent with the current ``render_version``.
+        """
+        return post.get("rendered_text") is not None and \
+            post.get("render_version") == cls.render_version()
+
+    @classmethod
+    def is_excerpt_rendered(cls, post):
+        """
+        Check if the post carries an excerpt from the storage that is
+        consistent with the current ``render_version``.
+        """
+        return post.get("excerpt_html") is not None and \
+            post.get("render_version") == cls.render_version()
 
     @classmethod
     def is_author(cls, post, user):
@@ -65,11 +382,15 @@ class PostProcessor(object):
         :return:
         """
         post["slug"] = cls.create_slug(post["title"])
-        post["editable"] = cls.is_author(post, current_user)
+        post["editable"] = \
+            cls.get_current_user_id() == u''+str(post['user_id'])
         post["url"] = cls.construct_url(post)
         post["priority"] = 0.8
         if render:
-            cls.render_text(post)
+            if cls.is_rendered(post):
+                post["meta"] = post.get("meta") or {}
+            else:
+                cls.render_text(post)
 
     @classmethod
     def all_extensions(cls):
@@ -79,3 +400,4 @@ class PostProcessor(object):
     def set_custom_extensions(cls, extensions):
         if type(extensions) == list:
             cls._markdown_extensions.extend(extensions)
+            cls._render_version = None
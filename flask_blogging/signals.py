@@ -199,7 +199,9 @@ Signal send after feed posts are processed
 """)
 
 sitemap_posts_fetched = signals.signal("sitemap_posts_fetched", doc="""\
-Signal send after posts are fetched
+Signal send after posts are fetched. The sitemap is streamed, so the signal is
+sent for each chunk of posts, which only have the ``post_id``, ``title`` and
+``last_modified_date`` values
 
 :param app: The Flask app which is the sender
 :type app: object
@@ -209,7 +211,8 @@ Signal send after posts are fetched
 :type posts: list
 """)
 sitemap_posts_processed = signals.signal("sitemap_posts_processed", doc="""\
-Signal send after posts are fetched and processed
+Signal send after posts are fetched and processed, for each chunk of posts
+in the sitemap
 
 :param app: The Flask app which is the sender
 :type app: object
@@ -1,12 +1,23 @@
 try:
-    from builtins import str
+    from builtins import str, range
 except ImportError:
     pass
+import contextlib
 import logging
+import random
+import threading
+import time
 import sqlalchemy as sqla
 import datetime
+import json
+import itertools
+from collections import OrderedDict
 from .storage import Storage
 from .signals import sqla_initialized
+try:
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+except ImportError:  # SQLAlchemy < 1.1
+    pg_insert = None
 
 
 class SQLAStorage(Storage):
@@ -17,9 +28,18 @@ class SQLAStorage(Storage):
     """
     _db = None
     _logger = logging.getLogger("flask-blogging")
+    # maximum number of ids in the ``IN`` clause of a single query
+    _in_batch_size = 500
+    # the seconds after which a missing post_counts table is looked up again
+    _post_counts_check_interval = 60
+    _table_names = ("post", "tag", "tag_posts", "user_posts", "post_counts")
+    # the attributes that are set once the tables are initialized
+    _table_attributes = frozenset([
+        "_post_table", "_tag_table", "_tag_posts_table", "_user_posts_table",
+        "_post_counts_table", "_post_counts_created", "_post_indexes"])
 
     def __init__(self, engine=None, table_prefix="", metadata=None, db=None,
-                 bind=None):
+                 bind=None, lazy=False, read_engines=None):
         """
         The constructor for the ``SQLAStorage`` class.
 
@@ -37,6 +57,15 @@ class SQLAStorage(Storage):
         :param bind: (Optional) Reference the database to bind for multiple
         database scenario with binds
         :type bind: str
+        :param lazy: (Optional) If ``True``, the tables are reflected on the
+         first query rather than in the constructor, and the missing tables
+         are then created by the storage (default ``False``).
+        :type lazy: bool
+        :param read_engines: (Optional) The engines of the read replicas of
+         the database of ``engine``. The posts are read from a replica picked
+         at random, unless ``use_primary`` is set, and are always written to
+         ``engine``.
+        :type read_engines: list
         """
         self._bind = bind
         if db:
@@ -49,12 +78,24 @@ class SQLAStorage(Storage):
             self._metadata = metadata or sqla.MetaData()
         self._info = {} if self._bind is None else {"bind_key": self._bind}
         self._table_prefix = table_prefix
-        self._metadata.reflect(bind=self._engine)
-        self._create_all_tables()
-        sqla_initialized.send(self, engine=self._engine,
-                              table_prefix=self._table_prefix,
-                              meta=self.metadata,
-                              bind=self._bind)
+        self._lazy = lazy
+        self._post_counts_checked = None
+        self._tables_lock = threading.Lock()
+        self._read_engines = list(read_engines or [])
+        self._local = threading.local()
+        if not lazy:
+            self._initialize_tables()
+
+    def __getattr__(self, name):
+        # only called for the attributes that are not set, which are the
+        # tables of a lazy storage until its first query
+        if name not in self._table_attributes or \
+                "_tables_lock" not in self.__dict__:
+            raise AttributeError(name)
+        with self._tables_lock:
+            if name not in self.__dict__:
+                self._initialize_tables()
+        return self.__dict__[name]
 
     @property
     def metadata(self):
@@ -76,13 +117,89 @@ class SQLAStorage(Storage):
     def user_posts_table(self):
         return self._user_posts_table
 
+    @property
+    def post_counts_table(self):
+        return self._post_counts_table
+
     @property
     def engine(self):
         return self._engine
 
+    @property
+    def read_engines(self):
+        return self._read_engines
+
+    def use_primary(self, primary=True):
+        """
+        Read the posts from the primary database rather than from the read
+        replicas, in the current thread. The views set this for the requests
+        of a blogger shortly after a write, so that the blogger does not see
+        the stale posts of a lagging replica.
+
+        :param primary: If ``True``, the reads go to the primary database
+        :type primary: bool
+        """
+        self._local.use_primary = primary
+
+    def bind_connection(self):
+        """
+        Run the storage calls of the current thread on one connection per
+        engine, until ``release_connection`` is called, rather than on a new
+        connection from the pool for each call. The reads on the bound
+        connection run without a transaction of their own, and the writes in
+        one transaction per call. The views bind a connection for each
+        request when ``BLOGGING_REQUEST_CONNECTION`` is set.
+        """
+        self._local.connections = {}
+        # the reads of a request go to the same replica
+        self._local.read_engine = random.choice(self._read_engines) \
+            if self._read_engines else None
+
+    def release_connection(self):
+        """
+        Return the connections bound by ``bind_connection`` to the pool.
+        """
+        connections = getattr(self._local, "connections", None)
+        self._local.connections = None
+        self._local.read_engine = None
+        for conn in (connections or {}).values():
+            try:
+                conn.close()
+            except Exception as e:
+                self._logger.exception(str(e))
+
+    def _get_read_engine(self):
+        if not self._read_engines or \
+                getattr(self._local, "use_primary", False):
+            return self._engine
+        return getattr(self._local, "read_engine", None) or \
+            random.choice(self._read_engines)
+
+    def _begin(self, engine, write=False):
+        """
+        A connection of ``engine`` in a new transaction, or the connection
+        of ``engine`` bound to the current thread by ``bind_connection``.
+        """
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            return engine.begin()
+        conn = connections.get(engine)
+        if conn is None:
+            conn = connections[engine] = engine.connect()
+        return self._use_connection(conn, transaction=write)
+
+    @contextlib.contextmanager
+    def _use_connection(self, conn, transaction):
+        if transaction and not conn.in_transaction():
+            with conn.begin():
+                yield conn
+        else:
+            yield conn
+
     def save_post(self, title, text, user_id, tags, draft=False,
                   post_date=None, last_modified_date=None, meta_data=None,
-                  post_id=None):
+                  post_id=None, rendered_text=None, render_version=None,
+                  excerpt_html=None):
         """
         Persist the blog post data. If ``post_id`` is ``None`` or ``post_id``
         is invalid, the post must be inserted into the storage. If ``post_id``
@@ -105,10 +222,22 @@ class SQLAStorage(Storage):
         :param last_modified_date: (Optional) The date when blog was last
          modified  (default datetime.datetime.utcnow() )
         :type last_modified_date: datetime.datetime
+        :param meta_data: (Optional) The meta data parsed from the text of
+         the blog post
+        :type meta_data: dict
         :param post_id: (Optional) The post identifier. This should be ``None``
          for an insert call,
          and a valid value for update. (default ``None``)
         :type post_id: int
+        :param rendered_text: (Optional) The html rendered from ``text``. If
+         ``None``, the post is rendered and updated on its first read.
+        :type rendered_text: str
+        :param render_version: (Optional) The
+         ``PostProcessor.render_version`` used for ``rendered_text``
+        :type render_version: str
+        :param excerpt_html: (Optional) The html rendered from the excerpt of
+         ``text``, for the listing pages
+        :type excerpt_html: str
 
         :return: The post_id value, in case of a successful insert or update.
          Return ``None`` if there were errors.
@@ -120,7 +249,7 @@ class SQLAStorage(Storage):
         last_modified_date = last_modified_date if last_modified_date is not \
             None else current_datetime
 
-        with self._engine.begin() as conn:
+        with self._begin(self._engine, write=True) as conn:
             try:
                 if post_id is not None:  # validate post_id
                     exists_statement = sqla.select([self._post_table]).where(
@@ -128,26 +257,65 @@ class SQLAStorage(Storage):
                     exists = \
                         conn.execute(exists_statement).fetchone() is not None
                     post_id = post_id if exists else None
+                old_counts = self._get_post_count_keys(post_id, conn)
                 post_statement = \
                     self._post_table.insert() if post_id is None else \
                     self._post_table.update().where(
                         self._post_table.c.id == post_id)
-                post_statement = post_statement.values(
+                post_statement = post_statement.values(self._post_values(
                     title=title, text=text, post_date=post_date,
-                    last_modified_date=last_modified_date, draft=draft
-                )
+                    last_modified_date=last_modified_date, draft=draft,
+                    rendered_text=rendered_text,
+                    meta_data=self._dump_meta(meta_data, rendered_text),
+                    render_version=render_version, excerpt_html=excerpt_html
+                ))
 
                 post_result = conn.execute(post_statement)
                 post_id = post_result.inserted_primary_key[0] \
                     if post_id is None else post_id
                 self._save_tags(tags, post_id, conn)
                 self._save_user_post(user_id, post_id, conn)
+                self._update_post_counts(
+                    old_counts, self._get_post_count_keys(post_id, conn), conn,
+                    last_modified_date=last_modified_date, post_id=post_id)
 
             except Exception as e:
                 self._logger.exception(str(e))
                 post_id = None
         return post_id
 
+    def save_posts(self, posts, chunk_size=1000):
+        """
+        Insert many new posts, such as when migrating the posts from another
+        system. The posts are read from ``posts`` one chunk at a time, so
+        ``posts`` can be a generator over a large dump. Each chunk is
+        inserted in one transaction, with ``executemany`` inserts and a
+        single lookup of its tags. If a chunk fails, its transaction is
+        rolled back and the remaining posts are not inserted.
+
+        :param posts: An iterable of dicts with the keyword arguments of
+         ``save_post``, other than ``post_id``, for each post
+        :type posts: iterable
+        :param chunk_size: The number of posts inserted per transaction
+         (default 1000)
+        :type chunk_size: int
+        :return: The number of posts that were inserted.
+        """
+        posts = iter(posts)
+        saved = 0
+        while True:
+            chunk = list(itertools.islice(posts, chunk_size))
+            if not chunk:
+                break
+            try:
+                with self._engine.begin() as conn:
+                    self._insert_posts(chunk, conn)
+            except Exception as e:
+                self._logger.exception(str(e))
+                break
+            saved += len(chunk)
+        return saved
+
     def get_post_by_id(self, post_id):
         """
         Fetch the blog post given by ``post_id``
@@ -158,40 +326,22 @@ class SQLAStorage(Storage):
          returns ``None``.
         """
         r = None
-        with self._engine.begin() as conn:
+        with self._begin(self._get_read_engine()) as conn:
             try:
                 post_statement = sqla.select([self._post_table]).where(
                     self._post_table.c.id == post_id
                 )
-                post_result = conn.execute(post_statement).fetchone()
-                if post_result is not None:
-                    r = dict(post_id=post_result[0], title=post_result[1],
-                             text=post_result[2], post_date=post_result[3],
-                             last_modified_date=post_result[4],
-                             draft=post_result[5])
-                    # get the tags
-                    tag_statement = sqla.select([self._tag_table.c.text]). \
-                        where(
-                            sqla.and_(
-                                self._tag_table.c.id ==
-                                self._tag_posts_table.c.tag_id,
-                                self._tag_posts_table.c.post_id == post_id))
-                    tag_result = conn.execute(tag_statement).fetchall()
-                    r["tags"] = [t[0] for t in tag_result]
-                    # get the user
-                    user_statement = sqla.select([
-                        self._user_posts_table.c.user_id]).where(
-                        self._user_posts_table.c.post_id == post_id
-                    )
-                    user_result = conn.execute(user_statement).fetchone()
-                    r["user_id"] = user_result[0]
+                post_result = conn.execute(post_statement).fetchall()
+                posts = self._serialise_posts(post_result, conn)
+                r = posts[0] if posts else None
             except Exception as e:
                 self._logger.exception(str(e))
                 r = None
         return r
 
     def get_posts(self, count=10, offset=0, recent=True, tag=None,
-                  user_id=None, include_draft=False):
+                  user_id=None, include_draft=False, before=None, after=None,
+                  summary=False):
         """
         Get posts given by filter criteria
 
@@ -207,21 +357,41 @@ class SQLAStorage(Storage):
         :type user_id: str
         :param include_draft: Whether to include posts marked as draft or not
         :type include_draft: bool
+        :param before: (Optional) A cursor created by ``encode_cursor``. Only
+         the posts that precede the cursor post in the requested ordering are
+         returned. The ``offset`` is ignored when a cursor is given.
+        :type before: str
+        :param after: (Optional) A cursor created by ``encode_cursor``. Only
+         the posts that follow the cursor post in the requested ordering are
+         returned. The ``offset`` is ignored when a cursor is given.
+        :type after: str
+        :param summary: (Optional) If ``True``, the posts only have the
+         ``post_id``, ``title``, ``post_date``, ``last_modified_date``,
+         ``draft``, ``tags`` and ``user_id`` values, and the text of the posts
+         is not fetched. (default ``False``)
+        :type summary: bool
 
         :return: A list of posts, with each element a dict containing values
          for the following keys: (title, text, draft, post_date,
          last_modified_date). If count is ``None``, then all the posts are
          returned.
         """
-        ordering = sqla.desc(self._post_table.c.post_date) if recent \
-            else self._post_table.c.post_date
         user_id = str(user_id) if user_id else user_id
+        # posts before the cursor are fetched by walking the ordering
+        # backwards from the cursor, and then reversed
+        reverse = before is not None and after is None
+        descending = recent != reverse
 
-        with self._engine.begin() as conn:
+        with self._begin(self._get_read_engine()) as conn:
             try:
-                select_statement = sqla.select([self._post_table.c.id])
-                sql_filter = self._get_filter(tag, user_id, include_draft,
-                                              conn)
+                select_statement = sqla.select(self._get_columns(summary))
+                sql_filter = self._get_filter(tag, user_id, include_draft)
+                cursor = after if after is not None else before
+                if cursor is not None:
+                    seek_filter = self._get_seek_filter(
+                        self.decode_cursor(cursor), descending)
+                    sql_filter = sqla.and_(sql_filter, seek_filter)
+                    offset = None
 
                 if sql_filter is not None:
                     select_statement = select_statement.where(sql_filter)
@@ -230,15 +400,114 @@ class SQLAStorage(Storage):
                 if offset:
                     select_statement = select_statement.offset(offset)
 
-                select_statement = select_statement.order_by(ordering)
+                select_statement = select_statement.order_by(
+                    *self._get_ordering(descending))
                 result = conn.execute(select_statement).fetchall()
+                if reverse:
+                    result.reverse()
+                posts = self._serialise_posts(result, conn, summary)
             except Exception as e:
                 self._logger.exception(str(e))
-                result = []
-
-        posts = [self.get_post_by_id(pid[0]) for pid in result]
+                posts = []
         return posts
 
+    def iter_posts(self, count=None, recent=True, tag=None, user_id=None,
+                   include_draft=False, batch_size=100, summary=False):
+        """
+        Iterate over the posts given by filter criteria. The rows are read
+        in batches of ``batch_size`` from a server side cursor where the
+        database driver supports it, and the tags and users of each batch are
+        fetched over a second connection, so only one batch of posts is held
+        in memory at a time.
+
+        :param count: The number of posts to retrieve. If count is ``None``,
+         all the posts are returned.
+        :type count: int
+        :param recent: Order by recent posts or not
+        :type recent: bool
+        :param tag: Filter by a specific tag
+        :type tag: str
+        :param user_id: Filter by a specific user
+        :type user_id: str
+        :param include_draft: Whether to include posts marked as draft or not
+        :type include_draft: bool
+        :param batch_size: The number of posts fetched from the storage at a
+         time (default 100)
+        :type batch_size: int
+        :param summary: (Optional) If ``True``, the posts only have the
+         ``post_id``, ``title``, ``post_date``, ``last_modified_date``,
+         ``draft``, ``tags`` and ``user_id`` values, and the text of the posts
+         is not fetched. (default ``False``)
+        :type summary: bool
+        :return: An iterator of posts, like the ones returned by
+         ``get_posts``.
+        """
+        user_id = str(user_id) if user_id else user_id
+        select_statement = sqla.select(self._get_columns(summary)).where(
+            self._get_filter(tag, user_id, include_draft)).order_by(
+            *self._get_ordering(recent))
+        if count:
+            select_statement = select_statement.limit(count)
+        engine = self._get_read_engine()
+        with engine.connect() as conn:
+            try:
+                result = conn.execution_options(stream_results=True). \
+                    execute(select_statement)
+                # some drivers cannot run other queries on the connection
+                # until the streamed result is consumed
+                with engine.connect() as hydrate_conn:
+                    rows = result.fetchmany(batch_size)
+                    while rows:
+                        for post in self._serialise_posts(
+                                rows, hydrate_conn, summary):
+                            yield post
+                        rows = result.fetchmany(batch_size)
+                result.close()
+            except Exception as e:
+                self._logger.exception(str(e))
+
+    def iter_sitemap_entries(self, count=None, offset=0, batch_size=1000):
+        """
+        Iterate over the published posts listed in the sitemap, ordered by
+        the post identifier. Only the ``id``, ``title`` and
+        ``last_modified_date`` columns are read, in batches of
+        ``batch_size`` rows from a server side cursor where the database
+        driver supports it.
+
+        :param count: The number of posts to retrieve. If count is ``None``,
+         all the posts are returned.
+        :type count: int
+        :param offset: The number of posts to offset (default 0)
+        :type offset: int
+        :param batch_size: The number of posts fetched from the storage at a
+         time (default 1000)
+        :type batch_size: int
+        :return: An iterator of dicts with the ``post_id``, ``title`` and
+         ``last_modified_date`` of the posts.
+        """
+        post_table = self._post_table
+        select_statement = sqla.select(
+            [post_table.c.id, post_table.c.title,
+             post_table.c.last_modified_date]).where(
+            post_table.c.draft == 0).order_by(post_table.c.id)
+        if count:
+            select_statement = select_statement.limit(count)
+        if offset:
+            select_statement = select_statement.offset(offset)
+        with self._get_read_engine().connect() as conn:
+            try:
+                result = conn.execution_options(stream_results=True). \
+                    execute(select_statement)
+                rows = result.fetchmany(batch_size)
+                while rows:
+                    for post_id, title, last_modified_date in rows:
+                        yield dict(post_id=post_id, title=title,
+                                   last_modified_date=last_modified_date)
+                    rows = result.fetchmany(batch_size)
+                result.close()
+            except Exception as e:
+                self._logger.exception(str(e))
+
     def count_posts(self, tag=None, user_id=None, include_draft=False):
         """
         Returns the total number of posts for the give filter
@@ -251,13 +520,17 @@ class SQLAStorage(Storage):
         :type include_draft: bool
         :return: The number of posts for the given filter.
         """
+        if not include_draft and not (tag and user_id):
+            # the published posts are counted in the post_counts table
+            summary = self._read_post_summary(tag, user_id)
+            if summary is not None:
+                return summary["count"]
         result = 0
-        with self._engine.begin() as conn:
+        with self._begin(self._get_read_engine()) as conn:
             try:
                 count_statement = sqla.select([sqla.func.count()]). \
                     select_from(self._post_table)
-                sql_filter = self._get_filter(tag, user_id, include_draft,
-                                              conn)
+                sql_filter = self._get_filter(tag, user_id, include_draft)
                 count_statement = count_statement.where(sql_filter)
                 result = conn.execute(count_statement).scalar()
             except Exception as e:
@@ -265,6 +538,57 @@ class SQLAStorage(Storage):
                 result = 0
         return result
 
+    def get_last_modified(self, post_id=None, tag=None, user_id=None,
+                          include_draft=False):
+        """
+        Get a cheap summary of the posts for the given filter, used by the
+        views to validate conditional requests without fetching the posts.
+        The summaries of the published posts are read from the
+        ``post_counts`` table, where the last modified date and the max id
+        are not lowered when a post is deleted or unpublished, as the count
+        changes then.
+
+        :param post_id: (Optional) Summarise only the post with this
+         identifier, whether it is a draft or not. The other filters are
+         ignored when ``post_id`` is given.
+        :type post_id: int
+        :param tag: Filter by a specific tag
+        :type tag: str
+        :param user_id: Filter by a specific user
+        :type user_id: str
+        :param include_draft: Whether to include posts marked as draft or not
+        :type include_draft: bool
+        :return: A dict with the ``last_modified_date``, the ``max_post_id``
+         and the ``count`` of the posts, or ``None`` if there were errors.
+        """
+        if post_id is None and not include_draft and not (tag and user_id):
+            # the published posts are summarised in the post_counts table
+            result = self._read_post_summary(tag, user_id)
+            if result is not None:
+                return result
+        result = None
+        with self._begin(self._get_read_engine()) as conn:
+            try:
+                columns = [
+                    sqla.func.max(self._post_table.c.last_modified_date),
+                    sqla.func.max(self._post_table.c.id),
+                    sqla.func.count()]
+                summary_statement = sqla.select(columns).select_from(
+                    self._post_table)
+                if post_id is not None:
+                    sql_filter = self._post_table.c.id == post_id
+                else:
+                    sql_filter = self._get_filter(tag, user_id,
+                                                  include_draft)
+                summary_statement = summary_statement.where(sql_filter)
+                row = conn.execute(summary_statement).fetchone()
+                result = dict(last_modified_date=row[0], max_post_id=row[1],
+                              count=row[2])
+            except Exception as e:
+                self._logger.exception(str(e))
+                result = None
+        return result
+
     def delete_post(self, post_id):
         """
         Delete the post defined by ``post_id``
@@ -276,7 +600,12 @@ class SQLAStorage(Storage):
         """
         status = False
         success = 0
-        with self._engine.begin() as conn:
+        with self._begin(self._engine, write=True) as conn:
+            try:
+                old_counts = self._get_post_count_keys(post_id, conn)
+                self._update_post_counts(old_counts, [], conn)
+            except Exception as e:
+                self._logger.exception(str(e))
             try:
                 post_del_statement = self._post_table.delete().where(
                     self._post_table.c.id == post_id)
@@ -301,20 +630,403 @@ class SQLAStorage(Storage):
         status = success == 3
         return status
 
-    def _get_filter(self, tag, user_id, include_draft, conn):
+    def update_rendered_text(self, post_id, rendered_text, meta_data,
+                             render_version, excerpt_html=None):
+        """
+        Persist the rendered html of a post whose stored rendering was missing
+        or stale.
+
+        :param post_id: The post identifier
+        :type post_id: int
+        :param rendered_text: The html rendered from the post text
+        :type rendered_text: str
+        :param meta_data: The meta data parsed from the post text
+        :type meta_data: dict
+        :param render_version: The ``PostProcessor.render_version`` used to
+         render the text
+        :type render_version: str
+        :param excerpt_html: (Optional) The html rendered from the excerpt of
+         the post text
+        :type excerpt_html: str
+        :return: Returns True if the rendered text was saved and False
+         otherwise.
+        """
+        if not self._has_render_columns():
+            return False
+        status = False
+        with self._begin(self._engine, write=True) as conn:
+            try:
+                statement = self._post_table.update().where(
+                    self._post_table.c.id == post_id).values(
+                    self._post_values(
+                        rendered_text=rendered_text,
+                        meta_data=self._dump_meta(meta_data, rendered_text),
+                        render_version=render_version,
+                        excerpt_html=excerpt_html))
+                status = conn.execute(statement).rowcount == 1
+            except Exception as e:
+                self._logger.exception(str(e))
+        return status
+
+    def get_stale_posts(self, render_version, count=100):
+        """
+        Get the posts, including the drafts, whose rendered text was not
+        persisted with the given ``render_version``.
+
+        :param render_version: The current ``PostProcessor.render_version``
+        :type render_version: str
+        :param count: The maximum number of posts to retrieve (default 100)
+        :type count: int
+        :return: A list of posts
+        """
+        if not self._has_render_columns():
+            return []
+        version_column = self._post_table.c.render_version
+        with self._engine.begin() as conn:
+            try:
+                select_statement = sqla.select([self._post_table]).where(
+                    sqla.or_(version_column.is_(None),
+                             version_column != render_version)
+                ).order_by(self._post_table.c.id).limit(count)
+                result = conn.execute(select_statement).fetchall()
+                posts = self._serialise_posts(result, conn)
+            except Exception as e:
+                self._logger.exception(str(e))
+                posts = []
+        return posts
+
+    def rebuild_post_counts(self):
+        """
+        Rebuild the ``post_counts`` table, which keeps the number of published
+        posts in total, per tag and per author. The counts are maintained by
+        ``save_post`` and ``delete_post``, so this is only needed to repair
+        them after the posts were changed directly in the database.
+
+        :return: Returns True if the counts were rebuilt and False otherwise.
+        """
+        status = False
+        with self._engine.begin() as conn:
+            try:
+                if self._has_post_counts(conn, recheck=True):
+                    self._rebuild_post_counts(conn)
+                    status = True
+            except Exception as e:
+                self._logger.exception(str(e))
+        return status
+
+    def create_indexes(self):
+        """
+        Create the indexes of the post table that are missing in the
+        database, such as when the tables were created by an earlier version.
+        The indexes that exist are left as they are, so it is safe to call
+        this more than once.
+
+        :return: Returns the names of the indexes that were created, or
+         ``None`` if there were errors.
+        """
+        created = None
+        with self._engine.begin() as conn:
+            try:
+                created = []
+                post_table_name = self._post_table.name
+                if conn.dialect.has_table(conn, post_table_name):
+                    existing = set(
+                        index["name"] for index in
+                        sqla.inspect(conn).get_indexes(post_table_name))
+                    for index in self._post_indexes:
+                        if index.name not in existing:
+                            index.create(bind=conn)
+                            created.append(index.name)
+            except Exception as e:
+                self._logger.exception(str(e))
+                created = None
+        return created
+
+    def _has_post_counts(self, conn, recheck=False):
+        # the table is only available after the tables are created. A
+        # missing table, such as one left out of the migrations, is looked
+        # up again at most once per interval, rather than on every query.
+        if not self._post_counts_created:
+            now = time.time()
+            checked = self._post_counts_checked
+            if recheck or checked is None or \
+                    now - checked >= self._post_counts_check_interval:
+                self._post_counts_checked = now
+                self._post_counts_created = conn.dialect.has_table(
+                    conn, self._post_counts_table.name)
+        return self._post_counts_created
+
+    def _rebuild_post_counts(self, conn):
+        published = self._post_table.c.draft == 0
+        columns = [sqla.func.count(),
+                   sqla.func.max(self._post_table.c.last_modified_date),
+                   sqla.func.max(self._post_table.c.id)]
+        total_statement = sqla.select(columns).select_from(
+            self._post_table).where(published)
+        tag_statement = sqla.select(
+            [self._tag_table.c.text] + columns).where(
+            sqla.and_(self._tag_posts_table.c.tag_id == self._tag_table.c.id,
+                      self._post_table.c.id ==
+                      self._tag_posts_table.c.post_id,
+                      published)).group_by(self._tag_table.c.text)
+        user_statement = sqla.select(
+            [self._user_posts_table.c.user_id] + columns).where(
+            sqla.and_(self._post_table.c.id ==
+                      self._user_posts_table.c.post_id,
+                      published)).group_by(self._user_posts_table.c.user_id)
+        counts = []
+        for kind, statement in (("all", total_statement),
+                                ("tag", tag_statement),
+                                ("user", user_statement)):
+            for row in conn.execute(statement):
+                name = row[0] if kind != "all" else ""
+                post_count, last_modified_date, max_post_id = row[-3:]
+                counts.append(dict(kind=kind, name=name,
+                                   post_count=post_count,
+                                   last_modified_date=last_modified_date,
+                                   max_post_id=max_post_id))
+        conn.execute(self._post_counts_table.delete())
+        conn.execute(self._post_counts_table.insert(), counts)
+
+    def _read_post_summary(self, tag, user_id, engine=None):
+        """
+        Read the summary of the published posts for the ``tag`` or the
+        ``user_id`` from the ``post_counts`` table, as returned by
+        ``get_last_modified``. The table is rebuilt on the primary database
+        if it has not been filled yet. Returns ``None`` if the table is not
+        available.
+        """
+        if tag:
+            key = ("tag", self.normalize_tags([tag])[0])
+        elif user_id:
+            key = ("user", str(user_id))
+        else:
+            key = ("all", "")
+        result = None
+        engine = engine or self._get_read_engine()
+        with self._begin(engine) as conn:
+            try:
+                if self._has_post_counts(conn):
+                    total = self._get_post_summary(("all", ""), conn)
+                    if total is None and engine is self._engine:
+                        with self._use_connection(conn, transaction=True):
+                            self._rebuild_post_counts(conn)
+                        total = self._get_post_summary(("all", ""), conn)
+                    if total is not None:
+                        result = total if key == ("all", "") else \
+                            self._get_post_summary(key, conn) or \
+                            dict(count=0, last_modified_date=None,
+                                 max_post_id=None)
+            except Exception as e:
+                self._logger.exception(str(e))
+                result = None
+        if result is None and engine is not self._engine:
+            result = self._read_post_summary(tag, user_id, self._engine)
+        return result
+
+    def _get_post_summary(self, key, conn):
+        counts = self._post_counts_table.c
+        statement = sqla.select(
+            [counts.post_count, counts.last_modified_date,
+             counts.max_post_id]).where(
+            sqla.and_(counts.kind == key[0], counts.name == key[1]))
+        row = conn.execute(statement).fetchone()
+        if row is None:
+            return None
+        return dict(count=row[0], last_modified_date=row[1],
+                    max_post_id=row[2])
+
+    def _get_post_count_keys(self, post_id, conn):
+        """
+        The ``post_counts`` keys that count the post given by ``post_id``,
+        which are none unless the post exists and is published.
+        """
+        if post_id is None:
+            return []
+        draft = conn.execute(sqla.select([self._post_table.c.draft]).where(
+            self._post_table.c.id == post_id)).scalar()
+        if draft is None or draft:
+            return []
+        tag_statement = sqla.select([self._tag_table.c.text]).where(
+            sqla.and_(self._tag_posts_table.c.tag_id == self._tag_table.c.id,
+                      self._tag_posts_table.c.post_id == post_id))
+        user_statement = sqla.select([self._user_posts_table.c.user_id]). \
+            where(self._user_posts_table.c.post_id == post_id)
+        keys = [("all", "")]
+        keys.extend(("tag", row[0]) for row in conn.execute(tag_statement))
+        keys.extend(("user", row[0]) for row in conn.execute(user_statement))
+        return keys
+
+    def _update_post_counts(self, old_keys, new_keys, conn,
+                            last_modified_date=None, post_id=None):
+        """
+        Move the counts of a post from the ``old_keys`` to the ``new_keys``,
+        in the transaction of the change to the post, and raise the last
+        modified date and the max id of the ``new_keys`` to those of the
+        post.
+        """
+        deltas = {}
+        for key in old_keys:
+            deltas[key] = deltas.get(key, 0) - 1
+        for key in new_keys:
+            deltas[key] = deltas.get(key, 0) + 1
+        modified = dict((key, (last_modified_date, post_id))
+                        for key in new_keys)
+        self._add_post_counts(deltas, conn, modified)
+
+    def _add_post_counts(self, deltas, conn, modified=None):
+        """
+        Add the ``deltas``, a dict of the change to the count for each
+        ``post_counts`` key, to the counts. The last modified date and the
+        max id of the keys in ``modified``, a dict of the last modified
+        date and the max id of the posts saved for each key, are raised to
+        these values.
+        """
+        modified = modified or {}
+        deltas = dict((key, delta) for key, delta in deltas.items() if delta)
+        if not (deltas or modified) or not self._has_post_counts(conn) or \
+                self._get_post_summary(("all", ""), conn) is None:
+            # the counts are rebuilt when they are first read
+            return
+        counts = self._post_counts_table.c
+        statement = sqla.select([counts.kind, counts.name]).where(
+            counts.name.in_(set(name for kind, name in deltas)))
+        existing = set(tuple(row) for row in conn.execute(statement))
+        # the missing counts are inserted as zero, ignoring the counts that
+        # were inserted concurrently by another writer, and then updated
+        inserts = [dict(kind=kind, name=name, post_count=0)
+                   for (kind, name), delta in deltas.items()
+                   if (kind, name) not in existing and delta > 0]
+        if inserts:
+            self._insert_or_ignore(self._post_counts_table, inserts,
+                                   ["kind", "name"], conn)
+        updates = []
+        for key in set(deltas) | set(modified):
+            last_modified_date, post_id = modified.get(key, (None, None))
+            updates.append(dict(b_kind=key[0], b_name=key[1],
+                                b_delta=deltas.get(key, 0),
+                                b_date=last_modified_date, b_id=post_id))
+        b_date = sqla.bindparam("b_date", type_=sqla.DateTime)
+        b_id = sqla.bindparam("b_id", type_=sqla.Integer)
+        # the maxes are not lowered when a post is removed, as the change
+        # to the count already changes the summary of the posts
+        conn.execute(self._post_counts_table.update().where(
+            sqla.and_(counts.kind == sqla.bindparam("b_kind"),
+                      counts.name == sqla.bindparam("b_name"))).values(
+            post_count=counts.post_count + sqla.bindparam("b_delta"),
+            last_modified_date=sqla.case(
+                [(sqla.or_(counts.last_modified_date.is_(None),
+                           counts.last_modified_date < b_date), b_date)],
+                else_=counts.last_modified_date),
+            max_post_id=sqla.case(
+                [(sqla.or_(counts.max_post_id.is_(None),
+                           counts.max_post_id < b_id), b_id)],
+                else_=counts.max_post_id)),
+            updates)
+
+    def _insert_posts(self, posts, conn):
+        """
+        Insert a chunk of new posts along with their tags, users and counts.
+        """
+        current_datetime = datetime.datetime.utcnow()
+        rows = []
+        for post in posts:
+            rendered_text = post.get("rendered_text")
+            rows.append(self._post_values(
+                title=post["title"], text=post["text"],
+                post_date=post.get("post_date") or current_datetime,
+                last_modified_date=post.get("last_modified_date") or
+                current_datetime,
+                draft=1 if post.get("draft") is True else 0,
+                rendered_text=rendered_text,
+                meta_data=self._dump_meta(post.get("meta_data"),
+                                          rendered_text),
+                render_version=post.get("render_version"),
+                excerpt_html=post.get("excerpt_html")))
+        post_ids = self._insert_post_rows(rows, conn)
+
+        post_tags = [list(OrderedDict.fromkeys(
+            self.normalize_tags(post.get("tags") or []))) for post in posts]
+        tags = list(OrderedDict.fromkeys(
+            tag for tags in post_tags for tag in tags))
+        tag_ids = self._get_tag_ids(tags, conn) if tags else {}
+        new_tags = [tag for tag in tags if tag not in tag_ids]
+        if new_tags:
+            self._insert_tags(new_tags, conn)
+            tag_ids.update(self._get_tag_ids(new_tags, conn, lock=True))
+
+        tag_posts = []
+        user_posts = []
+        deltas = {}
+        modified = {}
+        for post_id, post, tags, row in zip(post_ids, posts, post_tags, rows):
+            user_id = str(post["user_id"])
+            tag_posts.extend(dict(tag_id=tag_ids[tag], post_id=post_id)
+                             for tag in tags)
+            user_posts.append(dict(user_id=user_id, post_id=post_id))
+            if not row["draft"]:
+                keys = [("all", ""), ("user", user_id)]
+                keys.extend(("tag", tag) for tag in tags)
+                for key in keys:
+                    deltas[key] = deltas.get(key, 0) + 1
+                    last_modified_date, max_post_id = modified.get(
+                        key, (row["last_modified_date"], post_id))
+                    modified[key] = (
+                        max(last_modified_date, row["last_modified_date"]),
+                        max(max_post_id, post_id))
+        if tag_posts:
+            conn.execute(self._tag_posts_table.insert(), tag_posts)
+        conn.execute(self._user_posts_table.insert(), user_posts)
+        self._add_post_counts(deltas, conn, modified)
+
+    def _insert_post_rows(self, rows, conn):
+        """
+        Insert the post ``rows`` and return their ids.
+        """
+        if conn.dialect.name == "postgresql":
+            # a multiple row insert returns the ids in one round trip
+            statement = self._post_table.insert().values(rows).returning(
+                self._post_table.c.id)
+            return [row[0] for row in conn.execute(statement)]
+        # executemany does not return the ids of the rows, so the rows are
+        # inserted one at a time, in the transaction of the chunk
+        post_ids = []
+        for row in rows:
+            result = conn.execute(self._post_table.insert(), row)
+            post_ids.append(result.inserted_primary_key[0])
+        return post_ids
+
+    def _has_render_columns(self):
+        # tables reflected from an older schema lack the render columns
+        return "render_version" in self._post_table.c
+
+    def _has_excerpt_column(self):
+        return "excerpt_html" in self._post_table.c
+
+    def _post_values(self, **values):
+        """
+        The ``values`` for the columns that exist in the post table.
+        """
+        columns = self._post_table.c
+        return dict((k, v) for k, v in values.items() if k in columns)
+
+    @staticmethod
+    def _dump_meta(meta_data, rendered_text):
+        if rendered_text is None:
+            return None
+        return json.dumps(meta_data or {})
+
+    def _get_filter(self, tag, user_id, include_draft):
         filters = []
         if tag:
             tag = tag.upper()
-            tag_statement = sqla.select([self._tag_table.c.id]).where(
-                self._tag_table.c.text == tag)
-            tag_result = conn.execute(tag_statement).fetchone()
-            if tag_result is not None:
-                tag_id = tag_result[0]
-                tag_filter = sqla.and_(
-                    self._tag_posts_table.c.tag_id == tag_id,
-                    self._post_table.c.id == self._tag_posts_table.c.post_id
-                )
-                filters.append(tag_filter)
+            # join on the tag text, instead of looking up the tag id first
+            tag_filter = sqla.and_(
+                self._tag_table.c.text == tag,
+                self._tag_posts_table.c.tag_id == self._tag_table.c.id,
+                self._post_table.c.id == self._tag_posts_table.c.post_id
+            )
+            filters.append(tag_filter)
 
         if user_id:
             user_filter = sqla.and_(
@@ -329,70 +1041,171 @@ class SQLAStorage(Storage):
         sql_filter = sqla.and_(*filters)
         return sql_filter
 
-    def _save_tags(self, tags, post_id, conn):
+    def _get_ordering(self, descending):
+        columns = [self._post_table.c.post_date, self._post_table.c.id]
+        return [sqla.desc(c) for c in columns] if descending else columns
 
-        tags = self.normalize_tags(tags)
-        tag_ids = []
+    def _get_seek_filter(self, cursor, descending):
+        """
+        The filter for the posts that follow ``cursor`` in the
+        ``(post_date, id)`` ordering, so pages are located with an index
+        seek rather than by scanning and discarding ``OFFSET`` rows.
+        """
+        post_date, post_id = cursor
+        date_column = self._post_table.c.post_date
+        id_column = self._post_table.c.id
+        if descending:
+            return sqla.and_(date_column <= post_date,
+                             sqla.or_(date_column < post_date,
+                                      id_column < post_id))
+        else:
+            return sqla.and_(date_column >= post_date,
+                             sqla.or_(date_column > post_date,
+                                      id_column > post_id))
 
-        for tag in tags:  # iterate over given tags
-            try:
-                # check if the tag exists
-                statement = self._tag_table.select().where(
-                    self._tag_table.c.text == tag)
-                tag_result = conn.execute(statement).fetchone()
-                if tag_result is None:
-                    # insert if it is a new tag
-                    tag_insert_statement = self._tag_table.insert().\
-                        values(text=tag)
-                    result = conn.execute(tag_insert_statement)
-                    tag_id = result.inserted_primary_key[0]
-                else:
-                    # tag already exists
-                    tag_id = tag_result[0]
+    def _get_columns(self, summary):
+        if not summary:
+            return [self._post_table]
+        columns = self._post_table.c
+        summary_columns = [columns.id, columns.title, columns.post_date,
+                           columns.last_modified_date, columns.draft]
+        if self._has_excerpt_column():
+            summary_columns.extend([columns.excerpt_html,
+                                    columns.render_version])
+        return summary_columns
 
-            except sqla.exc.IntegrityError as e:
-                # some database error occurred;
-                tag_id = None
-                self._logger.exception(str(e))
+    def _serialise_posts(self, post_rows, conn, summary=False):
+        """
+        Convert the rows of the post table to post dicts. The tags and the
+        user of all the posts are fetched with a fixed number of ``IN``
+        queries per batch of posts, rather than with queries per post.
+        """
+        posts = []
+        render_columns = self._has_render_columns() and not summary
+        excerpt_column = self._has_excerpt_column()
+        for i in range(0, len(post_rows), self._in_batch_size):
+            batch = post_rows[i:i + self._in_batch_size]
+            post_ids = [row["id"] for row in batch]
+            tags = self._get_tags_by_post_ids(post_ids, conn)
+            users = self._get_users_by_post_ids(post_ids, conn)
+            for row in batch:
+                post_id = row["id"]
+                post = dict(post_id=post_id, title=row["title"],
+                            post_date=row["post_date"],
+                            last_modified_date=row["last_modified_date"],
+                            draft=row["draft"],
+                            tags=tags.get(post_id, []),
+                            user_id=users.get(post_id))
+                if not summary:
+                    post["text"] = row["text"]
+                if render_columns:
+                    meta_data = row["meta_data"]
+                    post.update(
+                        rendered_text=row["rendered_text"],
+                        meta=json.loads(meta_data) if meta_data else {},
+                        render_version=row["render_version"])
+                if excerpt_column:
+                    post["excerpt_html"] = row["excerpt_html"]
+                    post["render_version"] = row["render_version"]
+                posts.append(post)
+        return posts
 
-            except Exception as e:
-                # unknown exception occurred
-                tag_id = None
-                self._logger.exception(str(e))
+    def _get_tags_by_post_ids(self, post_ids, conn):
+        tag_statement = sqla.select([self._tag_posts_table.c.post_id,
+                                     self._tag_table.c.text]).where(
+            sqla.and_(self._tag_table.c.id == self._tag_posts_table.c.tag_id,
+                      self._tag_posts_table.c.post_id.in_(post_ids)))
+        tags = {}
+        for post_id, tag in conn.execute(tag_statement).fetchall():
+            tags.setdefault(post_id, []).append(tag)
+        return tags
 
-            if tag_id is not None:
-                # for a valid tag_id
-                tag_ids.append(tag_id)
+    def _get_users_by_post_ids(self, post_ids, conn):
+        user_statement = sqla.select([self._user_posts_table.c.post_id,
+                                      self._user_posts_table.c.user_id]).where(
+            self._user_posts_table.c.post_id.in_(post_ids))
+        return dict(conn.execute(user_statement).fetchall())
 
-                try:
-                    # check if given post has tag given by tag_id
-                    statement = self._tag_posts_table.select().where(
-                        sqla.and_(self._tag_posts_table.c.tag_id == tag_id,
-                                  self._tag_posts_table.c.post_id == post_id))
-                    tag_post_result = conn.execute(statement).fetchone()
-
-                    if tag_post_result is None:
-                        # if tag_id not present for the post given by post_id
-                        tag_post_statement = self._tag_posts_table.insert().\
-                            values(tag_id=tag_id, post_id=post_id)
-                        conn.execute(tag_post_statement)
+    def _save_tags(self, tags, post_id, conn):
 
-                except sqla.exc.IntegrityError as e:
-                    self._logger.exception(str(e))
-                except Exception as e:
-                    self._logger.exception(str(e))
+        # unique normalized tags, in the given order
+        tags = list(OrderedDict.fromkeys(self.normalize_tags(tags)))
         try:
-            # remove tags that have been deleted
-            statement = self._tag_posts_table.delete().where(
-                sqla.and_(sqla.not_(
-                    self._tag_posts_table.c.tag_id.in_(tag_ids)),
-                    self._tag_posts_table.c.post_id == post_id
-                )
-            )
-            conn.execute(statement)
+            tag_ids = self._get_tag_ids(tags, conn) if tags else {}
+            new_tags = [tag for tag in tags if tag not in tag_ids]
+            if new_tags:
+                self._insert_tags(new_tags, conn)
+                # the tags may have been inserted by a concurrent writer, so
+                # read them back with a locking read of the latest rows
+                tag_ids.update(self._get_tag_ids(new_tags, conn, lock=True))
+        except Exception as e:
+            self._logger.exception(str(e))
+            return
+
+        try:
+            tag_posts = self._tag_posts_table
+            statement = sqla.select([tag_posts.c.tag_id]).where(
+                tag_posts.c.post_id == post_id)
+            old_tag_ids = set(row[0] for row in conn.execute(statement))
+            new_tag_ids = set(tag_ids.values())
+            added = new_tag_ids - old_tag_ids
+            removed = old_tag_ids - new_tag_ids
+            if added:
+                # a single executemany for the new associations
+                conn.execute(tag_posts.insert(),
+                             [dict(tag_id=tag_id, post_id=post_id)
+                              for tag_id in sorted(added)])
+            if removed:
+                # remove tags that have been deleted
+                conn.execute(tag_posts.delete().where(
+                    sqla.and_(tag_posts.c.post_id == post_id,
+                              tag_posts.c.tag_id.in_(removed))))
         except Exception as e:
             self._logger.exception(str(e))
 
+    def _get_tag_ids(self, tags, conn, lock=False):
+        """
+        Get the ids of the existing ``tags`` with one ``IN`` query.
+        """
+        statement = sqla.select([self._tag_table.c.text,
+                                 self._tag_table.c.id]).where(
+            self._tag_table.c.text.in_(tags))
+        if lock:
+            statement = statement.with_for_update(read=True)
+        return dict(conn.execute(statement).fetchall())
+
+    def _insert_tags(self, tags, conn):
+        """
+        Insert the ``tags``, ignoring the tags that were inserted
+        concurrently by another writer.
+        """
+        self._insert_or_ignore(self._tag_table,
+                               [dict(text=tag) for tag in tags], ["text"],
+                               conn)
+
+    def _insert_or_ignore(self, table, rows, index_elements, conn):
+        """
+        Insert the ``rows`` into ``table``, ignoring the rows that conflict
+        on the unique ``index_elements`` with the rows inserted concurrently
+        by another writer.
+        """
+        dialect = conn.dialect.name
+        if dialect == "postgresql" and pg_insert is not None:
+            statement = pg_insert(table).on_conflict_do_nothing(
+                index_elements=index_elements)
+        elif dialect == "sqlite":
+            statement = table.insert().prefix_with("OR IGNORE")
+        elif dialect == "mysql":
+            statement = table.insert().prefix_with("IGNORE")
+        else:
+            for row in rows:
+                try:
+                    conn.execute(table.insert(), row)
+                except sqla.exc.IntegrityError as e:
+                    self._logger.debug(str(e))
+            return
+        conn.execute(statement, rows)
+
     def _save_user_post(self, user_id, post_id, conn):
         user_id = str(user_id)
         statement = sqla.select([self._user_posts_table]).where(
@@ -418,124 +1231,231 @@ class SQLAStorage(Storage):
     def _table_name(self, table_name):
         return self._table_prefix + table_name
 
-    def _create_all_tables(self):
+    def _initialize_tables(self):
+        """
+        Reflect the tables of the blog that exist in the database, and
+        define the missing ones, in a single connection. In the ``lazy``
+        mode, the missing tables are also created.
+        """
+        with self._engine.begin() as conn:
+            tables = self._load_tables(conn)
+        self._publish_tables(tables)
+
+    def _load_tables(self, conn):
+        table_names = self._reflect_tables(conn)
+        tables = self._create_all_tables(table_names)
+        post_indexes = self._get_post_indexes(tables["post"])
+        if self._lazy:
+            self._metadata.create_all(bind=conn, tables=list(tables.values()))
+        post_counts_created = self._lazy or \
+            self._table_name("post_counts") in table_names
+        return tables, post_indexes, post_counts_created
+
+    def _publish_tables(self, tables):
+        # the tables are published only once they are ready, as the other
+        # threads of a lazy storage use them without taking the lock
+        tables, self._post_indexes, self._post_counts_created = tables
+        self._post_table = tables["post"]
+        self._tag_table = tables["tag"]
+        self._tag_posts_table = tables["tag_posts"]
+        self._user_posts_table = tables["user_posts"]
+        self._post_counts_table = tables["post_counts"]
+        sqla_initialized.send(self, engine=self._engine,
+                              table_prefix=self._table_prefix,
+                              meta=self.metadata,
+                              bind=self._bind)
+
+    def _reflect_tables(self, conn):
+        """
+        Reflect only the tables of the blog, rather than all the tables of a
+        database shared with the rest of the application.
+
+        :return: The names of the tables of the blog in the database
+        """
+        names = set(self._table_name(table) for table in self._table_names)
+        table_names = names.intersection(
+            sqla.inspect(conn).get_table_names(schema=self._metadata.schema))
+        self._metadata.reflect(bind=conn, only=sorted(table_names))
+        return table_names
+
+    def _create_all_tables(self, table_names):
         """
         Creates all the required tables by calling the required functions.
-        :return:
+
+        :param table_names: The names of the tables in the database
+        :type table_names: set
+        :return: The tables by their name without the prefix
         """
-        self._create_post_table()
-        self._create_tag_table()
-        self._create_tag_posts_table()
-        self._create_user_posts_table()
+        return dict(
+            post=self._create_post_table(table_names),
+            tag=self._create_tag_table(table_names),
+            tag_posts=self._create_tag_posts_table(table_names),
+            user_posts=self._create_user_posts_table(table_names),
+            post_counts=self._create_post_counts_table(table_names))
 
-    def _create_post_table(self):
+    def _create_post_table(self, table_names):
         """
         Creates the table to store the blog posts.
         :return:
         """
-        with self._engine.begin() as conn:
-            post_table_name = self._table_name("post")
-            if not conn.dialect.has_table(conn, post_table_name):
-
-                self._post_table = sqla.Table(
-                    post_table_name, self._metadata,
-                    sqla.Column("id", sqla.Integer, primary_key=True),
-                    sqla.Column("title", sqla.String(256)),
-                    sqla.Column("text", sqla.Text),
-                    sqla.Column("post_date", sqla.DateTime),
-                    sqla.Column("last_modified_date", sqla.DateTime),
-                    # if 1 then make it a draft
-                    sqla.Column("draft", sqla.SmallInteger, default=0),
-                    info=self._info
+        post_table_name = self._table_name("post")
+        if post_table_name not in table_names:
+            table = sqla.Table(
+                post_table_name, self._metadata,
+                sqla.Column("id", sqla.Integer, primary_key=True),
+                sqla.Column("title", sqla.String(256)),
+                sqla.Column("text", sqla.Text),
+                sqla.Column("post_date", sqla.DateTime),
+                sqla.Column("last_modified_date", sqla.DateTime),
+                # if 1 then make it a draft
+                sqla.Column("draft", sqla.SmallInteger, default=0),
+                # the html rendered from text at save time
+                sqla.Column("rendered_text", sqla.Text),
+                sqla.Column("meta_data", sqla.Text),
+                sqla.Column("render_version", sqla.String(40)),
+                sqla.Column("excerpt_html", sqla.Text),
+                info=self._info
 
-                )
-                self._logger.debug("Created table with table name %s" %
-                                   post_table_name)
-            else:
-                self._post_table = self._metadata.tables[post_table_name]
-                self._logger.debug("Reflecting to table with table name %s" %
-                                   post_table_name)
+            )
+            self._logger.debug("Created table with table name %s" %
+                               post_table_name)
+        else:
+            table = self._metadata.tables[post_table_name]
+            self._logger.debug("Reflecting to table with table name %s" %
+                               post_table_name)
+        return table
+
+    def _get_post_indexes(self, post_table):
+        """
+        The indexes of the post table for the listing queries, which filter
+        on ``draft`` and sort on ``post_date`` and ``id``. The indexes are
+        added to the table in the metadata, so that they are created along
+        with a new table, and are reused if they were reflected.
+        """
+        definitions = [
+            # the published posts, or the drafts, newest first. The tag and
+            # author listings find their posts through the unique constraints
+            # of the tag_posts and user_posts tables, but still sort them, as
+            # the post_date is not in the join tables.
+            ("draft", "post_date", "id"),
+        ]
+        indexes = dict((index.name, index) for index in post_table.indexes)
+        post_indexes = []
+        for columns in definitions:
+            name = "ix_%s_%s" % (post_table.name, "_".join(columns))
+            if name not in indexes:
+                indexes[name] = sqla.Index(
+                    name, *[post_table.c[column] for column in columns])
+            post_indexes.append(indexes[name])
+        return post_indexes
 
-    def _create_tag_table(self):
+    def _create_tag_table(self, table_names):
         """
         Creates the table to store blog post tags.
         :return:
         """
-        with self._engine.begin() as conn:
-            tag_table_name = self._table_name("tag")
-            if not conn.dialect.has_table(conn, tag_table_name):
-                self._tag_table = sqla.Table(
-                    tag_table_name, self._metadata,
-                    sqla.Column("id", sqla.Integer, primary_key=True),
-                    sqla.Column("text", sqla.String(128), unique=True,
-                                index=True),
-                    info=self._info
-                )
-                self._logger.debug("Created table with table name %s" %
-                                   tag_table_name)
-            else:
-                self._tag_table = self._metadata.tables[tag_table_name]
-                self._logger.debug("Reflecting to table with table name %s" %
-                                   tag_table_name)
+        tag_table_name = self._table_name("tag")
+        if tag_table_name not in table_names:
+            table = sqla.Table(
+                tag_table_name, self._metadata,
+                sqla.Column("id", sqla.Integer, primary_key=True),
+                sqla.Column("text", sqla.String(128), unique=True,
+                            index=True),
+                info=self._info
+            )
+            self._logger.debug("Created table with table name %s" %
+                               tag_table_name)
+        else:
+            table = self._metadata.tables[tag_table_name]
+            self._logger.debug("Reflecting to table with table name %s" %
+                               tag_table_name)
+        return table
 
-    def _create_tag_posts_table(self):
+    def _create_tag_posts_table(self, table_names):
         """
         Creates the table to store association info between blog posts and
         tags.
         :return:
         """
-        with self._engine.begin() as conn:
-            tag_posts_table_name = self._table_name("tag_posts")
-            if not conn.dialect.has_table(conn, tag_posts_table_name):
-                tag_id_key = self._table_name("tag") + ".id"
-                post_id_key = self._table_name("post") + ".id"
-                self._tag_posts_table = sqla.Table(
-                    tag_posts_table_name, self._metadata,
-                    sqla.Column('tag_id', sqla.Integer,
-                                sqla.ForeignKey(tag_id_key, onupdate="CASCADE",
-                                                ondelete="CASCADE"),
-                                index=True),
-                    sqla.Column('post_id', sqla.Integer,
-                                sqla.ForeignKey(post_id_key,
-                                                onupdate="CASCADE",
-                                                ondelete="CASCADE"),
-                                index=True),
-                    sqla.UniqueConstraint('tag_id', 'post_id', name='uix_1'),
-                    info=self._info
-                )
-                self._logger.debug("Created table with table name %s" %
-                                   tag_posts_table_name)
-            else:
-                self._tag_posts_table = \
-                    self._metadata.tables[tag_posts_table_name]
-                self._logger.debug("Reflecting to table with table name %s" %
-                                   tag_posts_table_name)
+        tag_posts_table_name = self._table_name("tag_posts")
+        if tag_posts_table_name not in table_names:
+            tag_id_key = self._table_name("tag") + ".id"
+            post_id_key = self._table_name("post") + ".id"
+            table = sqla.Table(
+                tag_posts_table_name, self._metadata,
+                sqla.Column('tag_id', sqla.Integer,
+                            sqla.ForeignKey(tag_id_key, onupdate="CASCADE",
+                                            ondelete="CASCADE"),
+                            index=True),
+                sqla.Column('post_id', sqla.Integer,
+                            sqla.ForeignKey(post_id_key,
+                                            onupdate="CASCADE",
+                                            ondelete="CASCADE"),
+                            index=True),
+                sqla.UniqueConstraint('tag_id', 'post_id', name='uix_1'),
+                info=self._info
+            )
+            self._logger.debug("Created table with table name %s" %
+                               tag_posts_table_name)
+        else:
+            table = self._metadata.tables[tag_posts_table_name]
+            self._logger.debug("Reflecting to table with table name %s" %
+                               tag_posts_table_name)
+        return table
 
-    def _create_user_posts_table(self):
+    def _create_user_posts_table(self, table_names):
         """
         Creates the table to store association info between user and blog
         posts.
         :return:
         """
-        with self._engine.begin() as conn:
-            user_posts_table_name = self._table_name("user_posts")
-            if not conn.dialect.has_table(conn, user_posts_table_name):
-                post_id_key = self._table_name("post") + ".id"
-                self._user_posts_table = sqla.Table(
-                    user_posts_table_name, self._metadata,
-                    sqla.Column("user_id", sqla.String(128), index=True),
-                    sqla.Column("post_id", sqla.Integer,
-                                sqla.ForeignKey(post_id_key,
-                                                onupdate="CASCADE",
-                                                ondelete="CASCADE"),
-                                index=True),
-                    sqla.UniqueConstraint('user_id', 'post_id', name='uix_2'),
-                    info=self._info
-                )
-                self._logger.debug("Created table with table name %s" %
-                                   user_posts_table_name)
-            else:
-                self._user_posts_table = \
-                    self._metadata.tables[user_posts_table_name]
-                self._logger.debug("Reflecting to table with table name %s" %
-                                   user_posts_table_name)
+        user_posts_table_name = self._table_name("user_posts")
+        if user_posts_table_name not in table_names:
+            post_id_key = self._table_name("post") + ".id"
+            table = sqla.Table(
+                user_posts_table_name, self._metadata,
+                sqla.Column("user_id", sqla.String(128), index=True),
+                sqla.Column("post_id", sqla.Integer,
+                            sqla.ForeignKey(post_id_key,
+                                            onupdate="CASCADE",
+                                            ondelete="CASCADE"),
+                            index=True),
+                sqla.UniqueConstraint('user_id', 'post_id', name='uix_2'),
+                info=self._info
+            )
+            self._logger.debug("Created table with table name %s" %
+                               user_posts_table_name)
+        else:
+            table = self._metadata.tables[user_posts_table_name]
+            self._logger.debug("Reflecting to table with table name %s" %
+                               user_posts_table_name)
+        return table
+
+    def _create_post_counts_table(self, table_names):
+        """
+        Creates the table to store the number of published posts in total,
+        per tag and per author.
+        :return:
+        """
+        post_counts_table_name = self._table_name("post_counts")
+        if post_counts_table_name not in table_names:
+            table = sqla.Table(
+                post_counts_table_name, self._metadata,
+                # "all", "tag" or "user"
+                sqla.Column("kind", sqla.String(8), primary_key=True),
+                # the tag text or the user_id
+                sqla.Column("name", sqla.String(128), primary_key=True),
+                sqla.Column("post_count", sqla.Integer, default=0),
+                # the last modified date and the largest id of the counted
+                # posts, which validate the conditional requests
+                sqla.Column("last_modified_date", sqla.DateTime),
+                sqla.Column("max_post_id", sqla.Integer),
+                info=self._info
+            )
+            self._logger.debug("Created table with table name %s" %
+                               post_counts_table_name)
+        else:
+            table = self._metadata.tables[post_counts_table_name]
+            self._logger.debug("Reflecting to table with table name %s" %
+                               post_counts_table_name)
+        return table
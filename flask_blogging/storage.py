@@ -1,14 +1,23 @@
 try:
-    from builtins import object
+    from builtins import object, str
 except ImportError:
     pass
+import base64
+import itertools
+import datetime
+import inspect
 
 
 class Storage(object):
 
+    _cursor_format = "%Y%m%d%H%M%S%f"
+    # whether the methods of the storage classes accept a keyword argument
+    _accepted_arguments = {}
+
     def save_post(self, title, text, user_id, tags, draft=False,
                   post_date=None, last_modified_date=None, meta_data=None,
-                  post_id=None):
+                  post_id=None, rendered_text=None, render_version=None,
+                  excerpt_html=None):
         """
         Persist the blog post data. If ``post_id`` is ``None`` or ``post_id``
         is invalid, the post must be inserted into the storage. If ``post_id``
@@ -35,6 +44,15 @@ class Storage(object):
         :param post_id: The post identifier. This should be ``None`` for an
          insert call, and a valid value for update.
         :type post_id: int
+        :param rendered_text: (Optional) The html rendered from ``text``, to
+         be returned by the storage to avoid rendering the post on reads.
+        :type rendered_text: str
+        :param render_version: (Optional) The
+         ``PostProcessor.render_version`` used for ``rendered_text``
+        :type render_version: str
+        :param excerpt_html: (Optional) The html rendered from the excerpt of
+         ``text``, to be returned on the listing pages
+        :type excerpt_html: str
 
         :return: The post_id value, in case of a successful insert or update.
         Return ``None`` if there were errors.
@@ -42,6 +60,69 @@ class Storage(object):
         raise NotImplementedError("This method needs to be implemented by "
                                   "the inheriting class")
 
+    def save_posts(self, posts, chunk_size=1000):
+        """
+        Insert many new posts, such as when migrating the posts from another
+        system. Storage implementations should override this method to
+        insert the posts in bulk. The default implementation calls
+        ``save_post`` for each post, and stops at the first post that could
+        not be saved.
+
+        :param posts: An iterable of dicts with the keyword arguments of
+         ``save_post``, other than ``post_id``, for each post
+        :type posts: iterable
+        :param chunk_size: The number of posts inserted per transaction
+         (default 1000)
+        :type chunk_size: int
+        :return: The number of posts that were inserted.
+        """
+        saved = 0
+        for post in posts:
+            post = dict(post)
+            post.pop("post_id", None)
+            if self.save_post(**post) is None:
+                break
+            saved += 1
+        return saved
+
+    def update_rendered_text(self, post_id, rendered_text, meta_data,
+                             render_version, excerpt_html=None):
+        """
+        Persist the rendered html of a post whose stored rendering was missing
+        or stale. Storage implementations that do not persist the rendered
+        text need not override this method.
+
+        :param post_id: The post identifier
+        :type post_id: int
+        :param rendered_text: The html rendered from the post text
+        :type rendered_text: str
+        :param meta_data: The meta data parsed from the post text
+        :type meta_data: dict
+        :param render_version: The ``PostProcessor.render_version`` used to
+         render the text
+        :type render_version: str
+        :param excerpt_html: (Optional) The html rendered from the excerpt of
+         the post text
+        :type excerpt_html: str
+        :return: Returns True if the rendered text was saved and False
+         otherwise.
+        """
+        return False
+
+    def get_stale_posts(self, render_version, count=100):
+        """
+        Get the posts, including the drafts, whose rendered text was not
+        persisted with the given ``render_version``. Storage implementations
+        that do not persist the rendered text need not override this method.
+
+        :param render_version: The current ``PostProcessor.render_version``
+        :type render_version: str
+        :param count: The maximum number of posts to retrieve (default 100)
+        :type count: int
+        :return: A list of posts
+        """
+        return []
+
     def get_post_by_id(self, post_id):
         """
         Fetch the blog post given by ``post_id``
@@ -55,7 +136,8 @@ class Storage(object):
                                   "inheriting class")
 
     def get_posts(self, count=10, offset=0, recent=True,  tag=None,
-                  user_id=None, include_draft=False):
+                  user_id=None, include_draft=False, before=None, after=None,
+                  summary=False):
         """
         Get posts given by filter criteria
 
@@ -72,6 +154,19 @@ class Storage(object):
         :type user_id: str
         :param include_draft: Whether to include posts marked as draft or not
         :type include_draft: bool
+        :param before: (Optional) A cursor created by ``encode_cursor``. Only
+         the posts that precede the cursor post in the requested ordering are
+         returned. The ``offset`` is ignored when a cursor is given.
+        :type before: str
+        :param after: (Optional) A cursor created by ``encode_cursor``. Only
+         the posts that follow the cursor post in the requested ordering are
+         returned. The ``offset`` is ignored when a cursor is given.
+        :type after: str
+        :param summary: (Optional) If ``True``, the posts only have the
+         ``post_id``, ``title``, ``post_date``, ``last_modified_date``,
+         ``draft``, ``tags`` and ``user_id`` values, and the text of the posts
+         is not fetched. (default ``False``)
+        :type summary: bool
 
         :return: A list of posts, with each element a dict containing values
          for the following keys: (title, text, draft, post_date,
@@ -81,6 +176,77 @@ class Storage(object):
         raise NotImplementedError("This method needs to be implemented by the "
                                   "inheriting class")
 
+    def iter_posts(self, count=None, recent=True, tag=None, user_id=None,
+                   include_draft=False, batch_size=100, summary=False):
+        """
+        Iterate over the posts given by filter criteria, without loading all
+        of them into memory. The default implementation fetches the posts
+        with ``get_posts``, ``batch_size`` posts at a time. Storage
+        implementations can override this method to stream the posts.
+
+        :param count: The number of posts to retrieve. If count is ``None``,
+         all the posts are returned.
+        :type count: int
+        :param recent: Order by recent posts or not
+        :type recent: bool
+        :param tag: Filter by a specific tag
+        :type tag: str
+        :param user_id: Filter by a specific user
+        :type user_id: str
+        :param include_draft: Whether to include posts marked as draft or not
+        :type include_draft: bool
+        :param batch_size: The number of posts fetched from the storage at a
+         time (default 100)
+        :type batch_size: int
+        :param summary: (Optional) If ``True``, the posts only have the
+         ``post_id``, ``title``, ``post_date``, ``last_modified_date``,
+         ``draft``, ``tags`` and ``user_id`` values, and the text of the posts
+         is not fetched. (default ``False``)
+        :type summary: bool
+        :return: An iterator of posts, like the ones returned by
+         ``get_posts``.
+        """
+        offset = 0
+        while count is None or offset < count:
+            limit = batch_size if count is None else \
+                min(batch_size, count - offset)
+            # the summary is only asked for when it is needed, as the
+            # get_posts of earlier storage implementations lacks it
+            options = dict(summary=True) if summary else {}
+            posts = self.get_posts(count=limit, offset=offset, recent=recent,
+                                   tag=tag, user_id=user_id,
+                                   include_draft=include_draft, **options)
+            for post in posts:
+                yield post
+            if len(posts) < limit:
+                break
+            offset += limit
+
+    def iter_sitemap_entries(self, count=None, offset=0, batch_size=1000):
+        """
+        Iterate over the published posts listed in the sitemap, in a stable
+        order, without loading all of them into memory. Storage
+        implementations should override this method to fetch only the
+        columns needed by the sitemap.
+
+        :param count: The number of posts to retrieve. If count is ``None``,
+         all the posts are returned.
+        :type count: int
+        :param offset: The number of posts to offset (default 0)
+        :type offset: int
+        :param batch_size: The number of posts fetched from the storage at a
+         time (default 1000)
+        :type batch_size: int
+        :return: An iterator of dicts with the ``post_id``, ``title`` and
+         ``last_modified_date`` of the posts.
+        """
+        posts = self.iter_posts(
+            count=None if count is None else offset + count, recent=False,
+            include_draft=False, batch_size=batch_size)
+        for post in itertools.islice(posts, offset, None):
+            yield dict(post_id=post["post_id"], title=post["title"],
+                       last_modified_date=post["last_modified_date"])
+
     def count_posts(self, tag=None, user_id=None, include_draft=False):
         """
         Returns the total number of posts for the give filter
@@ -96,6 +262,55 @@ class Storage(object):
         raise NotImplementedError("This method needs to be implemented by the "
                                   "inheriting class")
 
+    def get_last_modified(self, post_id=None, tag=None, user_id=None,
+                          include_draft=False):
+        """
+        Get a cheap summary of the posts for the given filter, used by the
+        views to validate conditional requests without fetching the posts.
+        Storage implementations that cannot compute the summary cheaply need
+        not override this method.
+
+        :param post_id: (Optional) Summarise only the post with this
+         identifier, whether it is a draft or not. The other filters are
+         ignored when ``post_id`` is given.
+        :type post_id: int
+        :param tag: Filter by a specific tag
+        :type tag: str
+        :param user_id: Filter by a specific user
+        :type user_id: str
+        :param include_draft: Whether to include posts marked as draft or not
+        :type include_draft: bool
+        :return: A dict with the ``last_modified_date``, the ``max_post_id``
+         and the ``count`` of the posts, or ``None`` if the summary is not
+         available.
+        """
+        return None
+
+    def use_primary(self, primary=True):
+        """
+        Read the posts from the primary database rather than from the read
+        replicas, in the current thread. Storage implementations without read
+        replicas need not override this method.
+
+        :param primary: If ``True``, the reads go to the primary database
+        :type primary: bool
+        """
+        pass
+
+    def bind_connection(self):
+        """
+        Run the storage calls of the current thread on one connection, until
+        ``release_connection`` is called. Storage implementations without
+        connections need not override this method.
+        """
+        pass
+
+    def release_connection(self):
+        """
+        Release the connection bound by ``bind_connection``.
+        """
+        pass
+
     def delete_post(self, post_id):
         """
         Delete the post defined by ``post_id``
@@ -108,6 +323,76 @@ class Storage(object):
         raise NotImplementedError("This method needs to be implemented by the "
                                   "inheriting class")
 
+    def accepts_argument(self, method, argument):
+        """
+        Check if the ``method`` of the storage accepts the keyword
+        ``argument``. The storage implementations written for earlier
+        versions lack the arguments added since, such as the ``summary`` of
+        ``get_posts`` or the ``rendered_text`` of ``save_post``, so these
+        are only passed to the storages that accept them. The result is
+        computed once per storage class.
+
+        :param method: The name of the method
+        :type method: str
+        :param argument: The name of the keyword argument
+        :type argument: str
+        :return: ``True`` if the method accepts the argument
+        """
+        key = (type(self), method, argument)
+        accepted = Storage._accepted_arguments.get(key)
+        if accepted is None:
+            func = getattr(self, method)
+            try:
+                parameters = inspect.signature(func).parameters.values()
+                accepted = any(
+                    parameter.name == argument or
+                    parameter.kind == parameter.VAR_KEYWORD
+                    for parameter in parameters)
+            except AttributeError:  # Python 2 has no inspect.signature
+                spec = inspect.getargspec(func)
+                accepted = argument in spec.args or \
+                    spec.keywords is not None
+            Storage._accepted_arguments[key] = accepted
+        return accepted
+
     @staticmethod
     def normalize_tags(tags):
         return [tag.upper().strip() for tag in tags]
+
+    @staticmethod
+    def encode_cursor(post):
+        """
+        Create an opaque pagination cursor for the given post. Posts are
+        ordered by ``(post_date, post_id)``, and the cursor marks the
+        position of the post in that ordering.
+
+        :param post: The post dict with ``post_date`` and ``post_id`` values
+        :type post: dict
+        :return: A url safe string
+        """
+        value = "%s_%d" % (post["post_date"].strftime(Storage._cursor_format),
+                           post["post_id"])
+        cursor = base64.urlsafe_b64encode(value.encode("ascii"))
+        return cursor.decode("ascii").rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """
+        Decode a cursor created by ``encode_cursor``.
+
+        :param cursor: The cursor string
+        :type cursor: str
+        :return: A tuple of ``(post_date, post_id)``. Raises ``ValueError``
+         for an invalid cursor.
+        """
+        try:
+            cursor = str(cursor)
+            padding = "=" * (-len(cursor) % 4)
+            value = base64.urlsafe_b64decode((cursor + padding).
+                                             encode("ascii"))
+            post_date, post_id = value.decode("ascii").split("_")
+            return (datetime.datetime.strptime(post_date,
+                                               Storage._cursor_format),
+                    int(post_id))
+        except (TypeError, ValueError, UnicodeError) as e:
+            raise ValueError("Invalid cursor %r: %s" % (cursor, e))
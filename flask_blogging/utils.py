@@ -1,3 +1,12 @@
+try:
+    from builtins import object
+except ImportError:
+    pass
+import threading
+import time
+from collections import OrderedDict
+
+
 def ensureUtf(s, encoding='utf8'):
     """Converts input to unicode if necessary.
     If `s` is bytes, it will be decoded using the `encoding` parameters.
@@ -11,3 +20,100 @@ def ensureUtf(s, encoding='utf8'):
         return s.decode(encoding, 'ignore')
     else:
         return s
+
+
+class LRUCache(object):
+    """
+    A thread safe, in process cache that evicts the least recently used
+    entries once it holds more than ``max_entries`` entries, or more than
+    ``max_bytes`` bytes as measured by ``size_func``. Entries can also
+    expire after a timeout. The ``get``, ``set`` and ``delete`` methods
+    mirror those of the ``werkzeug`` and ``Flask-Cache`` caches.
+
+    :param max_entries: The maximum number of entries (default 1000). A
+     value of ``0`` disables the cache.
+    :type max_entries: int
+    :param max_bytes: (Optional) The maximum total size of the entries
+    :type max_bytes: int
+    :param size_func: (Optional) A function that returns the size in bytes of
+     a cached value. Required to enforce ``max_bytes``.
+    :type size_func: function
+    :param default_timeout: (Optional) The number of seconds after which the
+     entries expire. If ``None``, the entries do not expire.
+    :type default_timeout: int
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=None, size_func=None,
+                 default_timeout=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_func = size_func
+        self.default_timeout = default_timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get the value cached for ``key``, or ``None`` on a cache miss.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[2] is not None and \
+                    entry[2] <= time.time():
+                self._bytes -= entry[1]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, timeout=None):
+        """
+        Cache ``value`` for ``key``, evicting the least recently used entries
+        if the cache is full.
+        """
+        if not self.max_entries:
+            return
+        timeout = self.default_timeout if timeout is None else timeout
+        expires = None if timeout is None else time.time() + timeout
+        size = self.size_func(value) if self.size_func else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self._bytes -= old_entry[1]
+            self._entries[key] = (value, size, expires)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and
+                     self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[1]
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def info(self):
+        """
+        The statistics of the cache, useful to size the cache.
+
+        :return: A dict with the ``hits``, ``misses``, ``entries`` and
+         ``bytes`` values
+        """
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        entries=len(self._entries), bytes=self._bytes)
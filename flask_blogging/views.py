@@ -4,13 +4,21 @@ try:
 except ImportError:
     pass
 from .processor import PostProcessor
+from functools import wraps
 from flask_login import login_required, current_user
 from flask import Blueprint, current_app, render_template, request, redirect, \
-    url_for, flash, make_response
+    url_for, flash, make_response, session, stream_with_context, abort, g
 from flask_blogging.forms import BlogEditor
 import math
+import itertools
 from werkzeug.contrib.atom import AtomFeed
+from werkzeug.http import is_resource_modified
 import datetime
+import hashlib
+import logging
+import threading
+import time
+import uuid
 from flask_principal import PermissionDenied
 from .signals import page_by_id_fetched, page_by_id_processed, \
     posts_by_tag_fetched, posts_by_tag_processed, \
@@ -20,6 +28,7 @@ from .signals import page_by_id_fetched, page_by_id_processed, \
     sitemap_posts_fetched, sitemap_posts_processed, editor_post_saved, \
     post_deleted, editor_get_fetched
 from .utils import ensureUtf
+from .storage import Storage
 
 
 def _get_blogging_engine(app):
@@ -31,18 +40,54 @@ def _get_user_name(user):
     return user_name
 
 
-def _clear_cache(cache):
-    cache.delete_memoized(index)
-    cache.delete_memoized(page_by_id)
-    cache.delete_memoized(posts_by_author)
-    cache.delete_memoized(posts_by_tag)
-    cache.delete_memoized(sitemap)
-    cache.delete_memoized(feed)
+def _dependency_key(dependency):
+    return "blogging:dependency:%s" % dependency
 
 
-def _store_form_data(blog_form, storage, user, post):
+def _get_dependency_versions(cache, dependencies):
+    """
+    Get the current version token of each dependency. The cached views
+    include these tokens in their cache keys, so deleting a token
+    invalidates all the cached pages that depend on it.
+    """
+    keys = [_dependency_key(dependency) for dependency in dependencies]
+    versions = list(cache.get_many(*keys))
+    for i, version in enumerate(versions):
+        if version is None:
+            cache.add(keys[i], uuid.uuid4().hex, timeout=0)
+            versions[i] = cache.get(keys[i])
+    return versions
+
+
+def _invalidate_cache(cache, post_id, posts):
+    """
+    Invalidate the cached pages that depend on a post that was saved or
+    deleted, which are the page of the post, the index pages, the sitemap,
+    the feed, and the pages of the tags and authors of ``posts``.
+
+    :param cache: The cache object
+    :param post_id: The id of the post that was changed
+    :param posts: The old and the new versions of the post
+    """
+    dependencies = set(["index", "sitemap", "feed", "post:%s" % post_id])
+    for post in posts:
+        for tag in Storage.normalize_tags(post.get("tags", [])):
+            dependencies.add("tag:%s" % tag)
+        if post.get("user_id") is not None:
+            dependencies.add("author:%s" % post["user_id"])
+    # delete the keys one at a time, some cache backends stop deleting at
+    # the first key that is missing
+    for dependency in dependencies:
+        cache.delete(_dependency_key(dependency))
+
+
+def _store_form_data(blog_form, storage, user, post, post_processor):
     title = blog_form.title.data
     text = blog_form.text.data
+    # render at save time, so that the reads need not render the markdown
+    rendered_post = dict(text=text)
+    post_processor.render_text(rendered_post)
+    post_processor.render_excerpt(rendered_post)
     tags = blog_form.tags.data.split(",")
     draft = blog_form.draft.data
     user_id = user.get_id()
@@ -50,45 +95,157 @@ def _store_form_data(blog_form, storage, user, post):
     post_date = post.get("post_date", current_datetime)
     last_modified_date = datetime.datetime.utcnow()
     post_id = post.get("post_id")
+    rendered = dict(rendered_text=rendered_post["rendered_text"],
+                    render_version=post_processor.render_version(),
+                    excerpt_html=rendered_post["excerpt_html"])
+    # the storages of earlier versions render the posts on every read
+    rendered = dict((name, value) for name, value in rendered.items()
+                    if storage.accepts_argument("save_post", name))
     pid = storage.save_post(title, text, user_id, tags, draft=draft,
                             post_date=post_date,
                             last_modified_date=last_modified_date,
-                            post_id=post_id)
+                            meta_data=rendered_post["meta"], post_id=post_id,
+                            **rendered)
     return pid
 
 
+def _pin_primary(blogging_engine):
+    # the reads of the blogger go to the primary database for a while after
+    # a write, so that the pages do not show the posts of a lagging replica
+    seconds = blogging_engine.config.get("BLOGGING_PIN_PRIMARY_SECONDS", 10)
+    if seconds:
+        session["blogging_primary_until"] = time.time() + seconds
+
+
+def _use_primary():
+    blogging_engine = _get_blogging_engine(current_app)
+    primary = request.method not in ("GET", "HEAD") or \
+        session.get("blogging_primary_until", 0) > time.time()
+    blogging_engine.storage.use_primary(primary)
+
+
+def _reset_primary(exception):
+    blogging_engine = _get_blogging_engine(current_app)
+    blogging_engine.storage.use_primary(False)
+
+
+def _bind_connection():
+    # the storage calls of the request share a connection
+    blogging_engine = _get_blogging_engine(current_app)
+    if blogging_engine.config.get("BLOGGING_REQUEST_CONNECTION", False):
+        blogging_engine.storage.bind_connection()
+
+
+def _release_connection(exception):
+    blogging_engine = _get_blogging_engine(current_app)
+    blogging_engine.storage.release_connection()
+
+
+def _get_listing_endpoint(tag=None, user_id=None):
+    if tag:
+        return "blogging.posts_by_tag", dict(tag=tag)
+    elif user_id:
+        return "blogging.posts_by_author", dict(user_id=user_id)
+    else:
+        return "blogging.index", {}
+
+
 def _get_meta(storage, count, page, tag=None, user_id=None):
     max_posts = storage.count_posts(tag=tag, user_id=user_id)
     max_pages = math.ceil(float(max_posts)/float(count))
-    max_offset = (max_pages-1)*count
-    offset = min(max(0, (page-1)*count), max_offset)
-    if (tag is None) and (user_id is None):
-        prev_page = None if page <= 1 else url_for(
-            "blogging.index", count=count, page=page-1)
-        next_page = None if page >= max_pages else url_for(
-            "blogging.index", count=count, page=page+1)
-    elif tag:
-        prev_page = None if page <= 1 else url_for(
-            "blogging.posts_by_tag", tag=tag, count=count, page=page-1)
-        next_page = None if page >= max_pages else url_for(
-            "blogging.posts_by_tag", tag=tag, count=count, page=page+1)
-    elif user_id:
+    max_offset = max(0, (max_pages-1)*count)
+    endpoint, values = _get_listing_endpoint(tag, user_id)
+    if page is None:
+        # the page is located with a cursor instead of a page number
+        offset = 0
+        prev_page = next_page = None
+    else:
+        offset = min(max(0, (page-1)*count), max_offset)
         prev_page = None if page <= 1 else url_for(
-            "blogging.posts_by_author", user_id=user_id, count=count,
-            page=page-1)
+            endpoint, count=count, page=page-1, **values)
         next_page = None if page >= max_pages else url_for(
-            "blogging.posts_by_author", user_id=user_id, count=count,
-            page=page+1)
-    else:
-        prev_page = next_page = None
+            endpoint, count=count, page=page+1, **values)
 
-    pagination = dict(prev_page=prev_page, next_page=next_page)
+    pagination = dict(prev_page=prev_page, next_page=next_page, before=None,
+                      after=None)
     meta = dict(max_posts=max_posts, max_pages=max_pages, page=page,
                 max_offset=max_offset, offset=offset, count=count,
                 pagination=pagination)
     return meta
 
 
+def _get_page_posts(storage, meta, before=None, after=None, tag=None,
+                    user_id=None, summary=False):
+    """
+    Fetch the posts of a listing page, and set the ``before`` and ``after``
+    cursor urls of the pages adjacent to it in ``meta["pagination"]``.
+    Aborts with ``404`` if a cursor of the url is invalid, or if the
+    storage does not support the cursors.
+    """
+    cursors = storage.accepts_argument("get_posts", "before")
+    for cursor in (before, after):
+        if cursor is not None:
+            if not cursors:
+                abort(404)
+            try:
+                Storage.decode_cursor(cursor)
+            except ValueError:
+                abort(404)
+    count = meta["count"]
+    # only the arguments that are set are passed, as the get_posts of the
+    # storages of earlier versions lacks them
+    options = dict(summary=True) if summary and \
+        storage.accepts_argument("get_posts", "summary") else {}
+    if before is None and after is None:
+        posts = storage.get_posts(count=count, offset=meta["offset"],
+                                  tag=tag, user_id=user_id,
+                                  include_draft=False, recent=True, **options)
+        has_prev = meta["page"] > 1
+        has_next = meta["page"] < meta["max_pages"]
+    else:
+        # fetch an extra post to find if there is a page beyond this one
+        if after is not None:
+            options["after"] = after
+        else:
+            options["before"] = before
+        posts = storage.get_posts(count=count + 1, offset=None, tag=tag,
+                                  user_id=user_id, include_draft=False,
+                                  recent=True, **options)
+        has_more = len(posts) > count
+        if after is not None:
+            posts = posts[:count]
+            has_prev, has_next = True, has_more
+        else:
+            posts = posts[-count:]
+            has_prev, has_next = has_more, True
+
+    pagination = meta["pagination"]
+    endpoint, values = _get_listing_endpoint(tag, user_id)
+    if posts and has_prev and cursors:
+        pagination["before"] = url_for(
+            endpoint, count=count, before=storage.encode_cursor(posts[0]),
+            **values)
+    if posts and has_next and cursors:
+        pagination["after"] = url_for(
+            endpoint, count=count, after=storage.encode_cursor(posts[-1]),
+            **values)
+    if meta["page"] is None:
+        pagination["prev_page"] = pagination["before"]
+        pagination["next_page"] = pagination["after"]
+    return posts
+
+
+def _get_listing_options(config):
+    """
+    The listing pages fetch only a summary of the posts without their text,
+    unless ``BLOGGING_LISTING_FULL_TEXT`` is set for templates that show it.
+    Returns the ``summary`` and ``render`` options of the listing.
+    """
+    full_text = config.get("BLOGGING_LISTING_FULL_TEXT", False)
+    render = full_text and config.get("BLOGGING_RENDER_TEXT", True)
+    return not full_text, render
+
+
 def _is_blogger(blogger_permission):
     authenticated = current_user.is_authenticated() if \
         callable(current_user.is_authenticated) \
@@ -98,12 +255,14 @@ def _is_blogger(blogger_permission):
     return is_blogger
 
 
-def index(count, page):
+def index(count, page, before=None, after=None):
     """
     Serves the page with a list of blog posts
 
     :param count:
     :param offset:
+    :param before: (Optional) Cursor of the post that follows the page
+    :param after: (Optional) Cursor of the post that precedes the page
     :return:
     """
     blogging_engine = _get_blogging_engine(current_app)
@@ -112,16 +271,14 @@ def index(count, page):
     count = count or config.get("BLOGGING_POSTS_PER_PAGE", 10)
 
     meta = _get_meta(storage, count, page)
-    offset = meta["offset"]
     meta["is_user_blogger"] = _is_blogger(blogging_engine.blogger_permission)
 
-    render = config.get("BLOGGING_RENDER_TEXT", True)
-    posts = storage.get_posts(count=count, offset=offset, include_draft=False,
-                              tag=None, user_id=None, recent=True)
+    summary, render = _get_listing_options(config)
+    posts = _get_page_posts(storage, meta, before=before, after=after,
+                            summary=summary)
     index_posts_fetched.send(blogging_engine.app, engine=blogging_engine,
                              posts=posts, meta=meta, count=count, page=page)
-    for post in posts:
-        blogging_engine.process_post(post, render=render)
+    blogging_engine.process_posts(posts, render=render)
     index_posts_processed.send(blogging_engine.app, engine=blogging_engine,
                                posts=posts, meta=meta, count=count, page=page)
     return render_template("blogging/index.html", posts=posts, meta=meta,
@@ -153,26 +310,24 @@ def page_by_id(post_id, slug):
         return redirect(url_for("blogging.index"))
 
 
-def posts_by_tag(tag, count, page):
+def posts_by_tag(tag, count, page, before=None, after=None):
     blogging_engine = _get_blogging_engine(current_app)
     storage = blogging_engine.storage
     config = blogging_engine.config
     count = count or config.get("BLOGGING_POSTS_PER_PAGE", 10)
     meta = _get_meta(storage, count, page, tag=tag)
-    offset = meta["offset"]
     meta["is_user_blogger"] = _is_blogger(blogging_engine.blogger_permission)
 
-    render = config.get("BLOGGING_RENDER_TEXT", True)
-    posts = storage.get_posts(count=count, offset=offset, tag=tag,
-                              include_draft=False, user_id=None, recent=True)
+    summary, render = _get_listing_options(config)
+    posts = _get_page_posts(storage, meta, before=before, after=after,
+                            tag=tag, summary=summary)
 
     if len(posts):
         posts_by_tag_fetched.send(blogging_engine.app, engine=blogging_engine,
                                   posts=posts, meta=meta, tag=tag, count=count,
                                   page=page)
 
-        for post in posts:
-            blogging_engine.process_post(post, render=render)
+        blogging_engine.process_posts(posts, render=render)
         posts_by_tag_processed.send(blogging_engine.app,
                                     engine=blogging_engine,
                                     posts=posts, meta=meta, tag=tag,
@@ -185,25 +340,23 @@ def posts_by_tag(tag, count, page):
         return redirect(url_for("blogging.index", post_id=None))
 
 
-def posts_by_author(user_id, count, page):
+def posts_by_author(user_id, count, page, before=None, after=None):
     blogging_engine = _get_blogging_engine(current_app)
     storage = blogging_engine.storage
     config = blogging_engine.config
     count = count or config.get("BLOGGING_POSTS_PER_PAGE", 10)
     meta = _get_meta(storage, count, page, user_id=user_id)
-    offset = meta["offset"]
     meta["is_user_blogger"] = _is_blogger(blogging_engine.blogger_permission)
 
-    posts = storage.get_posts(count=count, offset=offset, user_id=user_id,
-                              include_draft=False, tag=None, recent=True)
-    render = config.get("BLOGGING_RENDER_TEXT", True)
+    summary, render = _get_listing_options(config)
+    posts = _get_page_posts(storage, meta, before=before, after=after,
+                            user_id=user_id, summary=summary)
     if len(posts):
         posts_by_author_fetched.send(blogging_engine.app,
                                      engine=blogging_engine, posts=posts,
                                      meta=meta, user_id=user_id, count=count,
                                      page=page)
-        for post in posts:
-            blogging_engine.process_post(post, render=render)
+        blogging_engine.process_posts(posts, render=render)
         posts_by_author_processed.send(blogging_engine.app,
                                        engine=blogging_engine, posts=posts,
                                        meta=meta, user_id=user_id, count=count,
@@ -219,8 +372,6 @@ def posts_by_author(user_id, count, page):
 def editor(post_id):
     blogging_engine = _get_blogging_engine(current_app)
     cache = blogging_engine.cache
-    if cache:
-        _clear_cache(cache)
     try:
         with blogging_engine.blogger_permission.require():
             post_processor = blogging_engine.post_processor
@@ -236,7 +387,14 @@ def editor(post_id):
                         pass
                     else:
                         post = {}
-                    pid = _store_form_data(form, storage, current_user, post)
+                    pid = _store_form_data(form, storage, current_user, post,
+                                           post_processor)
+                    if pid is not None:
+                        _pin_primary(blogging_engine)
+                    if cache and pid is not None:
+                        new_post = dict(tags=form.tags.data.split(","),
+                                        user_id=current_user.get_id())
+                        _invalidate_cache(cache, pid, [post, new_post])
                     editor_post_saved.send(blogging_engine.app,
                                            engine=blogging_engine,
                                            post_id=pid,
@@ -283,8 +441,6 @@ def editor(post_id):
 def delete(post_id):
     blogging_engine = _get_blogging_engine(current_app)
     cache = blogging_engine.cache
-    if cache:
-        _clear_cache(cache)
     try:
         with blogging_engine.blogger_permission.require():
             storage = blogging_engine.storage
@@ -292,7 +448,10 @@ def delete(post_id):
             if (post is not None) and \
                     (PostProcessor.is_author(post, current_user)):
                 success = storage.delete_post(post_id)
+                if cache and success:
+                    _invalidate_cache(cache, post_id, [post])
                 if success:
+                    _pin_primary(blogging_engine)
                     flash("Your post was successfully deleted", "info")
                     post_deleted.send(blogging_engine.app,
                                       engine=blogging_engine,
@@ -310,27 +469,93 @@ def delete(post_id):
         return redirect(url_for("blogging.index", post_id=None))
 
 
+def _get_sitemap_pages(storage, config):
+    max_urls = config.get("BLOGGING_SITEMAP_MAX_URLS", 50000)
+    max_posts = storage.count_posts(include_draft=False)
+    return max_urls, max(1, int(math.ceil(float(max_posts)/max_urls)))
+
+
+def _process_sitemap_posts(blogging_engine, posts):
+    # the sitemap entries only have the post_id, title and last_modified_date
+    post_processor = blogging_engine.post_processor
+    for post in posts:
+        post["slug"] = post_processor.create_slug(post["title"])
+        post["url"] = post_processor.construct_url(post)
+        post["priority"] = 0.8
+
+
+def _stream_sitemap(blogging_engine, count, offset):
+    """
+    Stream the sitemap of ``count`` posts from ``offset``. The posts are read
+    from the storage and the xml is sent in chunks, so that large sitemaps
+    are never held in memory. With a cache, the sitemap is rendered in full
+    instead, so that it is cached rather than read from the storage for
+    every request of the crawlers.
+    """
+    storage = blogging_engine.storage
+    config = blogging_engine.config
+    chunk_size = 1000
+
+    def generate_posts():
+        entries = storage.iter_sitemap_entries(count=count, offset=offset,
+                                               batch_size=chunk_size)
+        while True:
+            posts = list(itertools.islice(entries, chunk_size))
+            if not posts:
+                break
+            sitemap_posts_fetched.send(blogging_engine.app,
+                                       engine=blogging_engine, posts=posts)
+            _process_sitemap_posts(blogging_engine, posts)
+            sitemap_posts_processed.send(blogging_engine.app,
+                                         engine=blogging_engine,
+                                         posts=posts)
+            for post in posts:
+                yield post
+
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_template("blogging/sitemap.xml")
+    context = dict(posts=generate_posts(), config=config)
+    app.update_template_context(context)
+    # the bloggers are not served the cached pages
+    if blogging_engine.cache is not None and \
+            not _is_blogger(blogging_engine.blogger_permission):
+        response = app.response_class(template.render(context))
+    else:
+        sitemap_xml = template.stream(context)
+        sitemap_xml.enable_buffering(chunk_size)
+        response = app.response_class(stream_with_context(sitemap_xml))
+    response.headers["Content-Type"] = "application/xml"
+    return response
+
+
 def sitemap():
     blogging_engine = _get_blogging_engine(current_app)
     storage = blogging_engine.storage
     config = blogging_engine.config
-    posts = storage.get_posts(count=None, offset=None, recent=True,
-                              user_id=None, tag=None, include_draft=False)
-    if len(posts):
-        sitemap_posts_fetched.send(blogging_engine.app, engine=blogging_engine,
-                                   posts=posts)
-        for post in posts:
-            blogging_engine.process_post(post, render=False)
-        sitemap_posts_processed.send(blogging_engine.app,
-                                     engine=blogging_engine,
-                                     posts=posts)
-    sitemap_xml = render_template("blogging/sitemap.xml", posts=posts,
-                                  config=config)
+    max_urls, pages = _get_sitemap_pages(storage, config)
+    if pages == 1:
+        return _stream_sitemap(blogging_engine, count=None, offset=0)
+    # split the sitemap to respect the limit on the urls per sitemap
+    sitemaps = [url_for("blogging.sitemap_page", page=page)
+                for page in range(1, pages + 1)]
+    sitemap_xml = render_template("blogging/sitemap_index.xml",
+                                  sitemaps=sitemaps, config=config)
     response = make_response(sitemap_xml)
     response.headers["Content-Type"] = "application/xml"
     return response
 
 
+def sitemap_page(page):
+    blogging_engine = _get_blogging_engine(current_app)
+    storage = blogging_engine.storage
+    config = blogging_engine.config
+    max_urls, pages = _get_sitemap_pages(storage, config)
+    if page < 1 or page > pages:
+        abort(404)
+    return _stream_sitemap(blogging_engine, count=max_urls,
+                           offset=(page - 1) * max_urls)
+
+
 def feed():
     blogging_engine = _get_blogging_engine(current_app)
     storage = blogging_engine.storage
@@ -347,8 +572,8 @@ def feed():
     if len(posts):
         feed_posts_fetched.send(blogging_engine.app, engine=blogging_engine,
                                 posts=posts)
+        blogging_engine.process_posts(posts, render=True)
         for post in posts:
-            blogging_engine.process_post(post, render=True)
             feed.add(post["title"], ensureUtf(post["rendered_text"]),
                      content_type='html',
                      author=post["user_name"],
@@ -369,7 +594,154 @@ def unless(blogging_engine):
     return _unless
 
 
-def cached_func(blogging_engine, func):
+_refreshing_keys = set()
+_refreshing_lock = threading.Lock()
+_computing_events = {}
+_computing_lock = threading.Lock()
+
+
+def _acquire_lock(cache, cache_key, timeout):
+    """
+    Acquire the lock of ``cache_key`` in the cache shared by the processes.
+
+    :return: The token of the lock if it was acquired, else ``None``
+    """
+    lock_key = _lock_key(cache_key)
+    token = uuid.uuid4().hex
+    # the Flask-Cache ``add`` does not return whether the key was added
+    cache.add(lock_key, token, timeout=timeout)
+    return token if cache.get(lock_key) == token else None
+
+
+def _release_lock(cache, cache_key, token):
+    lock_key = _lock_key(cache_key)
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+def _is_locked(cache, cache_key):
+    return cache.get(_lock_key(cache_key)) is not None
+
+
+def _lock_key(cache_key):
+    return "blogging:lock:%s" % cache_key
+
+
+def _compute_once(cache, cache_key, get_cached, compute, lock_timeout):
+    """
+    Compute the response missing in the cache for ``cache_key`` once, rather
+    than once per concurrent request. The requests of the process wait for
+    the thread that computes the response, and the processes that share the
+    cache wait for the process that holds the lock of the key in the cache.
+    The waiting requests compute the response themselves if the lock is
+    released without a cached response, such as when the view failed, or if
+    the response is not cached after ``lock_timeout`` seconds. The requests
+    do not wait if the cache cannot hold the lock, such as the ``null``
+    cache, or a cache server that is down.
+
+    :param cache: The cache object
+    :param cache_key: The cache key of the response
+    :param get_cached: A function that returns the cached response, or
+     ``None``
+    :param compute: A function that computes and caches the response
+    :param lock_timeout: The number of seconds to wait for the response
+    :return: The response
+    """
+    with _computing_lock:
+        event = _computing_events.get(cache_key)
+        computing = event is None
+        if computing:
+            event = _computing_events[cache_key] = threading.Event()
+    if not computing:
+        event.wait(lock_timeout)
+        rv = get_cached()
+        return rv if rv is not None else compute()
+    try:
+        deadline = time.time() + lock_timeout
+        token = _acquire_lock(cache, cache_key, lock_timeout)
+        while token is None and time.time() < deadline:
+            if not _is_locked(cache, cache_key):
+                # nobody holds the lock, as the cache cannot hold it, or
+                # the lock was released as the response was cached
+                rv = get_cached()
+                return rv if rv is not None else compute()
+            # another process computes the response
+            time.sleep(0.05)
+            rv = get_cached()
+            if rv is not None:
+                return rv
+            # the lock is released without a cached response when the view
+            # failed, so the lock is taken to compute the response here
+            token = _acquire_lock(cache, cache_key, lock_timeout)
+        if token is None:
+            return compute()
+        try:
+            # the response may have been cached before the lock was released
+            rv = get_cached()
+            return rv if rv is not None else compute()
+        finally:
+            _release_lock(cache, cache_key, token)
+    finally:
+        with _computing_lock:
+            del _computing_events[cache_key]
+        event.set()
+
+
+def _refresh_cached_response(cache, cache_key, compute, lock_timeout):
+    """
+    Regenerate the stale cached response in a background thread, unless
+    another thread or process already regenerates it. The response is
+    rendered in a copy of the request context without the cookies, as the
+    anonymous visitors see it.
+    """
+    with _refreshing_lock:
+        if cache_key in _refreshing_keys:
+            return
+        _refreshing_keys.add(cache_key)
+    token = _acquire_lock(cache, cache_key, lock_timeout)
+    if token is None:
+        with _refreshing_lock:
+            _refreshing_keys.discard(cache_key)
+        return
+    app = current_app._get_current_object()
+    environ = dict(request.environ)
+    environ.pop("HTTP_COOKIE", None)
+
+    def refresh():
+        try:
+            with app.request_context(environ):
+                compute()
+        except Exception as e:
+            logging.getLogger("flask-blogging").exception(str(e))
+        finally:
+            _release_lock(cache, cache_key, token)
+            with _refreshing_lock:
+                _refreshing_keys.discard(cache_key)
+
+    thread = threading.Thread(target=refresh)
+    thread.daemon = True
+    thread.start()
+
+
+def cached_func(blogging_engine, func, dependencies):
+    """
+    Cache the responses of the view ``func``. The cache key of a response
+    includes the view arguments and the version tokens of the dependencies
+    of the view, so that ``_invalidate_cache`` can invalidate only the pages
+    affected by a change to a post. On a cache miss, the concurrent requests
+    for the same response wait for a single request to compute it.
+
+    If ``BLOGGING_CACHE_HARD_TIMEOUT`` is longer than
+    ``BLOGGING_CACHE_TIMEOUT``, the responses are kept until the hard
+    timeout, and the stale responses are served while a background thread
+    regenerates them.
+
+    :param blogging_engine: The blogging engine
+    :param func: The view function
+    :param dependencies: A function that returns the list of dependencies
+     for the view keyword arguments
+    :return: The cached view function
+    """
     cache = blogging_engine.cache
     if cache is None:
         return func
@@ -377,41 +749,224 @@ def cached_func(blogging_engine, func):
         unless_func = unless(blogging_engine)
         config = blogging_engine.config
         cache_timeout = config.get("BLOGGING_CACHE_TIMEOUT", 60)  # 60 seconds
-        memoized_func = cache.memoize(
-            timeout=cache_timeout, unless=unless_func)(func)
-        return memoized_func
+        hard_timeout = config.get("BLOGGING_CACHE_HARD_TIMEOUT")
+        stale_while_revalidate = hard_timeout is not None and \
+            hard_timeout > cache_timeout
+        lock_timeout = config.get("BLOGGING_CACHE_LOCK_TIMEOUT", 10)
+        # whether the view returned a streamed response, which is not cached
+        view_state = dict(streamed=False)
+
+        @wraps(func)
+        def cached_view(**kwargs):
+            if unless_func():
+                return func(**kwargs)
+            versions = _get_dependency_versions(cache, dependencies(kwargs))
+            key_data = repr((sorted(kwargs.items()), versions))
+            cache_key = "blogging:view:%s:%s" % (
+                func.__name__,
+                hashlib.sha1(key_data.encode("utf-8")).hexdigest())
+
+            def compute():
+                rv = func(**kwargs)
+                # the streamed responses cannot be cached
+                if getattr(rv, "is_streamed", False):
+                    view_state["streamed"] = True
+                elif stale_while_revalidate:
+                    # cached along with the time the response turns stale
+                    cache.set(cache_key, (rv, time.time() + cache_timeout),
+                              timeout=hard_timeout)
+                else:
+                    cache.set(cache_key, rv, timeout=cache_timeout)
+                return rv
+
+            rv, stale = _get_cached_response(cache_key)
+            if rv is None and view_state["streamed"]:
+                # the requests would wait for a response that is not cached
+                rv = compute()
+            elif rv is None:
+                rv = _compute_once(
+                    cache, cache_key,
+                    lambda: _get_cached_response(cache_key)[0], compute,
+                    lock_timeout)
+            elif stale:
+                # the stale response does not match the validators of the
+                # posts in the storage
+                g.blogging_stale_response = True
+                _refresh_cached_response(cache, cache_key, compute,
+                                         lock_timeout)
+            return rv
+
+        def _get_cached_response(cache_key):
+            # the cached response, and whether it is stale
+            entry = cache.get(cache_key)
+            if entry is None or not stale_while_revalidate:
+                return entry, False
+            rv, fresh_until = entry
+            return rv, fresh_until <= time.time()
+        return cached_view
+
+
+def conditional_func(blogging_engine, func, validators, dependencies=None):
+    """
+    Answer conditional GET requests for the view ``func``. The ``ETag`` of a
+    response is computed from a summary of the posts shown by the view, so
+    ``304 Not Modified`` is returned before any posts are fetched or any
+    templates are rendered.
+
+    The summary is only read from the storage for the requests with an
+    ``If-None-Match`` or ``If-Modified-Since`` header. For the other
+    requests it is cached along with the cached responses, so that the
+    cached responses are served without querying the storage. The stale
+    responses served by ``cached_func`` are sent without validators, as
+    they may not show the posts of the summary.
+
+    :param blogging_engine: The blogging engine
+    :param func: The view function
+    :param validators: A function that returns the keyword arguments of
+     ``Storage.get_last_modified`` for the view keyword arguments
+    :param dependencies: (Optional) A function that returns the list of
+     dependencies of the cached responses of the view, as for
+     ``cached_func``
+    :return: The conditional view function
+    """
+    storage = blogging_engine.storage
+    cache = blogging_engine.cache
+    cache_timeout = blogging_engine.config.get("BLOGGING_CACHE_TIMEOUT", 60)
+
+    def get_summary(kwargs):
+        conditional = "If-None-Match" in request.headers or \
+            "If-Modified-Since" in request.headers
+        if conditional or cache is None or dependencies is None:
+            return storage.get_last_modified(**validators(kwargs))
+        versions = _get_dependency_versions(cache, dependencies(kwargs))
+        key_data = repr((sorted(kwargs.items()), versions))
+        cache_key = "blogging:summary:%s:%s" % (
+            func.__name__, hashlib.sha1(key_data.encode("utf-8")).hexdigest())
+        summary = cache.get(cache_key)
+        if summary is None:
+            summary = storage.get_last_modified(**validators(kwargs))
+            if summary:
+                cache.set(cache_key, summary, timeout=cache_timeout)
+        return summary
+
+    @wraps(func)
+    def conditional_view(**kwargs):
+        # the pending flash messages are part of the page
+        if request.method not in ("GET", "HEAD") or "_flashes" in session:
+            return func(**kwargs)
+        summary = get_summary(kwargs)
+        if not summary or not summary["count"]:
+            return func(**kwargs)
+        last_modified = summary["last_modified_date"] \
+            if "post_id" in kwargs else None
+        etag_data = repr((func.__name__, sorted(kwargs.items()),
+                          str(summary["last_modified_date"]),
+                          summary["max_post_id"], summary["count"],
+                          blogging_engine.post_processor.render_version(),
+                          current_user.get_id(),
+                          _is_blogger(blogging_engine.blogger_permission)))
+        etag = hashlib.sha1(etag_data.encode("utf-8")).hexdigest()
+        if not is_resource_modified(request.environ, etag=etag,
+                                    last_modified=last_modified):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(func(**kwargs))
+            if response.status_code != 200:
+                return response
+            if g.get("blogging_stale_response"):
+                # with a validator of the summary, the clients would keep
+                # the stale response
+                response.vary.add("Cookie")
+                return response
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        # the pages differ for the logged in users
+        response.vary.add("Cookie")
+        return response
+    return conditional_view
+
+
+def _index_dependencies(kwargs):
+    return ["index"]
+
+
+def _post_dependencies(kwargs):
+    return ["post:%s" % kwargs["post_id"]]
+
+
+def _tag_dependencies(kwargs):
+    return ["tag:%s" % Storage.normalize_tags([kwargs["tag"]])[0]]
+
+
+def _author_dependencies(kwargs):
+    return ["author:%s" % kwargs["user_id"]]
+
+
+def _sitemap_dependencies(kwargs):
+    return ["sitemap"]
+
+
+def _feed_dependencies(kwargs):
+    return ["feed"]
 
 
 def create_blueprint(import_name, blogging_engine):
 
     blog_app = Blueprint("blogging", import_name, template_folder='templates')
+    blog_app.before_request(_use_primary)
+    blog_app.before_request(_bind_connection)
+    blog_app.teardown_request(_reset_primary)
+    blog_app.teardown_request(_release_connection)
 
     # register index
-    index_func = cached_func(blogging_engine, index)
+    index_func = conditional_func(
+        blogging_engine,
+        cached_func(blogging_engine, index, _index_dependencies),
+        lambda kwargs: {}, _index_dependencies)
     blog_app.add_url_rule("/", defaults={"count": None, "page": 1},
                           view_func=index_func)
     blog_app.add_url_rule("/<int:count>/", defaults={"page": 1},
                           view_func=index_func)
     blog_app.add_url_rule("/<int:count>/<int:page>/", view_func=index_func)
+    blog_app.add_url_rule("/<int:count>/before/<before>/",
+                          defaults={"page": None}, view_func=index_func)
+    blog_app.add_url_rule("/<int:count>/after/<after>/",
+                          defaults={"page": None}, view_func=index_func)
 
     # register page_by_id
-    page_by_id_func = cached_func(blogging_engine, page_by_id)
+    page_by_id_func = conditional_func(
+        blogging_engine,
+        cached_func(blogging_engine, page_by_id, _post_dependencies),
+        lambda kwargs: dict(post_id=kwargs["post_id"]), _post_dependencies)
     blog_app.add_url_rule("/page/<int:post_id>/", defaults={"slug": ""},
                           view_func=page_by_id_func)
     blog_app.add_url_rule("/page/<int:post_id>/<slug>/",
                           view_func=page_by_id_func)
 
     # register posts_by_tag
-    posts_by_tag_func = cached_func(blogging_engine, posts_by_tag)
+    posts_by_tag_func = conditional_func(
+        blogging_engine,
+        cached_func(blogging_engine, posts_by_tag, _tag_dependencies),
+        lambda kwargs: dict(tag=kwargs["tag"]), _tag_dependencies)
     blog_app.add_url_rule("/tag/<tag>/", defaults=dict(count=None, page=1),
                           view_func=posts_by_tag_func)
     blog_app.add_url_rule("/tag/<tag>/<int:count>/", defaults=dict(page=1),
                           view_func=posts_by_tag_func)
     blog_app.add_url_rule("/tag/<tag>/<int:count>/<int:page>/",
                           view_func=posts_by_tag_func)
+    blog_app.add_url_rule("/tag/<tag>/<int:count>/before/<before>/",
+                          defaults=dict(page=None),
+                          view_func=posts_by_tag_func)
+    blog_app.add_url_rule("/tag/<tag>/<int:count>/after/<after>/",
+                          defaults=dict(page=None),
+                          view_func=posts_by_tag_func)
 
     # register posts_by_author
-    posts_by_author_func = cached_func(blogging_engine, posts_by_author)
+    posts_by_author_func = conditional_func(
+        blogging_engine,
+        cached_func(blogging_engine, posts_by_author, _author_dependencies),
+        lambda kwargs: dict(user_id=kwargs["user_id"]), _author_dependencies)
     blog_app.add_url_rule("/author/<user_id>/",
                           defaults=dict(count=None, page=1),
                           view_func=posts_by_author_func)
@@ -420,6 +975,12 @@ def create_blueprint(import_name, blogging_engine):
                           view_func=posts_by_author_func)
     blog_app.add_url_rule("/author/<user_id>/<int:count>/<int:page>/",
                           view_func=posts_by_author_func)
+    blog_app.add_url_rule("/author/<user_id>/<int:count>/before/<before>/",
+                          defaults=dict(page=None),
+                          view_func=posts_by_author_func)
+    blog_app.add_url_rule("/author/<user_id>/<int:count>/after/<after>/",
+                          defaults=dict(page=None),
+                          view_func=posts_by_author_func)
 
     # register editor
     editor_func = editor  # For now lets not cache this
@@ -435,11 +996,23 @@ def create_blueprint(import_name, blogging_engine):
                           view_func=delete_func)
 
     # register sitemap
-    sitemap_func = cached_func(blogging_engine, sitemap)
+    sitemap_func = conditional_func(
+        blogging_engine,
+        cached_func(blogging_engine, sitemap, _sitemap_dependencies),
+        lambda kwargs: {}, _sitemap_dependencies)
     blog_app.add_url_rule("/sitemap.xml", view_func=sitemap_func)
+    sitemap_page_func = conditional_func(
+        blogging_engine,
+        cached_func(blogging_engine, sitemap_page, _sitemap_dependencies),
+        lambda kwargs: {}, _sitemap_dependencies)
+    blog_app.add_url_rule("/sitemap-<int:page>.xml",
+                          view_func=sitemap_page_func)
 
     # register feed
-    feed_func = cached_func(blogging_engine, feed)
+    feed_func = conditional_func(
+        blogging_engine,
+        cached_func(blogging_engine, feed, _feed_dependencies),
+        lambda kwargs: {}, _feed_dependencies)
     blog_app.add_url_rule('/feeds/all.atom.xml', view_func=feed_func)
 
     return blog_app
@@ -0,0 +1,99 @@
+import unittest
+import tempfile
+import os
+import datetime
+import asyncio
+import sqlalchemy as sqla
+from test import FlaskBloggingTestCase
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from flask_blogging.asyncsqlastorage import AsyncSQLAStorage
+    import aiosqlite
+    HAS_AIOSQLITE = True
+except (ImportError, SyntaxError):
+    HAS_AIOSQLITE = False
+
+
+@unittest.skipUnless(HAS_AIOSQLITE, "Requires SQLAlchemy 1.4 and aiosqlite")
+class TestAsyncSQLiteStorage(FlaskBloggingTestCase):
+
+    def setUp(self):
+        FlaskBloggingTestCase.setUp(self)
+        temp_dir = tempfile.gettempdir()
+        self._dbfile = os.path.join(temp_dir, "async_temp.db")
+        self._engine = create_async_engine(
+            "sqlite+aiosqlite:///" + self._dbfile)
+        self._meta = sqla.MetaData()
+        self._loop = asyncio.new_event_loop()
+        self.storage = AsyncSQLAStorage(self._engine, metadata=self._meta)
+
+    def tearDown(self):
+        self._run(self._engine.dispose())
+        self._loop.close()
+        os.remove(self._dbfile)
+
+    def _run(self, coroutine):
+        return self._loop.run_until_complete(coroutine)
+
+    def _collect(self, iterator):
+        items = []
+        while True:
+            try:
+                items.append(self._run(iterator.__anext__()))
+            except StopAsyncIteration:
+                return items
+
+    def test_save_and_get_post(self):
+        # the tables are created on the first query
+        self.assertEqual(len(self._meta.tables), 0)
+        pid = self._run(self.storage.save_post(
+            title="Title1", text="Sample Text", user_id="testuser",
+            tags=["hello", "world"]))
+        self.assertIn("post", self._meta.tables)
+        post = self._run(self.storage.get_post_by_id(pid))
+        self.assertEqual(post["title"], "Title1")
+        self.assertEqual(set(post["tags"]), set(["HELLO", "WORLD"]))
+        self.assertEqual(post["user_id"], "testuser")
+
+        pid = self._run(self.storage.save_post(
+            title="Title1-Edited", text="Sample Text", user_id="testuser",
+            tags=["hello"], post_id=pid))
+        post = self._run(self.storage.get_post_by_id(pid))
+        self.assertEqual(post["title"], "Title1-Edited")
+        self.assertEqual(self._run(self.storage.count_posts(tag="world")), 0)
+
+        self.assertTrue(self._run(self.storage.delete_post(pid)))
+        self.assertIsNone(self._run(self.storage.get_post_by_id(pid)))
+        self.assertEqual(self._run(self.storage.count_posts()), 0)
+
+    def test_get_posts_and_count(self):
+        post_date = datetime.datetime(2016, 1, 1)
+        posts = [dict(title="Title%d" % i, text="Sample Text%d" % i,
+                      user_id="testuser" if i < 3 else "newuser",
+                      tags=["hello"],
+                      post_date=post_date + datetime.timedelta(minutes=i))
+                 for i in range(5)]
+        self.assertEqual(self._run(self.storage.save_posts(posts,
+                                                           chunk_size=2)), 5)
+        posts, count = self._run(self.storage.get_posts_and_count(
+            count=2, user_id="testuser"))
+        self.assertEqual(count, 3)
+        self.assertEqual([post["title"] for post in posts],
+                         ["Title2", "Title1"])
+        last_modified = self._run(self.storage.get_last_modified(
+            tag="hello"))
+        self.assertEqual(last_modified["count"], 5)
+
+    def test_iter_posts(self):
+        posts = [dict(title="Title%d" % i, text="Sample Text%d" % i,
+                      user_id="testuser", tags=["hello"],
+                      post_date=datetime.datetime(2016, 1, 1, 0, i))
+                 for i in range(7)]
+        self._run(self.storage.save_posts(posts))
+        titles = [post["title"] for post in self._collect(
+            self.storage.iter_posts(batch_size=3, recent=False))]
+        self.assertEqual(titles, ["Title%d" % i for i in range(7)])
+        entries = self._collect(self.storage.iter_sitemap_entries(
+            count=5, offset=1, batch_size=2))
+        self.assertEqual([entry["title"] for entry in entries],
+                         ["Title%d" % i for i in range(1, 6)])
@@ -0,0 +1,132 @@
+import tempfile
+import os
+import sqlalchemy as sqla
+from flask_blogging import CachedStorage
+from flask_blogging.sqlastorage import SQLAStorage
+from test import FlaskBloggingTestCase
+
+
+class TestCachedStorage(FlaskBloggingTestCase):
+
+    def setUp(self):
+        FlaskBloggingTestCase.setUp(self)
+        temp_dir = tempfile.gettempdir()
+        self._dbfile = os.path.join(temp_dir, "cached_temp.db")
+        self._engine = sqla.create_engine("sqlite:///" + self._dbfile)
+        self._meta = sqla.MetaData()
+        self.storage = CachedStorage(SQLAStorage(self._engine,
+                                                 metadata=self._meta))
+        self._meta.create_all(bind=self._engine)
+        self._statements = []
+        sqla.event.listen(self._engine, "before_cursor_execute",
+                          self._count_statements)
+
+    def tearDown(self):
+        sqla.event.remove(self._engine, "before_cursor_execute",
+                          self._count_statements)
+        os.remove(self._dbfile)
+
+    def _count_statements(self, conn, cursor, statement, *args):
+        self._statements.append(statement)
+
+    def _num_statements(self, func):
+        del self._statements[:]
+        func()
+        return len(self._statements)
+
+    def test_cached_reads(self):
+        pid = self.storage.save_post(title="Title1", text="Sample Text",
+                                     user_id="testuser", tags=["hello"])
+        self.storage.get_post_by_id(pid)
+        self.storage.get_posts(tag="hello", summary=True)
+        self.storage.count_posts(tag="hello")
+        self.assertEqual(self._num_statements(
+            lambda: self.storage.get_post_by_id(pid)), 0)
+        self.assertEqual(self._num_statements(
+            lambda: self.storage.get_posts(tag="hello", summary=True)), 0)
+        self.assertEqual(self._num_statements(
+            lambda: self.storage.count_posts(tag="hello")), 0)
+        # the wrapped storage is used for the other attributes
+        self.assertIs(self.storage.engine, self._engine)
+
+        # the cached posts are not changed by the callers
+        post = self.storage.get_post_by_id(pid)
+        post["title"] = "Changed"
+        self.storage.get_posts(tag="hello", summary=True)[0]["tags"].append(
+            "CHANGED")
+        self.assertEqual(self.storage.get_post_by_id(pid)["title"], "Title1")
+        self.assertEqual(self.storage.get_posts(tag="hello",
+                                                summary=True)[0]["tags"],
+                         ["HELLO"])
+
+    def test_invalidation(self):
+        pid1 = self.storage.save_post(title="Title1", text="Sample Text",
+                                      user_id="testuser", tags=["hello"])
+        pid2 = self.storage.save_post(title="Title2", text="Sample Text",
+                                      user_id="newuser", tags=["world"])
+        self.assertEqual(len(self.storage.get_posts()), 2)
+        self.assertEqual(len(self.storage.get_posts(tag="hello")), 1)
+        self.assertEqual(self.storage.count_posts(tag="world"), 1)
+        self.assertEqual(len(self.storage.get_posts(user_id="newuser")), 1)
+
+        # the post moves from the tag world to the tag hello
+        self.storage.save_post(title="Title2-Edited", text="Sample Text",
+                               user_id="testuser", tags=["hello"],
+                               post_id=pid2)
+        self.assertEqual(self.storage.get_post_by_id(pid2)["title"],
+                         "Title2-Edited")
+        self.assertEqual(len(self.storage.get_posts(tag="hello")), 2)
+        self.assertEqual(self.storage.count_posts(tag="world"), 0)
+        self.assertEqual(len(self.storage.get_posts(user_id="newuser")), 0)
+        self.assertEqual(self.storage.get_posts()[0]["title"],
+                         "Title2-Edited")
+        # the listings of the other tags stay cached
+        self.storage.get_posts(tag="unused")
+        self.storage.save_post(title="Title3", text="Sample Text",
+                               user_id="testuser", tags=["hello"])
+        self.assertEqual(self._num_statements(
+            lambda: self.storage.get_posts(tag="unused")), 0)
+
+        self.assertTrue(self.storage.delete_post(pid1))
+        self.assertIsNone(self.storage.get_post_by_id(pid1))
+        self.assertEqual(self.storage.count_posts(tag="hello"), 2)
+        self.assertEqual(len(self.storage.get_posts()), 2)
+
+        self.assertEqual(self.storage.save_posts(
+            [dict(title="Title4", text="Sample Text", user_id="newuser",
+                  tags=["world"])]), 1)
+        self.assertEqual(self.storage.count_posts(tag="world"), 1)
+
+        self.assertTrue(self.storage.update_rendered_text(
+            pid2, "<p>Sample Text</p>", {}, "v1"))
+        self.assertEqual(self.storage.get_post_by_id(pid2)["rendered_text"],
+                         "<p>Sample Text</p>")
+
+    def test_storage_of_earlier_versions(self):
+        class LegacyStorage(SQLAStorage):
+            # the signatures of the storages written for earlier versions
+            def get_posts(self, count=10, offset=0, recent=True, tag=None,
+                          user_id=None, include_draft=False):
+                return SQLAStorage.get_posts(self, count, offset, recent,
+                                             tag, user_id, include_draft)
+
+            def save_post(self, title, text, user_id, tags, draft=False,
+                          post_date=None, last_modified_date=None,
+                          meta_data=None, post_id=None):
+                return SQLAStorage.save_post(
+                    self, title, text, user_id, tags, draft=draft,
+                    post_date=post_date,
+                    last_modified_date=last_modified_date,
+                    meta_data=meta_data, post_id=post_id)
+        storage = CachedStorage(LegacyStorage(self._engine,
+                                              metadata=sqla.MetaData()))
+        self.assertFalse(storage.accepts_argument("get_posts", "summary"))
+        self.assertFalse(storage.accepts_argument("save_post",
+                                                  "rendered_text"))
+        self.assertTrue(self.storage.accepts_argument("get_posts",
+                                                      "summary"))
+        pid = storage.save_post(title="Title1", text="Sample Text",
+                                user_id="testuser", tags=["hello"])
+        self.assertIsNotNone(pid)
+        self.assertEqual(len(storage.get_posts(tag="hello")), 1)
+        self.assertEqual(len(list(storage.iter_posts())), 1)
@@ -3,9 +3,16 @@ try:
 except ImportError:
     pass
 
-from unittest import TestCase
-from flask_blogging import BloggingEngine, PostProcessor
+from unittest import TestCase, skipIf
+from flask_blogging import BloggingEngine, PostProcessor, processor
+from flask_blogging.utils import LRUCache
+import time
+import threading
 from markdown.extensions.codehilite import CodeHiliteExtension
+try:
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = ProcessPoolExecutor = None
 
 
 sample_markdown = """
@@ -40,3 +47,137 @@ class TestCore(TestCase):
         extns = engine.post_processor.all_extensions()
         self.assertEqual(len(extns), 3)
         self.assertTrue(isinstance(extns[-1], CodeHiliteExtension))
+
+    def test_render_version(self):
+        def slugify(value, separator):
+            return value
+        identity = PostProcessor._config_identity(
+            {"slugify": slugify, "title": "Contents", "levels": [1, 2],
+             "marker": object()})
+        self.assertNotIn("0x", identity)
+        self.assertEqual(identity, PostProcessor._config_identity(
+            {"levels": [1, 2], "title": "Contents", "marker": object(),
+             "slugify": slugify}))
+        self.assertIn("'Contents'", identity)
+        self.assertIn("slugify", identity)
+
+    def test_render_cache(self):
+        PostProcessor.set_render_cache(max_entries=10)
+        render_cache = PostProcessor.get_render_cache()
+        post = dict(text="Title: Cached\n\nSample *Text*")
+        PostProcessor.render_text(post)
+        self.assertEqual(render_cache.info()["misses"], 1)
+        self.assertEqual(post["rendered_text"], "<p>Sample <em>Text</em></p>")
+        self.assertEqual(post["meta"], {"title": ["Cached"]})
+
+        post["meta"]["title"].append("Changed")
+        other_post = dict(text=post["text"])
+        PostProcessor.render_text(other_post)
+        self.assertEqual(render_cache.info()["hits"], 1)
+        self.assertEqual(other_post["rendered_text"], post["rendered_text"])
+        self.assertEqual(other_post["meta"], {"title": ["Cached"]})
+
+    def test_create_excerpt(self):
+        text = "First\n\nSecond\n<!--more-->\nThird"
+        self.assertEqual(PostProcessor.create_excerpt(text),
+                         "First\n\nSecond\n")
+        text = "First\n\nSecond\n  \nThird\n\n\nFourth"
+        self.assertEqual(PostProcessor.create_excerpt(text),
+                         "First\n\nSecond")
+        # the meta data header is kept along with the blocks
+        text = "Title: Excerpt\n\nFirst\n\nSecond\n\nThird"
+        self.assertEqual(PostProcessor.create_excerpt(text),
+                         "Title: Excerpt\n\nFirst\n\nSecond")
+        post = dict(text="Title: Excerpt\n\n*First*\n\nSecond\n\nThird")
+        PostProcessor.render_excerpt(post)
+        self.assertEqual(post["excerpt_html"],
+                         "<p><em>First</em></p>\n<p>Second</p>")
+
+    def test_lru_cache(self):
+        cache = LRUCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        # "b" is the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.info(), dict(hits=3, misses=1, entries=2,
+                                            bytes=0))
+
+        cache = LRUCache(max_bytes=10, size_func=len)
+        cache.set("a", "x" * 6)
+        cache.set("b", "x" * 6)
+        self.assertIsNone(cache.get("a"))
+        cache.set("c", "x" * 11)
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.info()["bytes"], 6)
+
+        cache = LRUCache(default_timeout=0.01)
+        cache.set("a", 1)
+        cache.set("b", 2, timeout=60)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), 2)
+
+    @skipIf(ThreadPoolExecutor is None, "Requires concurrent.futures")
+    def test_render_texts(self):
+        for executor_class in (ThreadPoolExecutor, ProcessPoolExecutor):
+            PostProcessor.set_render_cache(max_entries=10)
+            render_cache = PostProcessor.get_render_cache()
+            texts = ["Title: Post%d\n\nText *%d*" % (i, i) for i in range(4)]
+            executor = executor_class(max_workers=2)
+            try:
+                self.assertEqual(PostProcessor.render_texts(
+                    texts + texts[:1], executor), 4)
+            finally:
+                executor.shutdown()
+            # the posts are then rendered from the cache
+            for i, text in enumerate(texts):
+                post = dict(text=text)
+                PostProcessor.render_text(post)
+                self.assertEqual(post["rendered_text"],
+                                 "<p>Text <em>%d</em></p>" % i)
+                self.assertEqual(post["meta"], {"title": ["Post%d" % i]})
+            self.assertEqual(render_cache.info()["hits"], 4)
+        PostProcessor.set_render_cache()
+
+    def test_thread_local_markdown(self):
+        md = PostProcessor.get_markdown()
+        self.assertIs(PostProcessor.get_markdown(), md)
+
+        # the meta data of the previous text is not kept for a blank text
+        PostProcessor.set_render_cache(max_entries=0)
+        post = dict(text="Title: Meta\n\nSample Text")
+        PostProcessor.render_text(post)
+        self.assertEqual(post["meta"], {"title": ["Meta"]})
+        post = dict(text="   ")
+        PostProcessor.render_text(post)
+        self.assertEqual(post["meta"], {})
+        self.assertEqual(processor._render_markdown(
+            "Title: Meta\n\nSample Text", "version",
+            PostProcessor.all_extensions())[1], {"title": ["Meta"]})
+        self.assertEqual(processor._render_markdown(
+            "   ", "version", PostProcessor.all_extensions()), ("", {}))
+
+        PostProcessor.set_render_cache(max_entries=0)
+        results = {}
+
+        def render(i):
+            post = dict(text="Title: Post%d\n\nText %d" % (i, i))
+            PostProcessor.render_text(post)
+            results[i] = (post, PostProcessor.get_markdown())
+
+        threads = [threading.Thread(target=render, args=(i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i in range(4):
+            post, thread_md = results[i]
+            self.assertEqual(post["rendered_text"], "<p>Text %d</p>" % i)
+            self.assertEqual(post["meta"], {"title": ["Post%d" % i]})
+            self.assertIsNot(thread_md, md)
+        PostProcessor.set_render_cache()
@@ -84,6 +84,8 @@ class TestSignals(FlaskBloggingTestCase):
         with self.client:
             response = self.client.get("/blog/sitemap.xml")
             self.assertEqual(response.status_code, 200)
+            # the signals are sent as the sitemap is streamed
+            response.get_data()
             self.assertEqual(self.engine.ctr_sitemap_posts, 2)
 
     def test_feed_signals(self):
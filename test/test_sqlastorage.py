@@ -11,6 +11,7 @@ from test import FlaskBloggingTestCase
 import sqlalchemy as sqla
 from flask_sqlalchemy import SQLAlchemy
 import time
+import datetime
 try:
     import _mysql
     HAS_MYSQL = True
@@ -48,7 +49,9 @@ class TestSQLiteStorage(FlaskBloggingTestCase):
             table = metadata.tables[table_name]
             columns = [t.name for t in table.columns]
             expected_columns = ['id', 'title', 'text', 'post_date',
-                                'last_modified_date', 'draft']
+                                'last_modified_date', 'draft',
+                                'rendered_text', 'meta_data',
+                                'render_version', 'excerpt_html']
             self.assertListEqual(columns, expected_columns)
 
     def test_tag_table_exists(self):
@@ -120,6 +123,55 @@ class TestSQLiteStorage(FlaskBloggingTestCase):
         post = self.storage.get_post_by_id(pid)
         self.assertEqual(len(post["tags"]), 1)
 
+    def test_save_tags_query_count(self):
+        self.storage.count_posts()
+        statements = []
+
+        def count_statements(conn, cursor, statement, *args):
+            statements.append(statement)
+        sqla.event.listen(self._engine, "before_cursor_execute",
+                          count_statements)
+        try:
+            first_pid = self.storage.save_post(
+                title="Title", text="Sample Text", user_id="user",
+                tags=["hello", "world"])
+            num_statements = len(statements)
+            del statements[:]
+            tags = ["tag%d" % i for i in range(20)] + ["hello", "Hello "]
+            pid = self.storage.save_post(title="Title", text="Sample Text",
+                                         user_id="user", tags=tags)
+            # the number of queries should not grow with the number of tags
+            self.assertEqual(len(statements), num_statements)
+
+            del statements[:]
+            self.storage.save_post(title="Title", text="Sample Text",
+                                   user_id="user", post_id=first_pid,
+                                   tags=["world", "first"])
+            num_statements = len(statements)
+            del statements[:]
+            pid = self.storage.save_post(title="Title", text="Sample Text",
+                                         user_id="user", post_id=pid,
+                                         tags=tags[10:] + ["new"])
+            self.assertEqual(len(statements), num_statements)
+        finally:
+            sqla.event.remove(self._engine, "before_cursor_execute",
+                              count_statements)
+        post = self.storage.get_post_by_id(pid)
+        self.assertEqual(sorted(post["tags"]),
+                         sorted(["TAG%d" % i for i in range(10, 20)] +
+                                ["HELLO", "NEW"]))
+
+    def test_insert_existing_tags(self):
+        # a tag inserted by a concurrent writer is ignored
+        self.storage.save_post(title="Title", text="Sample Text",
+                               user_id="user", tags=["hello"])
+        with self._engine.begin() as conn:
+            self.storage._insert_tags(["HELLO", "WORLD"], conn)
+        with self._engine.begin() as conn:
+            tag_ids = self.storage._get_tag_ids(["HELLO", "WORLD"], conn)
+        self.assertEqual(sorted(tag_ids), ["HELLO", "WORLD"])
+        self.assertEqual(tag_ids["HELLO"], 1)
+
     def test_tag_post_uniqueness(self):
         self.storage.save_post(title="Title", text="Sample Text",
                                user_id="user", tags=["tags"])
@@ -171,6 +223,190 @@ class TestSQLiteStorage(FlaskBloggingTestCase):
         p = self.storage.get_post_by_id(2)
         self.assertIsNotNone(p)
 
+    def test_save_posts(self):
+        self.storage.count_posts()
+
+        def posts():
+            for i in range(25):
+                yield dict(title="Title%d" % i, text="Sample Text%d" % i,
+                           user_id="testuser" if i % 2 else "newuser",
+                           tags=["hello", "tag%d" % (i % 3)],
+                           draft=(i == 24),
+                           post_date=datetime.datetime(2016, 1, 1, i % 24))
+
+        saved = self.storage.save_posts(posts(), chunk_size=10)
+        self.assertEqual(saved, 25)
+        for i in range(25):
+            post = self.storage.get_post_by_id(i + 1)
+            self._assert_post(post, "Title%d" % i, "Sample Text%d" % i,
+                              "testuser" if i % 2 else "newuser",
+                              ["HELLO", "TAG%d" % (i % 3)])
+        self.assertEqual(self.storage.count_posts(), 24)
+        self.assertEqual(self.storage.count_posts(tag="hello"), 24)
+        self.assertEqual(self.storage.count_posts(tag="tag0"), 8)
+        self.assertEqual(self.storage.count_posts(user_id="testuser"), 12)
+        self.assertEqual(self.storage.count_posts(user_id="newuser"), 12)
+
+        # a chunk that fails is rolled back
+        bad_posts = [dict(title="Title", text="Sample Text",
+                          user_id="testuser", tags=["world"])] * 3
+        bad_posts.append(dict(text="Sample Text", user_id="testuser"))
+        saved = self.storage.save_posts(bad_posts, chunk_size=2)
+        self.assertEqual(saved, 2)
+        self.assertEqual(self.storage.count_posts(), 26)
+        self.assertEqual(self.storage.count_posts(tag="world"), 2)
+
+    def test_rendered_text(self):
+        pid = self.storage.save_post(title="Title1", text="Sample Text",
+                                     user_id="testuser", tags=["hello"],
+                                     meta_data={"author": ["me"]},
+                                     rendered_text="<p>Sample Text</p>",
+                                     render_version="v1")
+        post = self.storage.get_post_by_id(pid)
+        self.assertEqual(post["rendered_text"], "<p>Sample Text</p>")
+        self.assertEqual(post["meta"], {"author": ["me"]})
+        self.assertEqual(post["render_version"], "v1")
+
+        # an update without the rendered text clears the stale rendering
+        self.storage.save_post(title="Title1", text="New Text",
+                               user_id="testuser", tags=["hello"],
+                               post_id=pid)
+        post = self.storage.get_post_by_id(pid)
+        self.assertIsNone(post["rendered_text"])
+        self.assertIsNone(post["render_version"])
+
+        pid2 = self.storage.save_post(title="Title2", text="Sample Text",
+                                      user_id="testuser", tags=["hello"],
+                                      draft=True,
+                                      rendered_text="<p>Sample Text</p>",
+                                      render_version="v2")
+        stale = self.storage.get_stale_posts("v2")
+        self.assertListEqual([p["post_id"] for p in stale], [pid])
+        stale = self.storage.get_stale_posts("v3")
+        self.assertListEqual([p["post_id"] for p in stale], [pid, pid2])
+
+        self.assertTrue(self.storage.update_rendered_text(
+            pid, "<p>New Text</p>", {}, "v2"))
+        self.assertEqual(self.storage.get_stale_posts("v2"), [])
+        post = self.storage.get_post_by_id(pid)
+        self.assertEqual(post["rendered_text"], "<p>New Text</p>")
+        self.assertEqual(post["meta"], {})
+
+    def test_create_indexes(self):
+        expected = ["ix_post_draft_post_date_id"]
+        inspector = sqla.inspect(self._engine)
+        names = [index["name"] for index in inspector.get_indexes("post")]
+        for name in expected:
+            self.assertIn(name, names)
+        self.assertEqual(self.storage.create_indexes(), [])
+
+        # the tables of an earlier version lack the indexes
+        for index in self.storage.post_table.indexes:
+            if index.name in expected:
+                index.drop(bind=self._engine)
+        storage = SQLAStorage(self._engine, metadata=sqla.MetaData())
+        self.assertListEqual(storage.create_indexes(), expected)
+        self.assertEqual(storage.create_indexes(), [])
+        inspector = sqla.inspect(self._engine)
+        names = [index["name"] for index in inspector.get_indexes("post")]
+        for name in expected:
+            self.assertIn(name, names)
+
+    def test_reflect_own_tables(self):
+        other_table = sqla.Table("other", sqla.MetaData(),
+                                 sqla.Column("id", sqla.Integer,
+                                             primary_key=True))
+        other_table.create(bind=self._engine)
+        metadata = sqla.MetaData()
+        storage = SQLAStorage(self._engine, metadata=metadata)
+        self.assertEqual(set(metadata.tables),
+                         set(["post", "tag", "tag_posts", "user_posts",
+                              "post_counts"]))
+        self.assertEqual(storage.count_posts(), 0)
+        other_table.drop(bind=self._engine)
+
+    def test_lazy_storage(self):
+        metadata = sqla.MetaData()
+        storage = SQLAStorage(self._engine, table_prefix="lazy_",
+                              metadata=metadata, lazy=True)
+        self.assertEqual(len(metadata.tables), 0)
+        # the tables are reflected, and created, on the first query
+        pid = storage.save_post(title="Title", text="Sample Text",
+                                user_id="testuser", tags=["hello"])
+        self.assertIsNotNone(pid)
+        self.assertIn("lazy_post", metadata.tables)
+        self.assertEqual(storage.count_posts(tag="hello"), 1)
+
+        metadata = sqla.MetaData()
+        storage = SQLAStorage(self._engine, table_prefix="lazy_",
+                              metadata=metadata, lazy=True)
+        self.assertEqual(storage.get_post_by_id(pid)["title"], "Title")
+
+    def test_read_engines(self):
+        replica_file = os.path.join(tempfile.gettempdir(), "replica.db")
+        replica = create_engine("sqlite:///" + replica_file)
+        self._meta.create_all(bind=replica)
+        storage = SQLAStorage(self._engine, metadata=sqla.MetaData(),
+                              read_engines=[replica])
+        try:
+            pid = storage.save_post(title="Title", text="Sample Text",
+                                    user_id="testuser", tags=["hello"])
+            # the replica has not seen the write
+            self.assertIsNone(storage.get_post_by_id(pid))
+            self.assertEqual(storage.get_posts(), [])
+            # the post counts are not built on the replica
+            self.assertEqual(storage.count_posts(), 1)
+
+            storage.use_primary()
+            self.assertEqual(storage.get_post_by_id(pid)["title"], "Title")
+            self.assertEqual(len(storage.get_posts()), 1)
+            storage.use_primary(False)
+            self.assertIsNone(storage.get_post_by_id(pid))
+        finally:
+            os.remove(replica_file)
+
+    def test_bind_connection(self):
+        checkouts = []
+
+        def count_checkouts(*args):
+            checkouts.append(1)
+        sqla.event.listen(self._engine, "checkout", count_checkouts)
+        try:
+            self.storage.bind_connection()
+            pid = self.storage.save_post(title="Title", text="Sample Text",
+                                         user_id="testuser", tags=["bound"])
+            self.assertEqual(self.storage.get_post_by_id(pid)["title"],
+                             "Title")
+            self.assertEqual(len(self.storage.get_posts(tag="bound")), 1)
+            self.assertEqual(self.storage.count_posts(tag="bound"), 1)
+            self.assertTrue(self.storage.delete_post(pid))
+            self.storage.release_connection()
+            self.assertEqual(len(checkouts), 1)
+        finally:
+            sqla.event.remove(self._engine, "checkout", count_checkouts)
+        # the writes were committed
+        storage = SQLAStorage(self._engine, metadata=sqla.MetaData())
+        self.assertIsNone(storage.get_post_by_id(pid))
+        self.assertEqual(storage.count_posts(tag="bound"), 0)
+
+    def test_excerpt_html(self):
+        pid = self.storage.save_post(title="Title1", text="Sample Text",
+                                     user_id="testuser", tags=["hello"],
+                                     rendered_text="<p>Sample Text</p>",
+                                     render_version="v1",
+                                     excerpt_html="<p>Sample</p>")
+        post = self.storage.get_post_by_id(pid)
+        self.assertEqual(post["excerpt_html"], "<p>Sample</p>")
+        post = self.storage.get_posts(summary=True)[0]
+        self.assertEqual(post["excerpt_html"], "<p>Sample</p>")
+        self.assertEqual(post["render_version"], "v1")
+
+        self.assertTrue(self.storage.update_rendered_text(
+            pid, "<p>New Text</p>", {}, "v2", excerpt_html="<p>New</p>"))
+        post = self.storage.get_posts(summary=True)[0]
+        self.assertEqual(post["excerpt_html"], "<p>New</p>")
+        self.assertEqual(post["render_version"], "v2")
+
     def test_delete_post(self):
         # insert, check exists, delete, check doesn't exist anymore
         pid = self.storage.save_post(title="Title1", text="Sample Text",
@@ -276,6 +512,143 @@ class TestSQLiteStorage(FlaskBloggingTestCase):
             ctr -= 1
         return
 
+    def test_get_posts_query_count(self):
+        for i in range(15):
+            self.storage.save_post(title="Title%d" % i,
+                                   text="Sample Text%d" % i,
+                                   user_id="testuser", tags=["hello", "world"])
+        statements = []
+
+        def count_statements(conn, cursor, statement, *args):
+            statements.append(statement)
+        sqla.event.listen(self._engine, "before_cursor_execute",
+                          count_statements)
+        try:
+            posts = self.storage.get_posts(count=2)
+            num_statements = len(statements)
+            del statements[:]
+            all_posts = self.storage.get_posts(count=None)
+            # the number of queries should not grow with the page size
+            self.assertEqual(len(statements), num_statements)
+        finally:
+            sqla.event.remove(self._engine, "before_cursor_execute",
+                              count_statements)
+        self.assertEqual(len(posts), 2)
+        self.assertEqual(len(all_posts), 15)
+        for post in all_posts:
+            self._assert_post(post, post["title"], post["text"], "testuser",
+                              ["hello", "world"])
+
+    def test_get_posts_summary(self):
+        self.storage.save_post(title="Title", text="Sample Text",
+                               user_id="testuser", tags=["hello", "world"])
+        statements = []
+
+        def count_statements(conn, cursor, statement, *args):
+            statements.append(statement)
+        sqla.event.listen(self._engine, "before_cursor_execute",
+                          count_statements)
+        try:
+            posts = self.storage.get_posts(summary=True)
+            iter_posts = list(self.storage.iter_posts(summary=True))
+        finally:
+            sqla.event.remove(self._engine, "before_cursor_execute",
+                              count_statements)
+        for post in posts + iter_posts:
+            self.assertEqual(set(post.keys()),
+                             set(["post_id", "title", "post_date",
+                                  "last_modified_date", "draft", "tags",
+                                  "user_id", "excerpt_html",
+                                  "render_version"]))
+            self.assertEqual(post["title"], "Title")
+            self.assertEqual(set(post["tags"]), set(["HELLO", "WORLD"]))
+        # the text columns are not read
+        self.assertTrue(statements)
+        for statement in statements:
+            self.assertNotIn("post.text", statement)
+            self.assertNotIn("post.rendered_text", statement)
+
+    def test_get_posts_cursor(self):
+        post_date = datetime.datetime(2016, 1, 1)
+        for i in range(10):
+            # posts 4 and 5 share the post date
+            minutes = i - 1 if i == 5 else i
+            self.storage.save_post(
+                title="Title%d" % i, text="Sample Text%d" % i,
+                user_id="testuser", tags=["hello"],
+                post_date=post_date + datetime.timedelta(minutes=minutes))
+
+        posts = self.storage.get_posts(count=3)
+        titles = [p["title"] for p in posts]
+        self.assertListEqual(titles, ["Title9", "Title8", "Title7"])
+        seen = list(titles)
+        while posts:
+            cursor = self.storage.encode_cursor(posts[-1])
+            posts = self.storage.get_posts(count=3, after=cursor)
+            seen.extend([p["title"] for p in posts])
+        self.assertListEqual(seen, ["Title%d" % i for i in range(9, -1, -1)])
+
+        posts = self.storage.get_posts(count=3, recent=False)
+        cursor = self.storage.encode_cursor(posts[-1])
+        posts = self.storage.get_posts(count=3, recent=False, after=cursor)
+        titles = [p["title"] for p in posts]
+        self.assertListEqual(titles, ["Title3", "Title4", "Title5"])
+
+        cursor = self.storage.encode_cursor(posts[0])
+        posts = self.storage.get_posts(count=2, recent=False, before=cursor)
+        titles = [p["title"] for p in posts]
+        self.assertListEqual(titles, ["Title1", "Title2"])
+
+        posts = self.storage.get_posts(count=2, tag="hello", before=cursor)
+        titles = [p["title"] for p in posts]
+        self.assertListEqual(titles, ["Title5", "Title4"])
+
+        self.assertEqual(self.storage.get_posts(after="invalid"), [])
+        self.assertRaises(ValueError, self.storage.decode_cursor, "invalid")
+
+    def test_iter_posts(self):
+        self.storage.save_posts(
+            dict(title="Title%d" % i, text="Sample Text%d" % i,
+                 user_id="testuser", tags=["hello" if i < 10 else "world"],
+                 post_date=datetime.datetime(2016, 1, 1, i))
+            for i in range(20))
+
+        def post_ids(posts):
+            return [post["post_id"] for post in posts]
+
+        for kwargs in [dict(count=None), dict(count=None, recent=False),
+                       dict(count=None, tag="hello"),
+                       dict(count=7, user_id="testuser")]:
+            posts = self.storage.get_posts(**kwargs)
+            iter_posts = list(self.storage.iter_posts(batch_size=3,
+                                                      **kwargs))
+            self.assertEqual(post_ids(iter_posts), post_ids(posts))
+        for post in self.storage.iter_posts(tag="world", batch_size=4):
+            self._assert_post(post, post["title"], post["text"], "testuser",
+                              ["world"])
+
+        # the posts are fetched lazily, one batch at a time
+        statements = []
+
+        def count_statements(conn, cursor, statement, *args):
+            statements.append(statement)
+        sqla.event.listen(self._engine, "before_cursor_execute",
+                          count_statements)
+        try:
+            posts = self.storage.iter_posts(batch_size=5)
+            self.assertEqual(len(statements), 0)
+            self.assertEqual(next(posts)["post_id"], 20)
+            num_statements = len(statements)
+            for i in range(4):
+                next(posts)
+            self.assertEqual(len(statements), num_statements)
+            next(posts)
+            self.assertGreater(len(statements), num_statements)
+            posts.close()
+        finally:
+            sqla.event.remove(self._engine, "before_cursor_execute",
+                              count_statements)
+
     def test_count_posts(self):
         self._create_dummy_data()
 
@@ -303,6 +676,177 @@ class TestSQLiteStorage(FlaskBloggingTestCase):
         count = self.storage.count_posts(user_id="testuser", tag="world")
         self.assertEqual(count, 0)
 
+    def test_get_last_modified(self):
+        dates = [datetime.datetime(2016, 1, 1, i) for i in range(4)]
+        for i, date in enumerate(dates):
+            tags = ["hello"] if i < 2 else ["world"]
+            self.storage.save_post(title="Title%d" % i,
+                                   text="Sample Text%d" % i,
+                                   user_id="testuser", tags=tags,
+                                   draft=(i == 3), post_date=date,
+                                   last_modified_date=date)
+
+        summary = self.storage.get_last_modified()
+        self.assertEqual(summary, dict(last_modified_date=dates[2],
+                                       max_post_id=3, count=3))
+        summary = self.storage.get_last_modified(tag="hello")
+        self.assertEqual(summary, dict(last_modified_date=dates[1],
+                                       max_post_id=2, count=2))
+        summary = self.storage.get_last_modified(user_id="newuser")
+        self.assertEqual(summary["count"], 0)
+
+        # a draft is summarised when it is asked for by id
+        summary = self.storage.get_last_modified(post_id=4)
+        self.assertEqual(summary, dict(last_modified_date=dates[3],
+                                       max_post_id=4, count=1))
+
+        # an edit changes the summary
+        self.storage.save_post(title="Title0", text="Edited", tags=["hello"],
+                               user_id="testuser", post_id=1,
+                               post_date=dates[0],
+                               last_modified_date=dates[3])
+        summary = self.storage.get_last_modified(tag="hello")
+        self.assertEqual(summary["last_modified_date"], dates[3])
+
+        # so does a delete
+        self.storage.delete_post(2)
+        summary = self.storage.get_last_modified(tag="hello")
+        self.assertEqual(summary["count"], 1)
+
+        # the summaries of the listings are read from the post_counts table,
+        # which matches the posts once it is rebuilt
+        statements = []
+
+        def count_statements(*args):
+            statements.append(args[2])
+        summaries = [self.storage.get_last_modified(tag="world"),
+                     self.storage.get_last_modified(user_id="testuser")]
+        sqla.event.listen(self._engine, "before_cursor_execute",
+                          count_statements)
+        try:
+            self.assertEqual(self.storage.get_last_modified(),
+                             dict(last_modified_date=dates[3],
+                                  max_post_id=3, count=2))
+        finally:
+            sqla.event.remove(self._engine, "before_cursor_execute",
+                              count_statements)
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("max(", statements[0])
+        self.assertTrue(self.storage.rebuild_post_counts())
+        self.assertEqual(summaries,
+                         [self.storage.get_last_modified(tag="world"),
+                          self.storage.get_last_modified(user_id="testuser")])
+
+    def test_post_counts(self):
+        for i in range(6):
+            tags = ["hello"] if i < 3 else ["hello", "world"]
+            user = "testuser" if i < 3 else "newuser"
+            self.storage.save_post(title="Title%d" % i,
+                                   text="Sample Text%d" % i,
+                                   user_id=user, tags=tags, draft=(i == 5))
+
+        def assert_counts(total, hello, world, testuser, newuser):
+            self.assertEqual(self.storage.count_posts(), total)
+            self.assertEqual(self.storage.count_posts(tag="hello"), hello)
+            self.assertEqual(self.storage.count_posts(tag="world"), world)
+            self.assertEqual(self.storage.count_posts(user_id="testuser"),
+                             testuser)
+            self.assertEqual(self.storage.count_posts(user_id="newuser"),
+                             newuser)
+
+        assert_counts(5, 5, 2, 3, 2)
+        self.assertEqual(self.storage.count_posts(tag="missing"), 0)
+
+        # the counts are read from the post_counts table
+        counts_table = self.storage.post_counts_table
+        with self._engine.begin() as conn:
+            statement = sqla.select([sqla.func.count()]).select_from(
+                counts_table)
+            self.assertEqual(conn.execute(statement).scalar(), 5)
+
+        # edits move the counts of the post
+        self.storage.save_post(title="Title0", text="Sample Text0",
+                               user_id="newuser", tags=["world"], post_id=1)
+        assert_counts(5, 4, 3, 2, 3)
+        self.storage.save_post(title="Title5", text="Sample Text5",
+                               user_id="newuser", tags=["world"], post_id=6)
+        assert_counts(6, 4, 4, 2, 4)
+        self.storage.save_post(title="Title4", text="Sample Text4",
+                               user_id="newuser", tags=["world"], post_id=5,
+                               draft=True)
+        assert_counts(5, 3, 3, 2, 3)
+
+        # deleting a draft does not change the counts
+        self.storage.delete_post(5)
+        assert_counts(5, 3, 3, 2, 3)
+        self.storage.delete_post(6)
+        assert_counts(4, 3, 2, 2, 2)
+
+        # the counts are repaired after the posts are changed directly
+        with self._engine.begin() as conn:
+            conn.execute(self.storage.post_table.update().where(
+                self.storage.post_table.c.id == 2).values(draft=1))
+        assert_counts(4, 3, 2, 2, 2)
+        self.assertTrue(self.storage.rebuild_post_counts())
+        assert_counts(3, 2, 2, 1, 2)
+
+        # the counts are rebuilt when they are missing
+        with self._engine.begin() as conn:
+            conn.execute(counts_table.delete())
+        assert_counts(3, 2, 2, 1, 2)
+
+    def test_concurrent_post_counts(self):
+        self.storage.save_post(title="Title0", text="Sample Text0",
+                               user_id="testuser", tags=["hello"])
+        self.assertEqual(self.storage.count_posts(), 1)
+        insert_or_ignore = self.storage._insert_or_ignore
+
+        def concurrent_insert(table, rows, index_elements, conn):
+            # another writer inserts the count of the new tag first
+            if table is self.storage.post_counts_table:
+                conn.execute(table.insert(), [dict(kind="tag", name="NEW",
+                                                   post_count=2)])
+            return insert_or_ignore(table, rows, index_elements, conn)
+        self.storage._insert_or_ignore = concurrent_insert
+        try:
+            pid = self.storage.save_post(title="Title1", text="Sample Text1",
+                                         user_id="testuser", tags=["new"])
+        finally:
+            del self.storage._insert_or_ignore
+        self.assertIsNotNone(pid)
+        self.assertEqual(self.storage.count_posts(tag="new"), 3)
+        self.assertEqual(self.storage.count_posts(), 2)
+
+    def test_missing_post_counts(self):
+        # the post_counts table was left out, such as by the migrations
+        self.storage.post_counts_table.drop(bind=self._engine)
+        storage = SQLAStorage(self._engine, metadata=sqla.MetaData())
+        storage.save_post(title="Title0", text="Sample Text0",
+                          user_id="testuser", tags=["hello"])
+        statements = []
+
+        def count_statements(*args):
+            statements.append(args[2])
+        sqla.event.listen(self._engine, "before_cursor_execute",
+                          count_statements)
+        try:
+            self.assertEqual(storage.count_posts(), 1)
+            self.assertEqual(storage.count_posts(tag="hello"), 1)
+        finally:
+            sqla.event.remove(self._engine, "before_cursor_execute",
+                              count_statements)
+        # the missing table is not looked up again
+        self.assertEqual(len(statements), 2)
+
+        # but it is when the counts are rebuilt
+        storage.post_counts_table.create(bind=self._engine)
+        self.assertTrue(storage.rebuild_post_counts())
+        self.assertEqual(storage.count_posts(tag="hello"), 1)
+        with self._engine.begin() as conn:
+            statement = sqla.select([sqla.func.count()]).select_from(
+                storage.post_counts_table)
+            self.assertEqual(conn.execute(statement).scalar(), 3)
+
     def _create_dummy_data(self):
         for i in range(20):
             tags = ["hello"] if i < 10 else ["world"]
@@ -377,7 +921,9 @@ class TestSQLiteBinds(FlaskBloggingTestCase):
             table = metadata.tables[table_name]
             columns = [t.name for t in table.columns]
             expected_columns = ['id', 'title', 'text', 'post_date',
-                                'last_modified_date', 'draft']
+                                'last_modified_date', 'draft',
+                                'rendered_text', 'meta_data',
+                                'render_version', 'excerpt_html']
             self.assertListEqual(columns, expected_columns)
 
     def test_tag_table_exists(self):
@@ -3,18 +3,27 @@ try:
 except ImportError:
     pass
 import os
+import unittest
 import tempfile
+import threading
+import time
 from flask import redirect, url_for, current_app
 from flask_login import LoginManager, login_user, logout_user, current_user
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, MetaData, event
 from flask_blogging.sqlastorage import SQLAStorage
-from flask_blogging import BloggingEngine
+from flask_blogging import BloggingEngine, PostProcessor, views
+from flask_blogging.signals import page_by_id_fetched
+from flask_blogging.utils import LRUCache
 from test import FlaskBloggingTestCase, TestUser
 import re
 from flask_principal import identity_changed, Identity, \
     AnonymousIdentity, identity_loaded, RoleNeed, UserNeed
 from flask_cache import Cache
 from .utils import get_random_unicode
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
 
 
 class TestViews(FlaskBloggingTestCase):
@@ -119,6 +128,54 @@ class TestViews(FlaskBloggingTestCase):
                                    follow_redirects=True)
         assert "No posts found for this user!" in str(response.data)
 
+    def test_cursor_pagination(self):
+        pattern = re.compile(b"<h1>.*</h1>(?=\\s*</a>)")
+        with self.client:
+            response = self.client.get("/blog/5/")
+            self.assertEqual(response.status_code, 200)
+            next_url = re.search(b'href="(/blog/5/after/[^"]+)"',
+                                 response.data).group(1)
+            headings = pattern.findall(response.data)
+            while next_url:
+                response = self.client.get(next_url.decode("ascii"))
+                self.assertEqual(response.status_code, 200)
+                headings.extend(pattern.findall(response.data))
+                match = re.search(b'href="(/blog/5/after/[^"]+)"',
+                                  response.data)
+                next_url = match.group(1) if match else None
+            num_posts = self.storage.count_posts()
+            self.assertEqual(len(headings), num_posts)
+            self.assertEqual(len(set(headings)), num_posts)
+
+            prev_url = re.search(b'href="(/blog/5/before/[^"]+)"',
+                                 response.data).group(1)
+            response = self.client.get(prev_url.decode("ascii"))
+            self.assertEqual(response.status_code, 200)
+            self.assertListEqual(pattern.findall(response.data),
+                                 headings[num_posts-10:num_posts-5])
+
+            response = self.client.get("/blog/tag/hello/5/")
+            next_url = re.search(b'href="(/blog/tag/hello/5/after/[^"]+)"',
+                                 response.data).group(1)
+            response = self.client.get(next_url.decode("ascii"))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(pattern.findall(response.data)), 5)
+
+            response = self.client.get("/blog/author/newuser/5/")
+            next_url = re.search(
+                b'href="(/blog/author/newuser/5/after/[^"]+)"',
+                response.data).group(1)
+            response = self.client.get(next_url.decode("ascii"))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(pattern.findall(response.data)), 5)
+
+            # the invalid cursors are not found
+            for url in ["/blog/5/after/garbage/", "/blog/5/before/garbage/",
+                        "/blog/tag/hello/5/after/garbage/",
+                        "/blog/author/newuser/5/before/garbage/"]:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 404)
+
     def test_editor_get(self):
         user_id = "testuser"
         with self.client:
@@ -183,6 +240,195 @@ class TestViews(FlaskBloggingTestCase):
             response = self.client.get("/blog/page/21/")
             self.assertEqual(response.status_code, 200)
 
+            # the post is rendered when saved
+            post = self.storage.get_post_by_id(21)
+            self.assertEqual(post["rendered_text"], "<p>Test Text</p>")
+            self.assertEqual(post["render_version"],
+                             self.engine.post_processor.render_version())
+
+    def test_use_primary_after_write(self):
+        calls = []
+        storage_use_primary = self.storage.use_primary
+
+        def use_primary(primary=True):
+            calls.append(primary)
+            storage_use_primary(primary)
+        self.storage.use_primary = use_primary
+        with self.client:
+            self.client.get("/blog/")
+            self.assertEqual(calls[0], False)
+            self.login("testuser")
+            del calls[:]
+            response = self.client.post("/blog/editor/",
+                                        data=dict(title="Test Title",
+                                                  text="Test Text",
+                                                  tags="tag1, tag2"))
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(calls[-1], True)
+            # the blogger reads from the primary for a while after a write
+            del calls[:]
+            self.client.get("/blog/")
+            # the reads are reset after the previous request
+            self.assertEqual(calls, [False, True])
+
+            with self.client.session_transaction() as sess:
+                sess["blogging_primary_until"] = 0
+            del calls[:]
+            self.client.get("/blog/")
+            self.assertEqual(calls[-1], False)
+
+    def test_request_connection(self):
+        checkouts = []
+
+        def count_checkouts(*args):
+            checkouts.append(1)
+        engine = self.storage.engine
+        self.app.config["BLOGGING_REQUEST_CONNECTION"] = True
+        event.listen(engine, "checkout", count_checkouts)
+        try:
+            response = self.client.get("/blog/")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(checkouts), 1)
+        finally:
+            event.remove(engine, "checkout", count_checkouts)
+
+    def test_user_loader_batch(self):
+        loaded = []
+
+        @self.engine.user_loader_batch
+        def load_users(user_ids):
+            loaded.append(list(user_ids))
+            return dict((user_id, TestUser(user_id)) for user_id in user_ids)
+        response = self.client.get("/blog/20/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(loaded), 1)
+        self.assertEqual(set(loaded[0]), set(["testuser", "newuser"]))
+        response = self.client.get("/blog/feeds/all.atom.xml")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(loaded), 2)
+
+        # the names are cached across the requests
+        self.engine._user_name_cache = LRUCache(default_timeout=60)
+        response = self.client.get("/blog/tag/hello/")
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get("/blog/author/testuser/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(loaded[2:], [["testuser"]])
+
+    def test_storage_of_earlier_versions(self):
+        class LegacyStorage(SQLAStorage):
+            # the signatures of the storages written for earlier versions
+            def get_posts(self, count=10, offset=0, recent=True, tag=None,
+                          user_id=None, include_draft=False):
+                return SQLAStorage.get_posts(self, count, offset, recent,
+                                             tag, user_id, include_draft)
+
+            def save_post(self, title, text, user_id, tags, draft=False,
+                          post_date=None, last_modified_date=None,
+                          meta_data=None, post_id=None):
+                return SQLAStorage.save_post(
+                    self, title, text, user_id, tags, draft=draft,
+                    post_date=post_date,
+                    last_modified_date=last_modified_date,
+                    meta_data=meta_data, post_id=post_id)
+        self.engine.storage = LegacyStorage(self.storage.engine,
+                                            metadata=MetaData())
+        cursor = self.storage.encode_cursor(self.storage.get_post_by_id(1))
+        with self.client:
+            response = self.client.get("/blog/5/")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data.count(b"<h1>"), 5)
+            self.assertNotIn(b"/after/", response.data)
+            response = self.client.get("/blog/5/after/%s/" % cursor)
+            self.assertEqual(response.status_code, 404)
+            response = self.client.get("/blog/tag/hello/")
+            self.assertEqual(response.status_code, 200)
+
+            self.login("testuser")
+            response = self.client.post(
+                "/blog/editor/", data=dict(title="Legacy Title",
+                                           text="Legacy Text", tags="hello"))
+            self.assertEqual(response.status_code, 302)
+            self.logout()
+        post = self.storage.get_posts(count=1)[0]
+        self.assertEqual(post["title"], "Legacy Title")
+        self.assertIsNone(post["rendered_text"])
+
+    def test_user_loader_batch_int_keys(self):
+        class NamedUser(TestUser):
+            def get_name(self):
+                return "User Number %d" % self.id
+        self.storage.save_post(title="Numeric", text="Sample Text",
+                               user_id=7, tags=["numeric"])
+
+        @self.engine.user_loader_batch
+        def load_users(user_ids):
+            # the ids of the users are integers
+            return dict((int(user_id), NamedUser(int(user_id)))
+                        for user_id in user_ids if user_id.isdigit())
+        response = self.client.get("/blog/tag/numeric/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"User Number 7", response.data)
+
+    @unittest.skipIf(ThreadPoolExecutor is None,
+                     "Requires concurrent.futures")
+    def test_render_executor(self):
+        submitted = []
+
+        class Executor(ThreadPoolExecutor):
+            def submit(self, fn, *args, **kwargs):
+                submitted.append(args[0])
+                return ThreadPoolExecutor.submit(self, fn, *args, **kwargs)
+        self.engine.render_executor = Executor(max_workers=2)
+        PostProcessor.set_render_cache()
+        try:
+            response = self.client.get("/blog/feeds/all.atom.xml")
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b"Sample Text19", response.data)
+            # the texts of the stale posts are each rendered once
+            texts = [post["text"] for post in self.storage.get_posts(
+                count=None)]
+            self.assertTrue(set(texts) <= set(submitted))
+            self.assertEqual(len(set(submitted)), len(submitted))
+            self.assertEqual(self.storage.get_stale_posts(
+                self.engine.post_processor.render_version()), [])
+        finally:
+            self.engine.render_executor.shutdown()
+
+    def test_construct_url(self):
+        post_processor = self.engine.post_processor
+        titles = [u"Sample Title", u"Caf\u00e9 {1} 100% /a?b#c", u"  "]
+        with self.app.test_request_context("/", base_url="http://h/root/"):
+            for post_id, title in enumerate(titles, 1):
+                post = dict(post_id=post_id, title=title)
+                self.assertEqual(
+                    post_processor.construct_url(post),
+                    url_for("blogging.page_by_id", post_id=post_id,
+                            slug=post_processor.create_slug(title)))
+            self.assertEqual(post_processor.construct_url(post),
+                             "/root/blog/page/3/")
+            self.assertEqual(post_processor.construct_url(
+                dict(post_id="4", title="Title")),
+                "/root/blog/page/4/title/")
+        with self.app.test_request_context("/"):
+            self.assertEqual(post_processor.construct_url(
+                dict(post_id=1, title="Title")), "/blog/page/1/title/")
+
+    def test_render_stale_posts(self):
+        render_version = self.engine.post_processor.render_version()
+        response = self.client.get("/blog/page/1/")
+        self.assertEqual(response.status_code, 200)
+        # the post is rendered and updated on the first read
+        post = self.storage.get_post_by_id(1)
+        self.assertEqual(post["rendered_text"], "<p>Sample Text0</p>")
+        self.assertEqual(post["render_version"], render_version)
+
+        num_posts = self.storage.count_posts()
+        self.assertEqual(self.engine.render_stale_posts(batch_size=3),
+                         num_posts - 1)
+        self.assertEqual(self.storage.get_stale_posts(render_version), [])
+        self.assertEqual(self.engine.render_stale_posts(), 0)
+
     def test_editor_edit_page(self):
         user_id = "testuser"
         with self.client:
@@ -195,7 +441,7 @@ class TestViews(FlaskBloggingTestCase):
             response = self.client.get("/blog/100/")
             self.assertEqual(response.status_code, 200)
 
-            pattern = re.compile(b"<h1>.*</h1>")
+            pattern = re.compile(b"<h1>.*</h1>(?=\\s*</a>)")
             headings = pattern.findall(response.data)
             self.assertEqual(len(headings), 20)
             self.assertEqual(headings[-1], b"<h1>Sample Title0-Edited</h1>")
@@ -240,17 +486,122 @@ class TestViews(FlaskBloggingTestCase):
             response = self.client.get("/blog/sitemap.xml")
             self.assertEqual(response.status_code, 200)
 
+    def test_sitemap_index(self):
+        self.app.config["BLOGGING_SITEMAP_MAX_URLS"] = 8
+        with self.client:
+            response = self.client.get("/blog/sitemap.xml")
+            self.assertEqual(response.status_code, 200)
+            data = response.get_data(as_text=True)
+            assert "<sitemapindex" in data
+            sitemaps = re.findall("<loc>(.*?)</loc>", data)
+            pages = (self.storage.count_posts() + 7) // 8
+            self.assertEqual(sitemaps, ["/blog/sitemap-%d.xml" % (i + 1)
+                                        for i in range(pages)])
+
+            urls = []
+            for sitemap in sitemaps:
+                response = self.client.get(sitemap)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.headers["Content-Type"],
+                                 "application/xml")
+                urls.extend(re.findall("<loc>(.*?)</loc>",
+                                       response.get_data(as_text=True)))
+            self.assertEqual(len(urls), self.storage.count_posts())
+            self.assertEqual(len(set(urls)), len(urls))
+            self.assertEqual(urls[0], "/blog/page/1/%s/" % self.storage.
+                             get_post_by_id(1)["title"].lower().
+                             replace(" ", "-"))
+
+            response = self.client.get("/blog/sitemap-%d.xml" % (pages + 1))
+            self.assertEqual(response.status_code, 404)
+
     def test_atom(self):
         with self.client:
             # access to editor should be forbidden before login
             response = self.client.get("/blog/feeds/all.atom.xml")
             self.assertEqual(response.status_code, 200)
 
+    def test_conditional_get(self):
+        with self.client:
+            response = self.client.get("/blog/feeds/all.atom.xml")
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers["ETag"]
+
+            response = self.client.get("/blog/feeds/all.atom.xml",
+                                       headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers["ETag"], etag)
+            self.assertEqual(response.data, b"")
+
+            # a new post changes the feed
+            self.storage.save_post(title="Sample Title20",
+                                   text="Sample Text20",
+                                   user_id="newuser", tags=["world"])
+            response = self.client.get("/blog/feeds/all.atom.xml",
+                                       headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers["ETag"], etag)
+
+            # the post page can also be validated by its modification date
+            response = self.client.get("/blog/page/1/")
+            self.assertEqual(response.status_code, 200)
+            last_modified = response.headers["Last-Modified"]
+            response = self.client.get(
+                "/blog/page/1/", headers={"If-Modified-Since": last_modified})
+            self.assertEqual(response.status_code, 304)
+
+            # the pages differ for a logged in blogger
+            response = self.client.get("/blog/tag/hello/")
+            etag = response.headers["ETag"]
+            self.login("testuser")
+            response = self.client.get("/blog/tag/hello/",
+                                       headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+
+    def test_listing_summary(self):
+        fetched = []
+
+        def get_posts(*args, **kwargs):
+            posts = storage_get_posts(*args, **kwargs)
+            fetched.extend(posts)
+            return posts
+        storage_get_posts = self.storage.get_posts
+        self.storage.get_posts = get_posts
+        with self.client:
+            response = self.client.get("/blog/tag/hello/")
+            self.assertEqual(response.status_code, 200)
+            assert b"Sample Title1<" in response.data
+            # the listing pages do not fetch the text of the posts
+            self.assertTrue(fetched)
+            for post in fetched:
+                self.assertNotIn("text", post)
+
+            self.app.config["BLOGGING_LISTING_FULL_TEXT"] = True
+            del fetched[:]
+            response = self.client.get("/blog/tag/hello/5/")
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(fetched)
+            for post in fetched:
+                self.assertIn("rendered_text", post)
+
+    def test_listing_excerpt(self):
+        with self.client:
+            # the excerpts of posts saved without one are rendered and
+            # persisted on the first read
+            response = self.client.get("/blog/tag/hello/")
+            self.assertEqual(response.status_code, 200)
+            assert b"Read more" in response.data
+            for post in self.storage.get_posts(tag="hello", summary=True):
+                self.assertIsNotNone(post["excerpt_html"])
+                self.assertEqual(
+                    post["render_version"],
+                    self.engine.post_processor.render_version())
+
     def test_posts_per_page(self):
         posts_per_page = 5
         self.app.config["BLOGGING_POSTS_PER_PAGE"] = posts_per_page
         with self.client:
-            pattern = re.compile(b"<h1>.*</h1>")
+            pattern = re.compile(b"<h1>.*</h1>(?=\\s*</a>)")
             # index page
             response = self.client.get("/blog/")
             headings = pattern.findall(response.data)
@@ -372,6 +723,197 @@ class TestViewsWithCache(TestViews):
         cache = Cache(self.app, config={"CACHE_TYPE": "simple"})
         return BloggingEngine(self.app, self.storage, cache=cache)
 
+    def test_cache_invalidation(self):
+        user_id = "testuser"
+        with self.client:
+            world_page = self.client.get("/blog/tag/world/").data
+            hello_page = self.client.get("/blog/tag/hello/").data
+            index_page = self.client.get("/blog/").data
+
+            # changes made directly to the storage are not seen
+            self.storage.save_post(title="Sample Title20",
+                                   text="Sample Text20",
+                                   user_id="newuser", tags=["world"])
+            self.assertEqual(self.client.get("/blog/tag/world/").data,
+                             world_page)
+
+            # opening the editor does not invalidate the cache
+            self.login(user_id)
+            self.client.get("/blog/editor/")
+            self.client.get("/blog/editor/1/")
+            self.logout()
+            self.assertEqual(self.client.get("/blog/tag/world/").data,
+                             world_page)
+            self.assertEqual(self.client.get("/blog/").data, index_page)
+
+            # saving a post only invalidates the pages that depend on it
+            self.login(user_id)
+            response = self.client.post(
+                "/blog/editor/1/",
+                data=dict(title="Sample Title0-Edited",
+                          text="Sample Text0-Edited", tags="hello"))
+            self.assertEqual(response.status_code, 302)
+            self.logout()
+            self.assertEqual(self.client.get("/blog/tag/world/").data,
+                             world_page)
+            response = self.client.get("/blog/tag/hello/")
+            self.assertNotEqual(response.data, hello_page)
+            assert b"Sample Title0-Edited" in response.data
+            self.assertNotEqual(self.client.get("/blog/").data, index_page)
+
+            # deleting a post invalidates the pages of its tags
+            self.login(user_id)
+            response = self.client.post("/blog/delete/2/")
+            self.assertEqual(response.status_code, 302)
+            self.logout()
+            self.assertEqual(self.client.get("/blog/tag/world/").data,
+                             world_page)
+            response = self.client.get("/blog/tag/hello/")
+            assert b"Sample Title1<" not in response.data
+
+    def test_cached_pages_without_queries(self):
+        statements = []
+
+        def count_statements(*args):
+            statements.append(args[2])
+        urls = ["/blog/", "/blog/tag/hello/", "/blog/author/testuser/",
+                "/blog/page/1/", "/blog/feeds/all.atom.xml"]
+        etags = [self.client.get(url).headers["ETag"] for url in urls]
+        engine = self.storage.engine
+        event.listen(engine, "before_cursor_execute", count_statements)
+        try:
+            for url, etag in zip(urls, etags):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.headers["ETag"], etag)
+            self.assertEqual(statements, [])
+            # the conditional requests read the summary of the posts
+            response = self.client.get(urls[0],
+                                       headers={"If-None-Match": etags[0]})
+            self.assertEqual(response.status_code, 304)
+            # from the post_counts table
+            self.assertEqual(len(statements), 1)
+            self.assertIn("post_counts", statements[0])
+        finally:
+            event.remove(engine, "before_cursor_execute", count_statements)
+
+    def test_cached_sitemap(self):
+        statements = []
+
+        def count_statements(*args):
+            statements.append(args[2])
+        self.app.config["BLOGGING_SITEMAP_MAX_URLS"] = 8
+        urls = ["/blog/sitemap.xml", "/blog/sitemap-1.xml",
+                "/blog/sitemap-2.xml"]
+        pages = [self.client.get(url).data for url in urls]
+        engine = self.storage.engine
+        event.listen(engine, "before_cursor_execute", count_statements)
+        try:
+            for url, page in zip(urls, pages):
+                self.assertEqual(self.client.get(url).data, page)
+            self.assertEqual(statements, [])
+        finally:
+            event.remove(engine, "before_cursor_execute", count_statements)
+        self.assertEqual(len(re.findall(b"<loc>", pages[1])), 8)
+
+    def test_compute_once(self):
+        fetched = []
+
+        def slow_fetch(sender, **kwargs):
+            fetched.append(kwargs["post_id"])
+            time.sleep(0.2)
+        responses = []
+
+        def get_page():
+            with self.app.test_client() as client:
+                responses.append(client.get("/blog/page/1/sample-title0/"))
+        page_by_id_fetched.connect(slow_fetch)
+        try:
+            threads = [threading.Thread(target=get_page) for i in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            page_by_id_fetched.disconnect(slow_fetch)
+        # the concurrent requests wait for the page of a single request
+        self.assertEqual(fetched, [1])
+        self.assertEqual(set(response.data for response in responses),
+                         set([responses[0].data]))
+
+        # another process holds the lock of the key in the cache
+        cache = self.engine.cache
+        token = views._acquire_lock(cache, "key", 10)
+        self.assertIsNotNone(token)
+        self.assertIsNone(views._acquire_lock(cache, "key", 10))
+        computed = []
+        results = []
+        thread = threading.Thread(target=lambda: results.append(
+            views._compute_once(cache, "key", lambda: cache.get("key"),
+                                lambda: computed.append(1), 10)))
+        thread.start()
+        time.sleep(0.1)
+        cache.set("key", "value")
+        views._release_lock(cache, "key", token)
+        thread.join()
+        self.assertEqual(results, ["value"])
+        self.assertEqual(computed, [])
+
+        # the lock is released without a cached response
+        token = views._acquire_lock(cache, "other", 10)
+        del results[:]
+        thread = threading.Thread(target=lambda: results.append(
+            views._compute_once(cache, "other", lambda: cache.get("other"),
+                                lambda: "computed", 10)))
+        start = time.time()
+        thread.start()
+        time.sleep(0.1)
+        views._release_lock(cache, "other", token)
+        thread.join()
+        self.assertEqual(results, ["computed"])
+        self.assertLess(time.time() - start, 1)
+        self.assertIsNotNone(views._acquire_lock(cache, "other", 10))
+
+    def test_compute_once_without_lock(self):
+        # the null cache cannot hold the lock
+        cache = Cache(self.app, config={"CACHE_TYPE": "null"})
+        self.assertIsNone(views._acquire_lock(cache, "key", 10))
+        start = time.time()
+        rv = views._compute_once(cache, "key", lambda: cache.get("key"),
+                                 lambda: "computed", 10)
+        self.assertEqual(rv, "computed")
+        self.assertLess(time.time() - start, 1)
+
+
+class TestViewsWithStaleCache(TestViews):
+
+    def _create_blogging_engine(self):
+        self.app.config["BLOGGING_CACHE_TIMEOUT"] = 1
+        self.app.config["BLOGGING_CACHE_HARD_TIMEOUT"] = 60
+        cache = Cache(self.app, config={"CACHE_TYPE": "simple"})
+        return BloggingEngine(self.app, self.storage, cache=cache)
+
+    def test_stale_while_revalidate(self):
+        world_page = self.client.get("/blog/tag/world/").data
+        self.storage.save_post(title="Sample Title20", text="Sample Text20",
+                               user_id="newuser", tags=["world"])
+        self.assertEqual(self.client.get("/blog/tag/world/").data,
+                         world_page)
+        time.sleep(1.1)
+        # the stale page is served while it is rendered again, without the
+        # validators of the new post
+        response = self.client.get("/blog/tag/world/")
+        self.assertEqual(response.data, world_page)
+        self.assertNotIn("ETag", response.headers)
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            response = self.client.get("/blog/tag/world/")
+            if response.data != world_page:
+                break
+            time.sleep(0.05)
+        self.assertIn(b"Sample Title20", response.data)
+        self.assertIn("ETag", response.headers)
+
 
 class TestViewsWithUnicode(TestViews):
 